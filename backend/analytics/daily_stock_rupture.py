@@ -1,68 +1,87 @@
+import numpy as np
 import pandas as pd
 import json
+from excel_reader import open_workbook
+from metrics import stage
+from schemas import REPORT_SCHEMAS, compact_series
 
-def generate_combined_stock_ruptures(excel_file):
+def generate_combined_stock_ruptures(excel_file, progress=None):
     """
     Processes the stock list to find stock ruptures (0 quantity) 
     for both 9999 TAN and 8888 BKN, returned in a nested JSON.
+    `progress` is called with the name of each stage as it starts.
     """
     try:
+        if progress: progress("parse")
         # Step 1: Load Data
-        excel_data = pd.ExcelFile(excel_file)
+        excel_data = open_workbook(excel_file)
         sheet_name = "MC" if "MC" in excel_data.sheet_names else excel_data.sheet_names[0]
         
-        # Read the main data (headers on row 4) and the raw data for dates
-        df = pd.read_excel(excel_file, sheet_name=sheet_name, header=3)
-        full_df = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
+        # Read the sheet once: dates on row 3, headers on row 4, data below
+        with stage("read_stock_list") as record:
+            full_df = excel_data.parse(sheet_name=sheet_name, header=None)
+            record["rows_out"] = len(full_df)
         
-        header_row = full_df.iloc[3] # Row 4 containing 'Qté T', 'Qté B'
         date_row = full_df.iloc[2]   # Row 3 containing dates
+        header_row = full_df.iloc[3] # Row 4 containing 'Qté T', 'Qté B'
+        df = full_df.iloc[4:]
+        
+        def column(label):
+            # First column carrying this header, like pandas does for duplicates
+            matches = [i for i, x in enumerate(header_row) if x == label]
+            if not matches:
+                raise KeyError(label)
+            return df.iloc[:, matches[0]]
+
+        # Test, PDR or Other for every row, worked out once per distinct Type
+        types = compact_series(column("Type"), REPORT_SCHEMAS["mc_stock_list"]["Type"])
+        labels = types.cat.categories.astype(str).str.strip()
+        # Blanks have code -1, which picks the trailing "Other"
+        labels = np.append(np.where(labels.isin(["Test", "PDR"]), labels, "Other"), "Other")
+        row_types_all = pd.Series(labels[types.cat.codes.to_numpy()], index=df.index)
         
         def process_site_logic(active_col, consumption_col, qte_label):
             # 1. Filter: Site must be active and have consumption > 0
-            site_df = df.dropna(subset=[active_col]).copy()
-            site_df[consumption_col] = pd.to_numeric(site_df[consumption_col], errors='coerce').fillna(0)
-            site_df = site_df[site_df[consumption_col] > 0]
+            consumption = pd.to_numeric(column(consumption_col), errors='coerce').fillna(0)
+            site_df = df[column(active_col).notna() & (consumption > 0)]
             
             # 2. Identify relevant quantity columns (e.g., all 'Qté T' columns)
             qte_indices = [i for i, x in enumerate(header_row) if str(x).strip() == qte_label]
             
-            site_results = {}
+            # 3. Handle Date: Look at current index or one to the left (merged cells)
+            dated_indices = {}
             for idx in qte_indices:
-                # Check if the column exists and has data
-                current_column_data = site_df.iloc[:, idx]
-                if current_column_data.isna().all():
-                    continue
-                
-                # 3. Handle Date: Look at current index or one to the left (merged cells)
                 raw_date = date_row[idx] if pd.notna(date_row[idx]) else (date_row[idx-1] if idx > 0 else None)
-                if pd.isna(raw_date):
+                if pd.notna(raw_date):
+                    dated_indices[idx] = str(raw_date).split(' ')[0]
+            
+            qty_df = site_df.iloc[:, list(dated_indices)]
+            valid_data_mask = qty_df.notna()
+            
+            # 4. Count ruptures (Qty == 0) per Type for every date column at once
+            stock_out_mask = qty_df.apply(pd.to_numeric, errors='coerce').fillna(0) == 0
+            row_types = row_types_all.loc[site_df.index]
+            counts_df = (stock_out_mask & valid_data_mask).groupby(row_types).sum()
+            
+            site_results = {}
+            for position, (idx, date_key) in enumerate(dated_indices.items()):
+                # Skip columns without any data for this site
+                if not valid_data_mask.iloc[:, position].any():
                     continue
-                    
-                date_key = str(raw_date).split(' ')[0]
-                
-                # 4. Count ruptures (Qty == 0)
-                stock_out_mask = (pd.to_numeric(current_column_data, errors='coerce').fillna(0) == 0)
-                valid_data_mask = current_column_data.notna()
-                
-                rupture_rows = site_df[stock_out_mask & valid_data_mask]
-                
-                counts = {"Test": 0, "PDR": 0, "Other": 0}
-                for _, row in rupture_rows.iterrows():
-                    row_type = str(row["Type"]).strip()
-                    if row_type in counts:
-                        counts[row_type] += 1
-                    else:
-                        counts["Other"] += 1
                 
-                site_results[date_key] = counts
+                column_counts = counts_df.iloc[:, position]
+                site_results[date_key] = {
+                    label: int(column_counts.get(label, 0)) for label in ("Test", "PDR", "Other")
+                }
             return site_results
 
         # Execute for both sites
-        results = {
-            "TAN_9999": process_site_logic("que 9999 Actif", "Tot Cons. TAN", "Qté T"),
-            "BKN_8888": process_site_logic("que 8888 Actif", "Tot Cons. BKN", "Qté B")
-        }
+        if progress: progress("aggregate")
+        with stage("count_ruptures", rows_in=len(df)):
+            results = {
+                "TAN_9999": process_site_logic("que 9999 Actif", "Tot Cons. TAN", "Qté T"),
+                "BKN_8888": process_site_logic("que 8888 Actif", "Tot Cons. BKN", "Qté B")
+            }
 
         return results
 
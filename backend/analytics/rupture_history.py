@@ -0,0 +1,111 @@
+import sqlite3
+import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ruptures (
+    site TEXT NOT NULL,
+    date TEXT NOT NULL,
+    type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (site, date, type)
+);
+"""
+
+SITES = ("TAN_9999", "BKN_8888")
+TYPES = ("Test", "PDR", "Other")
+
+# Rolling aggregates over the recorded dates of a window of days
+AGGREGATES = {"mean": "AVG", "sum": "SUM", "max": "MAX"}
+
+# Date headers of the MC workbook that are not ISO dates
+DATE_FORMATS = ("%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y")
+
+def connect(store_path):
+    con = sqlite3.connect(store_path, timeout=30, isolation_level=None)
+    con.executescript(SCHEMA)
+    return con
+
+def iso_date(date_key):
+    """ISO form of a date key of generate_combined_stock_ruptures, None if unreadable."""
+    try:
+        return datetime.date.fromisoformat(date_key).isoformat()
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_key, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def record_ruptures(store_path, results):
+    """
+    Store the counts of a generate_combined_stock_ruptures result. Only
+    the dates a site has no counts for yet are added, so re-uploading an
+    overlapping workbook leaves the history unchanged.
+    Returns the number of dates added and skipped per site.
+    """
+    recorded_at = datetime.datetime.now().isoformat(timespec="seconds")
+    report = {}
+    con = connect(store_path)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        for site in SITES:
+            known = {row[0] for row in con.execute("SELECT DISTINCT date FROM ruptures WHERE site = ?", (site,))}
+            rows, skipped = [], 0
+            for date_key, counts in results.get(site, {}).items():
+                date = iso_date(date_key)
+                if date is None or date in known:
+                    skipped += 1
+                    continue
+                known.add(date)
+                rows.extend((site, date, label, int(counts.get(label, 0)), recorded_at) for label in TYPES)
+            con.executemany(
+                "INSERT INTO ruptures (site, date, type, count, recorded_at) VALUES (?, ?, ?, ?, ?)", rows,
+            )
+            report[site] = {"added": len(rows) // len(TYPES), "skipped": skipped}
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+    return report
+
+def query_ruptures(store_path, start=None, end=None, sites=SITES, window=None, aggregate="mean"):
+    """
+    Stored counts between `start` and `end` (ISO dates, inclusive), nested
+    like generate_combined_stock_ruptures: {site: {date: {type: count}}}.
+
+    With a `window` of days, "rolling" holds the `aggregate` (mean, sum or
+    max) of each count over the recorded dates of the `window` days up to
+    and including each date; earlier dates outside the range count too.
+    """
+    function = AGGREGATES[aggregate]
+    window_sql = (
+        f", {function}(count) OVER (PARTITION BY site, type ORDER BY julianday(date) "
+        f"RANGE BETWEEN {int(window) - 1} PRECEDING AND CURRENT ROW)" if window else ""
+    )
+    placeholders = ", ".join("?" * len(sites))
+    query = f"""
+        SELECT * FROM (
+            SELECT site, date, type, count{window_sql} FROM ruptures WHERE site IN ({placeholders})
+        ) WHERE date >= ? AND date <= ? ORDER BY site, date
+    """
+    con = connect(store_path)
+    try:
+        rows = con.execute(query, (*sites, start or "0000-00-00", end or "9999-99-99")).fetchall()
+    finally:
+        con.close()
+
+    result = {"ruptures": {site: {} for site in sites}}
+    if window:
+        result.update(rolling={site: {} for site in sites}, window=int(window), aggregate=aggregate)
+    for row in rows:
+        site, date, label, count = row[:4]
+        result["ruptures"][site].setdefault(date, {})[label] = count
+        if window:
+            result["rolling"][site].setdefault(date, {})[label] = round(row[4], 4)
+    return result
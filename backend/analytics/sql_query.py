@@ -0,0 +1,169 @@
+import io
+import os
+import json
+import threading
+from functools import partial
+from decimal import Decimal
+from metrics import stage
+from processors.global_orders import ME2N_COLUMNS, LOTUS_COLUMNS, LOTUS_CSV_COLUMNS, read_me2n, read_lotus
+from processors.mb51 import REQUIRED_COLUMNS as MB51_COLUMNS, load_mb51
+from processors.mb52 import MB52_COLUMNS, load_mb52
+
+# Ad-hoc SQL over uploaded reports, run by an embedded DuckDB. Each uploaded
+# report is a table read the way the processors read it, so its columns and
+# types are the ones they assume; names with spaces are quoted:
+# SELECT "Vendor/supplying plant", ...
+# Results are encoded whole in the worker, since they come back to the app
+# and go into the result cache as bytes; the route then sends them in chunks.
+QUERY_TABLES = {
+    "me2n": {"field": "me2n_file", "read": read_me2n, "columns": ME2N_COLUMNS},
+    # CSV exports have every LOTUS_CSV_COLUMNS column
+    "lotus": {"field": "lotus_file", "read": read_lotus, "columns": LOTUS_COLUMNS, "csv_columns": LOTUS_CSV_COLUMNS},
+    "mb51": {"field": "mb51_file", "read": partial(load_mb51, columns=MB51_COLUMNS), "columns": MB51_COLUMNS},
+    "mb52": {"field": "mb52_file", "read": load_mb52, "columns": MB52_COLUMNS},
+}
+
+# Result encodings: one JSON document, or an Arrow IPC stream (needs pyarrow)
+QUERY_FORMATS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+DEFAULT_ROWS = 1000
+MAX_ROWS = int(os.environ.get("STOCKSYNC_QUERY_MAX_ROWS", 100_000))
+TIMEOUT_SECONDS = int(os.environ.get("STOCKSYNC_QUERY_TIMEOUT", 60))
+BATCH_ROWS = 10_000
+
+def connect(tables):
+    """
+    In-memory DuckDB over the given DataFrames, sandboxed: no file or
+    network access and no extension installs, and the query cannot
+    change those settings back.
+    """
+    import duckdb
+    con = duckdb.connect(config={"autoinstall_known_extensions": False, "autoload_known_extensions": False})
+    for name, df in tables.items():
+        con.register(name, df)
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+    return con
+
+def check_query(sql):
+    """The single SELECT statement of `sql`; ValueError for anything else."""
+    import duckdb
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as e:
+        raise ValueError(str(e))
+    if len(statements) != 1:
+        raise ValueError(f"Expected one SQL statement, got {len(statements)}")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise ValueError("Only SELECT queries are allowed")
+    return statements[0].query
+
+def _json_value(value):
+    # DuckDB sums integers as DECIMAL
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+def fetch_rows(result, limit):
+    """
+    The first `limit` rows of a DuckDB result as tuples, fetched
+    BATCH_ROWS at a time, and whether there were more.
+    """
+    # One row past the limit tells whether the result was cut
+    rows = []
+    while len(rows) <= limit:
+        batch = result.fetchmany(BATCH_ROWS)
+        if not batch:
+            break
+        rows.extend(batch[:limit + 1 - len(rows)])
+    return rows[:limit], len(rows) > limit
+
+def fetch_batches(result, limit):
+    """The first `limit` rows of a DuckDB result as Arrow record batches, the schema and whether there were more."""
+    reader = result.to_arrow_reader(BATCH_ROWS) if hasattr(result, "to_arrow_reader") else result.fetch_record_batch(BATCH_ROWS)
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch.slice(0, limit + 1 - rows))
+        rows += batches[-1].num_rows
+        if rows > limit:
+            break
+    truncated = rows > limit
+    if truncated:
+        batches[-1] = batches[-1].slice(0, batches[-1].num_rows - 1)
+    return reader.schema, batches, truncated
+
+def write_json(columns, rows, truncated):
+    """{"columns", "rows", "row_count", "truncated"} as one document, rows as arrays."""
+    output = io.BytesIO()
+    output.write(b'{"columns": ' + json.dumps(columns).encode() + b', "rows": [')
+    for count, row in enumerate(rows):
+        output.write((b", " if count else b"") + json.dumps(row, default=_json_value).encode())
+    output.write(f'], "row_count": {len(rows)}, "truncated": {json.dumps(truncated)}}}'.encode())
+    return output.getvalue()
+
+def write_arrow(schema, batches, truncated):
+    """Arrow IPC stream as one buffer; a truncated result says so in the schema metadata."""
+    import pyarrow as pa
+    output = io.BytesIO()
+    schema = schema.with_metadata({**(schema.metadata or {}), b"truncated": json.dumps(truncated).encode()})
+    with pa.ipc.new_stream(output, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return output.getvalue()
+
+def run_query(files, sql, limit=None, output_format="json", progress=None):
+    """
+    Run one SELECT over the uploaded reports (`files` maps the form fields
+    of QUERY_TABLES to uploads) and return the encoded result.
+
+    At most `limit` rows (DEFAULT_ROWS by default, MAX_ROWS at most) are
+    returned, `truncated` telling whether there were more. A query running
+    longer than TIMEOUT_SECONDS is interrupted. Invalid queries, limits or
+    formats raise ValueError. Only the arrow format needs pyarrow.
+    """
+    import duckdb
+    if output_format not in QUERY_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {list(QUERY_FORMATS)}")
+    limit = DEFAULT_ROWS if limit is None else limit
+    if not 1 <= limit <= MAX_ROWS:
+        raise ValueError(f"limit must be between 1 and {MAX_ROWS}")
+    sql = check_query(sql)
+
+    if progress: progress("parse")
+    tables = {}
+    for name, table in QUERY_TABLES.items():
+        if files.get(table["field"]) is not None:
+            with stage(f"read_{name}") as record:
+                tables[name] = table["read"](files[table["field"]])
+                record["rows_out"] = len(tables[name])
+
+    if progress: progress("aggregate")
+    con = connect(tables)
+    timer = threading.Timer(TIMEOUT_SECONDS, con.interrupt)
+    timer.start()
+    try:
+        with stage("sql_query") as record:
+            result = con.execute(sql)
+            if output_format == "arrow":
+                schema, batches, truncated = fetch_batches(result, limit)
+                record["rows_out"] = sum(batch.num_rows for batch in batches)
+            else:
+                columns = [{"name": name, "type": str(column_type)} for name, column_type, *_ in result.description]
+                rows, truncated = fetch_rows(result, limit)
+                record["rows_out"] = len(rows)
+    except duckdb.InterruptException:
+        raise ValueError(f"Query exceeded the {TIMEOUT_SECONDS} s time limit")
+    except duckdb.Error as e:
+        raise ValueError(str(e))
+    finally:
+        timer.cancel()
+        con.close()
+
+    if progress: progress("write")
+    with stage("write_query"):
+        if output_format == "arrow":
+            return write_arrow(schema, batches, truncated)
+        return write_json(columns, rows, truncated)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from metrics import stage
+from material_index import material_index, MISSING
+from processors.global_orders import filter_me2n, filter_lotus, sum_global_orders
+from processors.mb52 import load_mb52
+
+# MB52 storage locations counted as stock of each site, as in process_mb52
+STOCK_SITES = {"8888": [1000, 8888], "9999": [9999]}
+
+def coverage_table(orders, stock):
+    """
+    One row per material (indexed by material code) with the stock of each
+    site, the stock on hand, the open quantity and the coverage, worst
+    coverage first.
+    """
+    index = material_index()
+    with stage("coverage_codes", rows_in=len(orders) + len(stock)):
+        order_codes = index.codes(orders["SAP article no"], orders["Product name"])
+        stock_codes = index.codes(stock["Material Number"], stock["Material Description"])
+
+    with stage("coverage_join", rows_in=len(orders) + len(stock)) as record:
+        # Open quantity per material
+        quantity = pd.to_numeric(orders["Quantity"], errors="coerce").fillna(0).to_numpy()
+        has_code = order_codes != MISSING
+        open_quantity = pd.Series(quantity[has_code]).groupby(order_codes[has_code]).sum()
+
+        # Stock per material and site
+        locations = stock["Storage Location"].to_numpy()
+        sites = np.select(
+            [np.isin(locations, site_locations) for site_locations in STOCK_SITES.values()],
+            list(STOCK_SITES), default="",
+        )
+        kept = (sites != "") & (stock_codes != MISSING)
+        per_site = (
+            pd.Series(stock["Unrestricted"].to_numpy()[kept]).groupby([stock_codes[kept], sites[kept]]).sum()
+            .unstack(fill_value=0)
+            .reindex(columns=list(STOCK_SITES), fill_value=0)
+            .add_prefix("stock_")
+        )
+
+        # Materials of either report, MB52 descriptions first
+        table = per_site.join(open_quantity.rename("open_quantity"), how="outer").fillna(0)
+        descriptions = pd.concat([
+            pd.Series(stock["Material Description"].to_numpy()[stock_codes != MISSING], index=stock_codes[stock_codes != MISSING]),
+            pd.Series(orders["Product name"].to_numpy()[has_code], index=order_codes[has_code]),
+        ]).dropna()
+        descriptions = descriptions[~descriptions.index.duplicated()]
+
+        table.insert(0, "material", index.materials(table.index.to_numpy()))
+        table.insert(1, "description", descriptions.reindex(table.index).astype(object).where(lambda d: d.notna(), None).to_numpy())
+        table["stock_on_hand"] = table[[f"stock_{site}" for site in STOCK_SITES]].sum(axis=1)
+        table["coverage"] = table["stock_on_hand"] - table["open_quantity"]
+        table["projected_rupture"] = table["coverage"] < 0
+        table = table.sort_values(["coverage", "material"], kind="stable")
+        record["rows_out"] = len(table)
+    return table
+
+def generate_stock_coverage(me2n_file, lotus_file, mb52_file, progress=None):
+    """
+    Coverage of the open global orders (ME2N + LOTUS) by the MB52 stock,
+    per material, in a nested JSON for the analytics UI. A material is a
+    projected rupture when its open quantity exceeds its stock on hand.
+    `progress` is called with the name of each stage as it starts.
+    """
+    try:
+        if progress: progress("parse")
+        df_me2n = filter_me2n(me2n_file)
+        df_lotus = filter_lotus(lotus_file)
+        if df_me2n is None or df_lotus is None:
+            return {"error": "Could not read the ME2N or LOTUS file"}
+        orders = sum_global_orders(df_lotus, df_me2n)
+        stock = load_mb52(mb52_file)
+
+        if progress: progress("aggregate")
+        table = coverage_table(orders, stock)
+
+        return {
+            "summary": {
+                "materials": len(table),
+                "with_open_orders": int((table["open_quantity"] > 0).sum()),
+                "out_of_stock": int((table["stock_on_hand"] <= 0).sum()),
+                "projected_ruptures": int(table["projected_rupture"].sum()),
+                "stock_on_hand": float(table["stock_on_hand"].sum()),
+                "open_quantity": float(table["open_quantity"].sum()),
+            },
+            "materials": table.to_dict(orient="records"),
+        }
+
+    except Exception as e:
+        return {"error": str(e)}
@@ -1,16 +1,412 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, g, jsonify, make_response, request
 from flask_cors import CORS
+from werkzeug.datastructures import FileStorage
+import os
 import sys
+import time
 import datetime
+import argparse
+import functools
+import importlib.util
 import io
+import zipfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
-from processors.global_orders import process_global_orders
-from processors.mb51 import process_mb51
-from processors.mb52 import process_mb52
-from analytics.daily_stock_rupture import generate_combined_stock_ruptures
+from result_cache import cache_from_env, file_digest
+from datasets import ResultPreview, datasets_from_env, previews_from_env
+from jobs import jobs_from_env
+from workers import pool_from_env
+from metrics import StageMetrics, collect_stages, server_timing
+from output_formats import OUTPUT_FORMATS, FRAMES, missing_requirement
+from storage import data_path
+from uploads import StreamedRequest, uploads_from_env
+
+# Processor modules (and pandas) are only imported by the workers, or on
+# first use, so /health answers as soon as the server is up
 
 app = Flask(__name__)
-CORS(app)
+
+# Uploaded files are streamed to temporary files instead of memory
+upload_store = uploads_from_env()
+StreamedRequest.upload_dir = upload_store.directory
+app.request_class = StreamedRequest
+app.config['MAX_CONTENT_LENGTH'] = upload_store.max_bytes
+# Let the frontend read the optional timing header
+CORS(app, expose_headers=['Server-Timing'])
+
+result_cache = cache_from_env()
+job_manager = jobs_from_env()
+stage_metrics = StageMetrics()
+processor_pool = pool_from_env(stage_metrics)
+dataset_store = datasets_from_env()
+preview_store = previews_from_env()
+mb51_store_path = data_path('mb51_state.sqlite')
+rupture_history_path = data_path('rupture_history.sqlite')
+
+def run_cached(processor, files, params, process):
+    """
+    Return the output bytes of `process()`, reusing the stored result when
+    the same files were already processed with the same parameters.
+    """
+    key = result_cache.make_key(processor, files, params)
+    data = result_cache.get(key)
+    if data is not None:
+        return data
+
+    data = process()
+    if not data: return None
+
+    result_cache.put(key, data)
+    return data
+
+def is_zip_bundle(data):
+    """True for a ZIP of several results; an XLSX is a ZIP package too."""
+    if data[:2] != b'PK':
+        return False
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        return '[Content_Types].xml' not in z.namelist()
+
+# --- Processor outputs ---
+# Each takes the uploaded files and form fields and returns the response
+# payload as {'data', 'mimetype', 'download_name'}, or None on failure.
+# 'output_format' is an optional form field (see OUTPUT_FORMATS).
+
+def global_orders_output(files, form, progress=None):
+    params = {'output_format': form.get('output_format') or 'xlsx'}
+    output_format = OUTPUT_FORMATS[params['output_format']]
+    result = run_cached('global_orders', files, params, lambda: processor_pool.run('global_orders', files, params, progress))
+    if not result: return None
+
+    return {
+        'data': result,
+        'mimetype': output_format['mimetype'],
+        'download_name': f"GlobalOrders-{datetime.datetime.now().strftime('%H%M%S')}.{output_format['extension']}",
+    }
+
+def mb52_output(files, form, progress=None):
+    params = {'output_format': form.get('output_format') or 'xlsx'}
+    # Memory-bounded aggregation: forced on/off, else chosen by file size
+    if form.get('streaming'):
+        params['streaming'] = form.get('streaming') in ('1', 'true')
+    output_format = OUTPUT_FORMATS[params['output_format']]
+    result = run_cached('mb52', files, params, lambda: processor_pool.run('mb52', files, params, progress))
+    if not result: return None
+
+    # Several storage locations come back zipped together
+    is_zip = is_zip_bundle(result)
+
+    return {
+        'data': result,
+        'mimetype': 'application/zip' if is_zip else output_format['mimetype'],
+        'download_name': f"MB52_Result.{'zip' if is_zip else output_format['extension']}",
+    }
+
+def mb51_output(files, form, progress=None):
+    params = {'movement_type': int(form['movement_type']), 'output_format': form.get('output_format') or 'xlsx'}
+    output_format = OUTPUT_FORMATS[params['output_format']]
+    result = run_cached('mb51', files, params, lambda: processor_pool.run('mb51', files, params, progress))
+    if result is None: return None
+
+    return {
+        'data': result,
+        'mimetype': output_format['mimetype'],
+        'download_name': f"MB51-Filtered-{datetime.datetime.now().strftime('%H%M%S')}.{output_format['extension']}",
+    }
+
+def mb51_incremental_output(files, form, progress=None):
+    # Stateful: each upload changes the store, so the result is never cached
+    params = {
+        'movement_type': int(form['movement_type']),
+        'output_format': form.get('output_format') or 'xlsx',
+        'store_path': mb51_store_path,
+    }
+    result = processor_pool.run('mb51_incremental', files, params, progress)
+    if result is None: return None
+
+    # Delta, Consolidated and Resolved are sheets of one XLSX, or zipped files
+    output_format = OUTPUT_FORMATS['xlsx'] if params['output_format'] == 'xlsx' else {'extension': 'zip', 'mimetype': 'application/zip'}
+    return {
+        'data': result,
+        'mimetype': output_format['mimetype'],
+        'download_name': f"MB51-Incremental-{datetime.datetime.now().strftime('%H%M%S')}.{output_format['extension']}",
+    }
+
+def mb52_combined_output(files, form, progress=None):
+    """One MB52 aggregation over several exports; `files` is a list."""
+    params = {'output_format': form.get('output_format') or 'xlsx'}
+    output_format = OUTPUT_FORMATS[params['output_format']]
+    fields = {f'mb52_file_{i}': f for i, f in enumerate(files)}
+    result = run_cached('mb52_combined', fields, params, lambda: processor_pool.run('mb52_combined', fields, params, progress))
+    if not result: return None
+
+    is_zip = is_zip_bundle(result)
+    return {
+        'data': result,
+        'mimetype': 'application/zip' if is_zip else output_format['mimetype'],
+        'download_name': f"MB52_Combined.{'zip' if is_zip else output_format['extension']}",
+    }
+
+def json_output(processor, files, progress=None, on_result=None):
+    """
+    Output of an analytics processor returning JSON-ready data.
+    `on_result` is called with every successful result, cached ones
+    included, so it must be safe to repeat.
+    """
+    key = result_cache.make_key(processor, files)
+    data = result_cache.get(key)
+
+    if data is None:
+        # Any 'raise' inside the processor propagates to the caller
+        json_data = processor_pool.run(processor, files, {}, progress)
+        data = app.json.dumps(json_data).encode()
+
+        # Failures come back as {"error": ...} and must not be cached
+        if 'error' not in json_data:
+            result_cache.put(key, data)
+    elif on_result:
+        # Only successes are cached
+        json_data = app.json.loads(data)
+
+    if on_result and 'error' not in json_data:
+        on_result(json_data)
+
+    return {'data': data, 'mimetype': 'application/json', 'download_name': None}
+
+def record_rupture_history(results):
+    from analytics.rupture_history import record_ruptures
+    try:
+        record_ruptures(rupture_history_path, results)
+    except Exception as e:
+        # The counts are still returned, only the history misses them
+        print(f"Could not record the stock rupture history: {e}")
+
+def stock_ruptures_output(files, form, progress=None):
+    return json_output('stock_ruptures', files, progress, on_result=record_rupture_history)
+
+def stock_coverage_output(files, form, progress=None):
+    return json_output('stock_coverage', files, progress)
+
+# --- Processor previews ---
+# Each takes the same files and form as the output and returns the result
+# as {'frames': {table name: DataFrame}, 'summary'}, kept server-side and
+# read one page at a time; files are only written on export.
+
+def global_orders_preview(files, form, progress=None):
+    return {'frames': processor_pool.run('global_orders', files, {'output_format': FRAMES}, progress)}
+
+def mb52_preview(files, form, progress=None):
+    params = {'output_format': FRAMES}
+    if form.get('streaming'):
+        params['streaming'] = form.get('streaming') in ('1', 'true')
+    # One table per storage location group
+    return {'frames': processor_pool.run('mb52', files, params, progress)}
+
+def mb51_preview(files, form, progress=None):
+    params = {'movement_type': int(form['movement_type']), 'output_format': FRAMES}
+    return {'frames': processor_pool.run('mb51', files, params, progress)}
+
+def analytics_result(output):
+    """The data of an analytics output; its error is raised."""
+    data = app.json.loads(output['data'])
+    if data is None:
+        raise RuntimeError('Processing failed')
+    if 'error' in data:
+        raise ValueError(data['error'])
+    return data
+
+def stock_ruptures_preview(files, form, progress=None):
+    import pandas as pd
+    results = analytics_result(stock_ruptures_output(files, form, progress))
+    rows = [{'site': site, 'date': date, **counts} for site, dates in results.items() for date, counts in dates.items()]
+    return {'frames': {'ruptures': pd.DataFrame(rows, columns=['site', 'date', 'Test', 'PDR', 'Other'])}}
+
+def stock_coverage_preview(files, form, progress=None):
+    import pandas as pd
+    results = analytics_result(stock_coverage_output(files, form, progress))
+    return {'frames': {'materials': pd.DataFrame(results['materials'])}, 'summary': results['summary']}
+
+# 'form' lists the required fields, 'options' the optional ones; 'preview'
+# is left out for processors whose runs change stored state
+PROCESSORS = {
+    'global_orders': {'files': ['me2n_file', 'lotus_file'], 'form': [], 'options': ['output_format'], 'output': global_orders_output, 'preview': global_orders_preview},
+    'mb52': {'files': ['mb52_file'], 'form': [], 'options': ['output_format', 'streaming'], 'output': mb52_output, 'preview': mb52_preview},
+    'mb51': {'files': ['mb51_file'], 'form': ['movement_type'], 'options': ['output_format'], 'output': mb51_output, 'preview': mb51_preview},
+    'mb51_incremental': {'files': ['mb51_file'], 'form': ['movement_type'], 'options': ['output_format'], 'output': mb51_incremental_output},
+    'stock_ruptures': {'files': ['file'], 'form': [], 'options': [], 'output': stock_ruptures_output, 'preview': stock_ruptures_preview},
+    'stock_coverage': {'files': ['me2n_file', 'lotus_file', 'mb52_file'], 'form': [], 'options': [], 'output': stock_coverage_output, 'preview': stock_coverage_preview},
+}
+
+# Largest page a preview returns
+MAX_PREVIEW_PAGE_SIZE = 1000
+
+# Processors the batch endpoint runs once per uploaded file
+BATCH_PROCESSORS = ['mb51', 'mb52', 'stock_ruptures']
+
+def output_format_error(form):
+    """
+    Error response for an unknown output_format field (400), or for one
+    whose writer is not installed (501), else None.
+    """
+    output_format = form.get('output_format') or 'xlsx'
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({'error': f"Unknown output format '{output_format}', expected one of {list(OUTPUT_FORMATS)}"}), 400
+    module = missing_requirement(output_format)
+    if module:
+        return jsonify({'error': f"The '{output_format}' output format needs {module}, which is not installed"}), 501
+    return None
+
+def batch_entries(name, output):
+    """ZIP entries of one output; the files of a ZIP bundle go in a `name` folder."""
+    if output['mimetype'] == 'application/json':
+        return [(f"{name}.json", output['data'])]
+    if output['mimetype'] == 'application/zip':
+        with zipfile.ZipFile(io.BytesIO(output['data'])) as bundle:
+            return [(f"{name}/{entry}", bundle.read(entry)) for entry in bundle.namelist()]
+    return [(f"{name}{os.path.splitext(output['download_name'])[1]}", output['data'])]
+
+def batch_output(processor, files, form, combined=False, max_workers=4):
+    """
+    Run `processor` on every file concurrently and bundle the results in
+    one ZIP, plus the combined MB52 aggregation when asked. Failed files
+    are listed in errors.json and left out of the combined aggregation.
+    None when every file failed.
+    """
+    field = PROCESSORS[processor]['files'][0]
+    output_fn = PROCESSORS[processor]['output']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(files), max_workers))) as executor:
+        futures = [executor.submit(output_fn, {field: f}, form) for f in files]
+
+    entries, errors, processed = [], [], []
+    for i, (f, future) in enumerate(zip(files, futures)):
+        # Numbered so two exports with the same name do not collide
+        name = f"{i + 1:02d}-{os.path.splitext(os.path.basename(f.filename or 'file'))[0]}"
+        try:
+            output = future.result()
+            if output is None:
+                raise RuntimeError('Processing failed')
+            if output['mimetype'] == 'application/json' and 'error' in app.json.loads(output['data']):
+                raise RuntimeError(app.json.loads(output['data'])['error'])
+            entries += batch_entries(name, output)
+            processed.append(f)
+        except Exception as e:
+            errors.append({'file': f.filename, 'error': str(e)})
+
+    # Over the files that processed on their own; reads the same upload
+    # streams, so only once the per-file runs are done
+    if combined and processed:
+        combined_output = mb52_combined_output(processed, form)
+        if combined_output is None:
+            errors.append({'file': 'combined', 'error': 'Processing failed'})
+        else:
+            entries += batch_entries('combined', combined_output)
+
+    if not entries:
+        return None
+    if errors:
+        entries.append(('errors.json', app.json.dumps(errors).encode()))
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, data in entries:
+            bundle.writestr(name, data)
+    return {
+        'data': buffer.getvalue(),
+        'mimetype': 'application/zip',
+        'download_name': f"Batch-{processor}-{datetime.datetime.now().strftime('%H%M%S')}.zip",
+    }
+
+def stream_chunks(data, chunk_size=1024 * 1024):
+    """Yield `data` one chunk at a time."""
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+def send_output(output):
+    if output['mimetype'] == 'application/json':
+        return Response(output['data'], mimetype='application/json'), 200
+
+    # Large XLSX/ZIP results go out in chunks instead of one write
+    return Response(
+        stream_chunks(output['data']),
+        mimetype=output['mimetype'],
+        headers={
+            'Content-Disposition': f"attachment; filename={output['download_name']}",
+            'Content-Length': str(len(output['data'])),
+        },
+        direct_passthrough=True,
+    ), 200
+
+def request_file(name):
+    """
+    The uploaded file `name`, the finished chunked upload whose id is
+    sent as the `<name>_upload` form field, or the parsed dataset whose
+    id is sent as `<name>_dataset`. None if none was sent.
+    """
+    if name in request.files:
+        return request.files[name]
+
+    dataset_id = request.form.get(f'{name}_dataset')
+    if dataset_id:
+        try:
+            return dataset_store.get(dataset_id)
+        except KeyError:
+            raise ValueError(f"Unknown or expired dataset '{dataset_id}'")
+
+    upload_id = request.form.get(f'{name}_upload')
+    if not upload_id:
+        return None
+    try:
+        file = upload_store.open_chunked(upload_id, name)
+    except KeyError:
+        raise ValueError(f"Unknown upload '{upload_id}'")
+    g.setdefault('opened_uploads', []).append(file)
+    return file
+
+@app.teardown_request
+def close_opened_uploads(exc=None):
+    for file in g.pop('opened_uploads', []):
+        file.close()
+
+@app.before_request
+def reject_large_uploads():
+    # Checked up front: inside the routes the error would become a 500
+    if request.content_length and request.content_length > upload_store.max_bytes:
+        return upload_too_large(None)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'Upload exceeds the {upload_store.max_bytes // (1024 * 1024)} MB limit'}), 413
+
+def job_output(output_fn, files, form, releases=(), progress=None):
+    try:
+        output = output_fn(files, form, progress)
+    finally:
+        # Detached uploads are removed once the job is done with them
+        for release in releases:
+            release()
+    if output is None:
+        raise RuntimeError('Processing failed')
+    return output
+
+def timing_requested():
+    """Timing header asked for by the client (X-StockSync-Timing: 1) or always on (STOCKSYNC_SERVER_TIMING=1)."""
+    return request.headers.get('X-StockSync-Timing') == '1' or os.environ.get('STOCKSYNC_SERVER_TIMING') == '1'
+
+def with_server_timing(route):
+    """Add a Server-Timing header with the duration of each pipeline stage when requested."""
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        if not timing_requested():
+            return route(*args, **kwargs)
+
+        started = time.perf_counter()
+        with collect_stages() as records:
+            response = make_response(route(*args, **kwargs))
+        response.headers['Server-Timing'] = server_timing(records, time.perf_counter() - started)
+        return response
+    return wrapper
 
 @app.route('/kys')
 def kys():
@@ -20,93 +416,422 @@ def kys():
 def health():
     return jsonify("OK!")
 
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.report())
+
+@app.route('/uploads', methods=['POST'])
+def create_upload_route():
+    """Start a resumable chunked upload; send 'filename' and the total 'size' in bytes."""
+    body = request.get_json(silent=True) or request.form
+    filename = body.get('filename')
+    if not filename:
+        return jsonify({'error': 'Missing filename'}), 400
+    try:
+        size = int(body['size']) if body.get('size') is not None else None
+        return jsonify(upload_store.create(filename, size)), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status_route(upload_id):
+    try:
+        return jsonify(upload_store.status(upload_id)), 200
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+
+@app.route('/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def upload_chunk_route(upload_id):
+    """
+    Append the request body at the 'Upload-Offset' header. A mismatched
+    offset returns 409 with the offset to resume from.
+    """
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Missing or invalid Upload-Offset header'}), 400
+    try:
+        return jsonify(upload_store.append(upload_id, offset, request.stream)), 200
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), **upload_store.status(upload_id)}), 409
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload_route(upload_id):
+    try:
+        upload_store.delete(upload_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify({'status': 'deleted'}), 200
+
+@app.route('/metrics')
+def metrics_route():
+    return Response(stage_metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/materials')
+def materials_route():
+    from material_index import material_index
+    return jsonify(material_index().report())
+
+@app.route('/materials/<path:material>')
+def material_route(material):
+    """Code and description of a material seen in any report (leading zeros ignored)."""
+    from material_index import material_index
+    entry = material_index().lookup(material)
+    if entry is None:
+        return jsonify({'error': 'Unknown material'}), 404
+    return jsonify(entry), 200
+
+@app.route('/datasets', methods=['POST'])
+def create_dataset_route():
+    """
+    Parse an Excel upload ('file', or a chunked upload id as 'file_upload')
+    once and keep it in memory. The returned id can then be sent as
+    `<field>_dataset` to any processor instead of the file itself.
+    """
+    try:
+        file = request_file('file')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not file or not file.filename:
+        return jsonify({'error': 'Missing file'}), 400
+    if not isinstance(file, FileStorage):
+        return jsonify({'error': 'Already a dataset'}), 400
+    if file.filename.lower().endswith('.csv'):
+        return jsonify({'error': 'Only Excel workbooks can be kept as datasets, send CSV files directly'}), 400
+
+    try:
+        workbook = processor_pool.run('parse_workbook', {'file': file})
+        workbook.digest = file_digest(file)
+        return jsonify(dataset_store.add(workbook)), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Could not parse {file.filename}: {e}'}), 500
+
+@app.route('/datasets', methods=['GET'])
+def datasets_route():
+    return jsonify(dataset_store.report())
+
+@app.route('/datasets/<dataset_id>', methods=['GET'])
+def dataset_status_route(dataset_id):
+    try:
+        return jsonify(dataset_store.status(dataset_id)), 200
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+
+@app.route('/datasets/<dataset_id>', methods=['DELETE'])
+def delete_dataset_route(dataset_id):
+    try:
+        dataset_store.delete(dataset_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired dataset'}), 404
+    return jsonify({'status': 'deleted'}), 200
+
+@app.route('/jobs/<processor>', methods=['POST'])
+def submit_job_route(processor):
+    spec = PROCESSORS.get(processor)
+    if spec is None:
+        return jsonify({'error': f'Unknown processor: {processor}'}), 404
+
+    try:
+        files = {name: request_file(name) for name in spec['files']}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    form = {name: request.form.get(name) for name in spec['form']}
+    if not all(files.values()) or not all(form.values()):
+        return jsonify({'error': 'Missing required files or fields'}), 400
+
+    form.update({name: request.form[name] for name in spec['options'] if request.form.get(name)})
+    if output_format_error(form):
+        return output_format_error(form)
+
+    # The request's file streams are closed once it returns; parsed
+    # datasets stay in the dataset store
+    detached = {
+        name: upload_store.detach(f) if isinstance(f, FileStorage) else (f, lambda: None)
+        for name, f in files.items()
+    }
+    files = {name: file for name, (file, _) in detached.items()}
+    releases = [release for _, release in detached.values()]
+    job_id = job_manager.submit(processor, job_output, spec['output'], files, form, releases)
+
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+
+@app.route('/previews/<processor>', methods=['POST'])
+@with_server_timing
+def create_preview_route(processor):
+    """
+    Run a processor with the same files and fields as its endpoint and
+    keep the result frames for paging (GET /previews/<id>/rows) instead
+    of writing a file; GET /previews/<id>/export writes it on demand.
+    """
+    spec = PROCESSORS.get(processor)
+    if spec is None or 'preview' not in spec:
+        return jsonify({'error': f'Preview is not available for: {processor}'}), 404
+
+    try:
+        files = {name: request_file(name) for name in spec['files']}
+        form = {name: request.form.get(name) for name in spec['form']}
+        if not all(files.values()) or not all(form.values()):
+            return jsonify({'error': 'Missing required files or fields'}), 400
+        form.update({name: request.form[name] for name in spec['options'] if request.form.get(name)})
+
+        result = spec['preview'](files, form)
+        if not result['frames']:
+            return jsonify({'error': 'Processing failed'}), 500
+        return jsonify(preview_store.add(ResultPreview(processor, result['frames'], result.get('summary')))), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/previews/<preview_id>', methods=['GET'])
+def preview_status_route(preview_id):
+    """Tables (row counts, columns and types) of a preview."""
+    try:
+        return jsonify(preview_store.status(preview_id)), 200
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired preview'}), 404
+
+@app.route('/previews/<preview_id>/rows', methods=['GET'])
+def preview_rows_route(preview_id):
+    """
+    One page of a preview table: 'table' (default the first), 'page' from
+    1, 'page_size', 'sort' column with 'descending=1', 'search' over every
+    column and repeatable 'filter=<column>:<text>', both case-insensitive.
+    """
+    try:
+        preview = preview_store.get(preview_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired preview'}), 404
+
+    table = request.args.get('table') or next(iter(preview.frames))
+    if table not in preview.frames:
+        return jsonify({'error': f"Unknown table '{table}', expected one of {list(preview.frames)}"}), 400
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 100))
+    except ValueError:
+        return jsonify({'error': 'page and page_size must be numbers'}), 400
+    if page < 1 or not 1 <= page_size <= MAX_PREVIEW_PAGE_SIZE:
+        return jsonify({'error': f'page must be positive and page_size between 1 and {MAX_PREVIEW_PAGE_SIZE}'}), 400
+
+    filters = []
+    for value in request.args.getlist('filter'):
+        column, separator, text = value.partition(':')
+        if not separator:
+            return jsonify({'error': f"Invalid filter '{value}', expected <column>:<text>"}), 400
+        filters.append((column, text))
+
+    try:
+        return jsonify(preview.page(
+            table, page, page_size,
+            sort=request.args.get('sort') or None,
+            descending=request.args.get('descending') in ('1', 'true'),
+            search=request.args.get('search') or None,
+            filters=filters,
+        )), 200
+    except KeyError as e:
+        return jsonify({'error': f"Unknown column {e}"}), 400
+
+@app.route('/previews/<preview_id>/export', methods=['GET'])
+def export_preview_route(preview_id):
+    """The whole result as the processor writes it, in 'output_format' (xlsx by default)."""
+    try:
+        preview = preview_store.get(preview_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired preview'}), 404
+    if output_format_error(request.args):
+        return output_format_error(request.args)
+
+    output_format = request.args.get('output_format') or 'xlsx'
+    data = preview.exports.get(output_format)
+    if data is None:
+        params = {'processor': preview.processor, 'frames': preview.frames, 'output_format': output_format}
+        try:
+            data = processor_pool.run('write_preview', {}, params)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        data = preview.keep_export(output_format, data)
+        # The export counts against the preview store like the frames
+        preview_store.resized(preview_id)
+
+    is_zip = is_zip_bundle(data)
+    extension = 'zip' if is_zip else OUTPUT_FORMATS[output_format]['extension']
+    return send_output({
+        'data': data,
+        'mimetype': 'application/zip' if is_zip else OUTPUT_FORMATS[output_format]['mimetype'],
+        'download_name': f"{preview.processor}-{datetime.datetime.now().strftime('%H%M%S')}.{extension}",
+    })
+
+@app.route('/previews/<preview_id>', methods=['DELETE'])
+def delete_preview_route(preview_id):
+    try:
+        preview_store.delete(preview_id)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired preview'}), 404
+    return jsonify({'status': 'deleted'}), 200
+
+@app.route('/batch/<processor>', methods=['POST'])
+@with_server_timing
+def batch_route(processor):
+    """
+    Process every file sent under the processor's file field (repeated
+    fields, or repeated `<field>_upload` ids) and return one ZIP. MB52
+    accepts combined=1 to add the aggregation over all files.
+    """
+    if processor not in BATCH_PROCESSORS:
+        return jsonify({'error': f'Batch processing is not available for: {processor}'}), 404
+
+    spec = PROCESSORS[processor]
+    field = spec['files'][0]
+    try:
+        files = [f for f in request.files.getlist(field) if f]
+        for upload_id in request.form.getlist(f'{field}_upload'):
+            files.append(upload_store.open_chunked(upload_id, field))
+            g.setdefault('opened_uploads', []).append(files[-1])
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'Invalid upload: {e}'}), 400
+
+    form = {name: request.form.get(name) for name in spec['form']}
+    if not files or not all(form.values()):
+        return jsonify({'error': 'Missing required files or fields'}), 400
+    form.update({name: request.form[name] for name in spec['options'] if request.form.get(name)})
+    if output_format_error(form):
+        return output_format_error(form)
+
+    combined = processor == 'mb52' and request.form.get('combined') in ('1', 'true')
+    try:
+        output = batch_output(processor, files, form, combined, max_workers=max(processor_pool.max_workers, 1))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if output is None:
+        return jsonify({'error': 'Processing failed for every file'}), 500
+    return send_output(output)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result_route(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if status['status'] == 'failed':
+        return jsonify({'error': status['error'], 'status': 'failed'}), 500
+    if status['status'] != 'done':
+        return jsonify({'error': 'Job not finished', 'status': status['status']}), 409
+
+    return send_output(job_manager.output(job_id))
+
 @app.route('/processors/global_orders', methods=['POST'])
+@with_server_timing
 def process_global_orders_route():
     try:
-        me2n_file = request.files.get('me2n_file')
-        lotus_file = request.files.get('lotus_file')
+        me2n_file = request_file('me2n_file')
+        lotus_file = request_file('lotus_file')
         
         if not me2n_file or not lotus_file:
             return jsonify({'error': 'Missing required files'}), 400
+        if output_format_error(request.form):
+            return output_format_error(request.form)
         
-        result_buffer = process_global_orders(me2n_file, lotus_file)
-        if not result_buffer: return jsonify({'error': 'Processing failed'}), 500
+        output = global_orders_output({'me2n_file': me2n_file, 'lotus_file': lotus_file}, request.form)
+        if not output: return jsonify({'error': 'Processing failed'}), 500
             
-        return send_file(
-            result_buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True, 
-            download_name=f"GlobalOrders-{datetime.datetime.now().strftime('%H%M%S')}.xlsx",
-        ), 200
+        return send_output(output)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/processors/mb52', methods=['POST'])
+@with_server_timing
 def process_mb52_route():
     try:
-        mb52_file = request.files.get('mb52_file')
+        mb52_file = request_file('mb52_file')
         if not mb52_file: return jsonify({'error': 'Missing file'}), 400
+        if output_format_error(request.form):
+            return output_format_error(request.form)
         
-        result_buffer = process_mb52(mb52_file)
-        if not result_buffer: return jsonify({'error': 'Processing failed'}), 500
-        
-        # Logic to check if it's a zip or excel
-        result_buffer.seek(0)
-        is_zip = result_buffer.read(2) == b'PK'
-        result_buffer.seek(0)
-
-        mimetype = 'application/zip' if is_zip else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        ext = 'zip' if is_zip else 'xlsx'
+        output = mb52_output({'mb52_file': mb52_file}, request.form)
+        if not output: return jsonify({'error': 'Processing failed'}), 500
         
-        return send_file(
-            result_buffer,
-            as_attachment=True,
-            download_name=f"MB52_Result.{ext}",
-            mimetype=mimetype
-        ), 200
+        return send_output(output)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/processors/mb51', methods=['POST'])
+@with_server_timing
 def process_mb51_route():
     try:
-        mb51_file = request.files.get('mb51_file')
+        mb51_file = request_file('mb51_file')
         movement_type = request.form.get('movement_type')
 
         if not mb51_file or not movement_type:
             return jsonify({'error': 'Missing file or movement type'}), 400
+        if output_format_error(request.form):
+            return output_format_error(request.form)
             
-        # Process directly in memory
-        result_buffer = process_mb51(mb51_file, int(movement_type))
+        # Workers read the upload straight from its temporary file
+        output = mb51_output({'mb51_file': mb51_file}, request.form)
         
-        if result_buffer is None:
+        if output is None:
             return jsonify({'error': 'Processing failed'}), 500
         
-        return send_file(
-            result_buffer,
-            as_attachment=True, 
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            download_name=f"MB51-Filtered-{datetime.datetime.now().strftime('%H%M%S')}.xlsx",
-        ), 200
+        return send_output(output)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/processors/mb51_incremental', methods=['POST'])
+@with_server_timing
+def process_mb51_incremental_route():
+    try:
+        mb51_file = request_file('mb51_file')
+        movement_type = request.form.get('movement_type')
+
+        if not mb51_file or not movement_type:
+            return jsonify({'error': 'Missing file or movement type'}), 400
+        if output_format_error(request.form):
+            return output_format_error(request.form)
+
+        output = mb51_incremental_output({'mb51_file': mb51_file}, request.form)
+        if output is None:
+            return jsonify({'error': 'Processing failed'}), 500
+
+        return send_output(output)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/processors/mb51_incremental/reset', methods=['POST'])
+def reset_mb51_incremental_route():
+    movement_type = request.form.get('movement_type')
+    if not movement_type:
+        return jsonify({'error': 'Missing movement type'}), 400
+
+    from processors.mb51_incremental import reset_mb51_state
+    reset_mb51_state(mb51_store_path, int(movement_type))
+    return jsonify({'status': 'reset', 'movement_type': int(movement_type)}), 200
+
 @app.route('/processors/stock_ruptures', methods=['POST'])
+@with_server_timing
 def stock_ruptures_route():
     try:
         # Check if file exists in request
-        if 'file' not in request.files:
+        file = request_file('file')
+        if file is None:
             return jsonify({'error': 'No file part in the request (Expected key: "file")'}), 400
             
-        file = request.files['file']
         if file.filename == '':
             return jsonify({'error': 'The selected file is empty.'}), 400
         
         # Call the processor
         # Any 'raise' inside generate_stock_ruptures will jump straight to the 'except' block below
-        json_data = generate_combined_stock_ruptures(file)
-        
-        return jsonify(json_data), 200
+        return send_output(stock_ruptures_output({'file': file}, {}))
 
     except Exception as e:
         # We capture the message from the raised exception 'e'
@@ -119,5 +844,125 @@ def stock_ruptures_route():
             'status': 'failed'
         }), 500
 
+@app.route('/processors/stock_ruptures/history', methods=['GET'])
+def stock_rupture_history_route():
+    """
+    Stored rupture counts: optional 'start'/'end' ISO dates, 'site'
+    (repeatable), and a rolling 'window' in days with its 'aggregate'.
+    """
+    from analytics.rupture_history import SITES, AGGREGATES, iso_date, query_ruptures
+
+    start, end = request.args.get('start'), request.args.get('end')
+    for value in (start, end):
+        if value and iso_date(value) != value:
+            return jsonify({'error': f"Invalid date '{value}', expected YYYY-MM-DD"}), 400
+
+    sites = request.args.getlist('site') or list(SITES)
+    if any(site not in SITES for site in sites):
+        return jsonify({'error': f"Unknown site, expected one of {list(SITES)}"}), 400
+
+    aggregate = request.args.get('aggregate', 'mean')
+    if aggregate not in AGGREGATES:
+        return jsonify({'error': f"Unknown aggregate '{aggregate}', expected one of {list(AGGREGATES)}"}), 400
+    try:
+        window = int(request.args['window']) if request.args.get('window') else None
+    except ValueError:
+        window = 0
+    if window is not None and window < 1:
+        return jsonify({'error': 'window must be a positive number of days'}), 400
+
+    return jsonify(query_ruptures(rupture_history_path, start, end, sites, window, aggregate)), 200
+
+@app.route('/processors/stock_coverage', methods=['POST'])
+@with_server_timing
+def stock_coverage_route():
+    try:
+        files = {field: request_file(field) for field in PROCESSORS['stock_coverage']['files']}
+        if not all(files.values()):
+            return jsonify({'error': 'Missing required files (me2n_file, lotus_file, mb52_file)'}), 400
+
+        return send_output(stock_coverage_output(files, {}))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/query/tables', methods=['GET'])
+def query_tables_route():
+    """Tables a query can use, their form field and columns."""
+    from analytics.sql_query import QUERY_TABLES
+    return jsonify({
+        name: {key: value for key, value in table.items() if key != 'read'}
+        for name, table in QUERY_TABLES.items()
+    })
+
+@app.route('/query', methods=['POST'])
+@with_server_timing
+def query_route():
+    """
+    Run one SELECT ('sql') over the uploaded reports, each a table named
+    after its report (me2n_file -> me2n, lotus_file, mb51_file, mb52_file;
+    also as _upload or _dataset ids). Optional 'limit' on the returned
+    rows and 'output_format' (json, or arrow for an Arrow IPC stream).
+    """
+    from analytics.sql_query import QUERY_TABLES, QUERY_FORMATS
+    # Both are in requirements.txt; a partial install still gets a clear answer
+    if importlib.util.find_spec('duckdb') is None:
+        return jsonify({'error': 'SQL queries need duckdb, which is not installed'}), 501
+    if request.form.get('output_format') == 'arrow' and importlib.util.find_spec('pyarrow') is None:
+        return jsonify({'error': 'Arrow query results need pyarrow, which is not installed'}), 501
+
+    try:
+        sql = request.form.get('sql')
+        files = {table['field']: request_file(table['field']) for table in QUERY_TABLES.values()}
+        files = {field: f for field, f in files.items() if f}
+        if not sql or not files:
+            return jsonify({'error': 'Missing sql or report files'}), 400
+
+        params = {'sql': sql, 'output_format': request.form.get('output_format') or 'json'}
+        if request.form.get('limit'):
+            params['limit'] = int(request.form['limit'])
+        if params['output_format'] not in QUERY_FORMATS:
+            return jsonify({'error': f"Unknown output format '{params['output_format']}', expected one of {list(QUERY_FORMATS)}"}), 400
+
+        result = run_cached('query', files, params, lambda: processor_pool.run('query', files, params))
+    except ValueError as e:
+        # Unknown uploads, invalid limits and SQL errors
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    # The encoded result is already whole in memory; it only goes out in chunks
+    return Response(stream_chunks(result), mimetype=QUERY_FORMATS[params['output_format']])
+
+def serve_production(host, port, threads):
+    """
+    Serve with waitress (no reloader, no debugger) and warm the processor
+    workers in the background so /health answers immediately.
+    """
+    threading.Thread(target=processor_pool.start, daemon=True).start()
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress is not installed, serving with the Flask server")
+        app.run(host=host, port=port, debug=False, threaded=True)
+        return
+    serve(app, host=host, port=port, threads=threads)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="StockSync backend")
+    parser.add_argument('--production', action='store_true',
+                        default=os.environ.get('STOCKSYNC_SERVER_MODE') == 'production',
+                        help="serve with waitress instead of the Flask debug server")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5454)
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('STOCKSYNC_SERVER_THREADS', 8)),
+                        help="request threads in production mode")
+    return parser.parse_args(argv)
+
 if __name__ == '__main__':
-    app.run(host='localhost', port=5454, debug=True, threaded=True)
+    # Required for the worker processes of the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
+    args = parse_args()
+    if args.production:
+        serve_production(args.host, args.port, args.threads)
+    else:
+        app.run(host=args.host, port=args.port, debug=True, threaded=True)
@@ -6,7 +6,19 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # Imported lazily by workers.py, invisible to the import scan
+    hiddenimports=[
+        'processors.global_orders',
+        'processors.mb51',
+        'processors.mb51_incremental',
+        'processors.mb52',
+        'analytics.daily_stock_rupture',
+        'analytics.stock_coverage',
+        'analytics.rupture_history',
+        'analytics.sql_query',
+        'material_index',
+        'waitress',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,89 @@
+"""
+Check that the polars engine (STOCKSYNC_ENGINE=polars) returns the same
+results as the pandas one on synthetic exports, including the wrapped
+LOTUS CSV lines, Excel LOTUS exports, blank ids and combined MB52 runs.
+
+Run from backend/ (exits with status 1 on the first mismatch):
+
+    python benchmarks/engine_parity.py --rows 1000 20000 --seeds 3
+"""
+import io
+import os
+import sys
+import csv
+import argparse
+import zipfile
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+from generators import GENERATORS
+from processors.global_orders import process_global_orders
+from processors.mb52 import process_mb52, process_mb52_combined
+
+def wrapped(csv_bytes):
+    """
+    The same LOTUS export in its other shape: every line wrapped in quotes,
+    fields unquoted and decimal points instead of commas.
+    """
+    rows = csv.reader(io.StringIO(csv_bytes.decode("utf-8")))
+    return "".join('"' + ",".join(field.replace(",", ".") for field in row) + '"\n' for row in rows).encode("utf-8")
+
+def upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+def frames(buffer):
+    """Result frames of a parquet output, by file name for a ZIP bundle."""
+    data = buffer.getvalue()
+    if zipfile.is_zipfile(io.BytesIO(data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            # File names end with the time they were written
+            return {name.rsplit("-", 1)[0]: pd.read_parquet(io.BytesIO(z.read(name))) for name in z.namelist()}
+    return {"result": pd.read_parquet(io.BytesIO(data))}
+
+def run(engine, process, inputs):
+    os.environ["STOCKSYNC_ENGINE"] = engine
+    with contextlib.redirect_stdout(sys.stderr):
+        result = process(*inputs(), output_format="parquet")
+    if result is None:
+        raise RuntimeError(f"{process.__name__} failed with the {engine} engine")
+    return frames(result)
+
+def compare(label, process, inputs):
+    expected, actual = run("pandas", process, inputs), run("polars", process, inputs)
+    assert expected.keys() == actual.keys(), f"{label}: {sorted(expected)} != {sorted(actual)}"
+    for name in expected:
+        # Dtypes differ (polars sums in float64), values must not
+        pd.testing.assert_frame_equal(expected[name], actual[name], check_dtype=False, obj=f"{label} {name}")
+    print(f"{label}: {sum(len(frame) for frame in expected.values())} rows match", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the pandas and polars engines.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 20000])
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    for rows in args.rows:
+        for seed in range(args.seeds):
+            me2n = GENERATORS["me2n"](rows, seed)
+            lotus = GENERATORS["lotus_csv"](rows, seed)
+            lotus_xlsx = GENERATORS["lotus_xlsx"](rows, seed)
+            mb52 = GENERATORS["mb52"](rows, seed)
+            other_mb52 = GENERATORS["mb52"](rows // 2 or 1, seed + 1)
+
+            compare(f"global_orders_csv {rows}/{seed}", process_global_orders,
+                    lambda: (upload(me2n, "ME2N.xlsx"), upload(lotus, "LOTUS.csv")))
+            compare(f"global_orders_wrapped_csv {rows}/{seed}", process_global_orders,
+                    lambda: (upload(me2n, "ME2N.xlsx"), upload(wrapped(lotus), "LOTUS.csv")))
+            compare(f"global_orders_xlsx {rows}/{seed}", process_global_orders,
+                    lambda: (upload(me2n, "ME2N.xlsx"), upload(lotus_xlsx, "LOTUS.xlsx")))
+            compare(f"mb52 {rows}/{seed}", process_mb52, lambda: (io.BytesIO(mb52),))
+            compare(f"mb52_combined {rows}/{seed}", process_mb52_combined,
+                    lambda: ([io.BytesIO(mb52), io.BytesIO(other_mb52)],))
+    print("parity ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+from xlsx_writer import write_xlsx
+from processors.global_orders import LOTUS_COLUMNS, LOTUS_CSV_COLUMNS
+from processors.mb51 import REQUIRED_COLUMNS as MB51_COLUMNS
+
+# Synthetic SAP/LOTUS exports with the columns, value shapes and quirks
+# (blank ids, mixed year/order ids, 1000/8888/9999 locations, decimal
+# commas, merged date cells) the processors see in real files.
+# Every generator takes a row count and a seed and returns file bytes.
+
+STORAGE_LOCATIONS = [1000, 8888, 9999, 2000]
+
+def _materials(rng, rows):
+    """Material numbers drawn from a catalog a fifth of the row count."""
+    return rng.integers(1000000, 1000000 + max(rows // 5, 1), rows)
+
+def _descriptions(materials):
+    return pd.Series(materials).map(lambda m: f"ARTICLE {m} STD").to_numpy()
+
+def _dates(rng, rows, start="2024-01-01", days=365):
+    return pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, rows), unit="D")
+
+def me2n(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    materials = _materials(rng, rows).astype(float)
+    materials[rng.random(rows) < 0.02] = np.nan
+    df = pd.DataFrame({
+        "Purchasing Document": rng.integers(4500000000, 4500000000 + max(rows // 3, 1), rows),
+        "Item": rng.integers(1, 20, rows) * 10,
+        "Document Date": _dates(rng, rows),
+        "Vendor/supplying plant": rng.choice(["100234 ACME INDUSTRIE", "100871 NORD LOGISTIK", "8888 PLANT"], rows),
+        "Material": materials,
+        "Short Text": _descriptions(np.nan_to_num(materials).astype(np.int64)),
+        "Storage Location": rng.choice(STORAGE_LOCATIONS + [np.nan], rows, p=[0.3, 0.3, 0.3, 0.05, 0.05]),
+        "Order Quantity": rng.integers(1, 500, rows),
+        "Still to be delivered (qty)": rng.choice([0, 0, 1, 5, 10, 50], rows),
+        "Req. Tracking Number": [f"{1000 + i}/2024/{i % 7 + 1}" for i in range(rows)],
+        "Purchasing Group": "P01",
+    })
+    return write_xlsx(df).getvalue()
+
+def _lotus(rows, seed):
+    """LOTUS orders, as text the way the export writes them."""
+    rng = np.random.default_rng(seed)
+    order = 1000 + np.arange(rows)
+    year_prefixed = rng.random(rows) < 0.7
+    articles = _materials(rng, rows).astype(str)
+    articles[rng.random(rows) < 0.1] = ""
+    articles[rng.random(rows) < 0.02] = "N/A"
+    return pd.DataFrame({
+        "OrderID": np.where(year_prefixed, "2024/" + order.astype(str), order.astype(str)),
+        "Col2": "X",
+        "Pos. no": rng.integers(1, 6, rows).astype(str),
+        "Activity": "Purchase",
+        "Product name": "ARTICLE " + articles + " STD",
+        "SAP article no": articles,
+        "Quantity": rng.integers(1, 50, rows).astype(str),
+        "Price (EUR)": [f"{whole},{cents:02d}" for whole, cents in zip(rng.integers(1, 999, rows), rng.integers(0, 99, rows))],
+        "SAP PO number": rng.choice(["", "", "0", "N/A", "4500012345"], rows),
+        "SAP PR number": "10023456",
+        "Process started on": "2024-03-01",
+        "CC": rng.choice(["47000", "47000", "48000"], rows),
+        "Col13": "C13",
+        "Cost type number": "6100",
+        "Cost type description": "Spare parts",
+        "Supplier": "ACME",
+        "Budget position": "B-01",
+        "Creator delivery date": "2024-04-01",
+    })
+
+def lotus_csv(rows, seed=0):
+    """Header-less, comma separated, prices quoted because of their decimal comma."""
+    df = _lotus(rows, seed)[LOTUS_CSV_COLUMNS]
+    return df.to_csv(index=False, header=False, lineterminator="\n").encode("utf-8")
+
+def lotus_xlsx(rows, seed=0):
+    df = _lotus(rows, seed).rename(columns={"Col2": "Type"})
+    numeric = {"Quantity": pd.to_numeric(df["Quantity"]), "CC": pd.to_numeric(df["CC"])}
+    df = df.assign(**numeric, **{"Req. Tracking Number": ""})
+    return write_xlsx(df[LOTUS_COLUMNS + ["Supplier", "Creator delivery date"]]).getvalue()
+
+def mb51(rows, seed=0):
+    """
+    Receipts (101/121) with their full, partial or over-reversals
+    (102/122) spread through the export, plus unrelated 261 lines.
+    """
+    rng = np.random.default_rng(seed)
+    movement = rng.choice([101, 102, 121, 122, 261], rows, p=[0.3, 0.15, 0.25, 0.15, 0.15])
+    qty = rng.choice([1, 2, 5, 10, 20], rows).astype(float)
+    qty = np.where(np.isin(movement, [102, 122, 261]), -qty, qty)
+    materials = rng.integers(1000000, 1000000 + max(rows // 20, 1), rows)
+    orders = rng.integers(4500000000, 4500000000 + max(rows // 10, 1), rows)
+    df = pd.DataFrame({
+        "Posting Date": _dates(rng, rows),
+        "Material": materials,
+        "Material Description": _descriptions(materials),
+        "Purchase order": orders.astype(float),
+        "Qty in unit of entry": qty,
+        "Vendor": rng.choice(["100234", "100871"], rows),
+        "Movement type": movement,
+        "Document Header Text": (orders % 100000).astype(str),
+        "Unit of Entry": "PC",
+        "Amt.in loc.cur.": np.round(qty * rng.uniform(1, 200, rows), 2),
+        "Cost Center": rng.choice([47000, 48000], rows),
+        "Material Document": 5000000000 + np.arange(rows),
+        "Storage Location": rng.choice(STORAGE_LOCATIONS, rows),
+        "Reference": "REF" + np.arange(rows).astype(str),
+        "Plant": "P100",
+    })
+    return write_xlsx(df[MB51_COLUMNS + ["Plant"]]).getvalue()
+
+def mb52(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    materials = rng.integers(1000000, 1000000 + max(rows // 4, 1), rows)
+    df = pd.DataFrame({
+        "Plant": "P100",
+        "Material Number": materials,
+        "Storage Location": rng.choice(STORAGE_LOCATIONS, rows),
+        "Material Description": _descriptions(materials),
+        "Base Unit of Measure": "PC",
+        "Unrestricted": rng.integers(0, 500, rows).astype(float),
+        "Blocked": 0.0,
+    })
+    return write_xlsx(df).getvalue()
+
+def mc_stock_list(rows, seed=0, days=14):
+    """
+    MC stock list: a title block, the dates on row 3 (one per merged
+    'Qté T'/'Qté B' pair), the headers on row 4 and one material per row.
+    """
+    rng = np.random.default_rng(seed)
+    header = ["Material", "Type", "que 9999 Actif", "que 8888 Actif", "Tot Cons. TAN", "Tot Cons. BKN"]
+    dates = [None] * len(header)
+    for day in range(days):
+        header += ["Qté T", "Qté B"]
+        dates += [pd.Timestamp("2024-03-01") + pd.Timedelta(days=day), None]
+
+    data = {
+        0: 1000000 + np.arange(rows),
+        1: rng.choice(["Test", "PDR", "Other", " Test "], rows),
+        2: np.where(rng.random(rows) < 0.8, "x", None),
+        3: np.where(rng.random(rows) < 0.6, "x", None),
+        4: rng.choice([0, 1, 5, 20], rows),
+        5: rng.choice([0, 2, 10], rows),
+    }
+    for col in range(6, len(header)):
+        values = rng.choice([0, 0, 1, 3, 12], rows).astype(float)
+        values[rng.random(rows) < 0.05] = np.nan
+        data[col] = values
+
+    # Row 1 (the title) is written as the sheet header, rows 2-4 lead the data
+    layout = pd.DataFrame([[None] * len(header), dates, header])
+    sheet = pd.concat([layout, pd.DataFrame(data)], ignore_index=True)
+    sheet.columns = ["Stock list MC"] + [None] * (len(header) - 1)
+    return write_xlsx({"MC": sheet}).getvalue()
+
+# Generators by the name used on the command line
+GENERATORS = {
+    "me2n": me2n,
+    "lotus_csv": lotus_csv,
+    "lotus_xlsx": lotus_xlsx,
+    "mb51": mb51,
+    "mb52": mb52,
+    "mc_stock_list": mc_stock_list,
+}
@@ -0,0 +1,153 @@
+"""
+Check that process_mb51 resolves reversals exactly like the original
+row-by-row implementation (frozen below as reference_mb51) on dense
+synthetic exports: few materials and orders so every reversal has several
+candidates, blank keys, zero and blank quantities, receipts partially
+reversed several times and rows without a posting date.
+
+Run from backend/ (exits with status 1 on the first mismatch):
+
+    python benchmarks/mb51_parity.py --rows 50 400 --seeds 20
+"""
+import io
+import os
+import sys
+import argparse
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+from processors.mb51 import process_mb51
+
+def reference_mb51(df, movement_type):
+    """
+    The original MB51 processor on an export read by pd.read_excel, kept
+    unchanged apart from taking the frame and returning it.
+    """
+    df = df.dropna(subset=["Posting Date"])
+    df['Document Header Text'] = df['Document Header Text'].astype(str).str.extract(r'(\S+)')
+
+    po_col = "Purchase order" if movement_type == 102 else "Document Header Text"
+
+    df_x02 = df[df["Movement type"] == movement_type].copy()
+    df_x01 = df[df["Movement type"] == (movement_type - 1)].copy()
+
+    rows_to_delete = []
+
+    for idx_x02, row_x02 in df_x02.iterrows():
+        mat = row_x02["Material"]
+        po = row_x02[po_col]
+        qty_x02 = row_x02["Qty in unit of entry"]
+
+        matching_x01 = df_x01[
+            (df_x01["Material"] == mat) &
+            (df_x01[po_col] == po)
+        ]
+
+        if len(matching_x01) == 0:
+            continue
+
+        candidates = []
+        for idx_x01, row_x01 in matching_x01.iterrows():
+            qty_x01 = row_x01["Qty in unit of entry"]
+            if qty_x01 + qty_x02 == 0:
+                candidates.append((idx_x01, "match"))
+            elif qty_x01 + qty_x02 > 0:
+                candidates.append((idx_x01, "positive"))
+            else:
+                candidates.append((idx_x01, "partial"))
+
+        exact = [c for c in candidates if c[1] == "match"]
+        if exact:
+            rows_to_delete.extend([idx_x02, exact[0][0]])
+            continue
+
+        partial = [c for c in candidates if c[1] == "partial"]
+        if partial:
+            idx_x01 = partial[0][0]
+            qty_x01 = df.loc[idx_x01, "Qty in unit of entry"]
+            new_qty = qty_x01 + qty_x02
+
+            price = df.loc[idx_x01, "Amt.in loc.cur."]
+            pu = abs(price) / abs(qty_x01) if qty_x01 != 0 else 0
+
+            df.at[idx_x01, "Qty in unit of entry"] = new_qty
+            df.at[idx_x01, "Amt.in loc.cur."] = new_qty * pu
+            rows_to_delete.append(idx_x02)
+            continue
+
+        positive = [c for c in candidates if c[1] == "positive"]
+        if positive:
+            rows_to_delete.extend([idx_x02, positive[0][0]])
+
+    df = df.drop(rows_to_delete)
+    df['Storage Location'] = df['Storage Location'].apply(lambda x: 8888 if x == 1000 else x)
+    return df
+
+def dense_mb51(rows, seed=0):
+    """
+    An MB51 export where reversals collide: 4 materials, 5 orders and
+    header texts, some of them blank, quantities of either sign including
+    0 and blanks, so exact, partial (repeatedly on the same receipt) and
+    positive matches all occur.
+    """
+    rng = np.random.default_rng(seed)
+    movement = rng.choice([101, 102, 121, 122, 261], rows, p=[0.25, 0.25, 0.2, 0.2, 0.1])
+    magnitude = rng.choice([0, 1, 2, 3, 5, 10, 20, np.nan], rows, p=[0.05, 0.2, 0.2, 0.15, 0.15, 0.1, 0.1, 0.05])
+    # Reversals are mostly negative and receipts positive, not always
+    sign = np.where(np.isin(movement, [102, 122, 261]), -1, 1) * np.where(rng.random(rows) < 0.1, -1, 1)
+    orders = rng.choice([4500000001, 4500000002, 4500000003, 4500000004, 4500000005, np.nan], rows)
+    headers = rng.choice(["H1", "H2 extra words", " H3", "H4", "", None], rows)
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 60, rows), unit="D")
+    df = pd.DataFrame({
+        "Posting Date": pd.Series(dates).where(rng.random(rows) > 0.03),
+        "Material": rng.choice([1000001, 1000002, 1000003, 1000004, np.nan], rows, p=[0.3, 0.3, 0.2, 0.15, 0.05]),
+        "Material Description": "ARTICLE",
+        "Purchase order": orders,
+        "Qty in unit of entry": magnitude * sign,
+        "Vendor": rng.choice([100234, 100871], rows),
+        "Movement type": movement,
+        "Document Header Text": headers,
+        "Unit of Entry": "PC",
+        "Amt.in loc.cur.": np.round(rng.uniform(-500, 500, rows), 2),
+        "Cost Center": rng.choice([47000, np.nan], rows),
+        "Material Document": 5000000000 + np.arange(rows),
+        "Storage Location": rng.choice([1000, 8888, 9999, 2000, np.nan], rows),
+        "Reference": "REF" + np.arange(rows).astype(str),
+        "Plant": "P100",
+    })
+    output = io.BytesIO()
+    df.to_excel(output, index=False)
+    return output.getvalue()
+
+def compare(label, data, movement_type):
+    expected = reference_mb51(pd.read_excel(io.BytesIO(data)), movement_type)
+    with contextlib.redirect_stdout(sys.stderr):
+        result = process_mb51(FileStorage(stream=io.BytesIO(data), filename="MB51.xlsx"), movement_type, output_format="csv")
+    if result is None:
+        raise RuntimeError(f"{label}: process_mb51 failed")
+    # Both through CSV, so only values are compared, not dtypes
+    expected = pd.read_csv(io.BytesIO(expected.to_csv(index=False).encode("utf-8")))
+    actual = pd.read_csv(result)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False, obj=label)
+    print(f"{label}: {len(actual)} rows match", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare process_mb51 with the original row-by-row matching.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 400])
+    parser.add_argument("--seeds", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for rows in args.rows:
+        for seed in range(args.seeds):
+            data = dense_mb51(rows, seed)
+            for movement_type in (102, 122):
+                compare(f"mb51 {movement_type} {rows}/{seed}", data, movement_type)
+    print("parity ok")
+
+if __name__ == "__main__":
+    main()
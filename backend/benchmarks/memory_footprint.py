@@ -0,0 +1,114 @@
+"""
+Measure the memory the compact report dtypes (schemas.REPORT_SCHEMAS)
+save on synthetic exports, and check that the readers apply them.
+
+For every report the schema columns are read as plain read_excel returns
+them, then compacted; a column that grows, or a reader that does not
+return the compact dtypes, is a failure.
+
+Run from backend/ (exits with status 1 on the first failure):
+
+    python benchmarks/memory_footprint.py --rows 10000 100000 --output memory.json
+"""
+import io
+import os
+import sys
+import json
+import argparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from werkzeug.datastructures import FileStorage
+from generators import GENERATORS
+from excel_reader import read_excel, open_workbook
+from schemas import REPORT_SCHEMAS, compact
+from processors.global_orders import read_me2n, read_lotus, read_lotus_csv
+from processors.mb51 import load_mb51
+from processors.mb52 import load_mb52
+
+def upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+def stock_list_types(file_storage):
+    """The Type column of an MC stock list (headers on row 4)."""
+    grid = open_workbook(file_storage).parse(sheet_name=0, header=None)
+    header = list(grid.iloc[3])
+    return grid.iloc[4:, header.index("Type")].rename("Type").to_frame()
+
+# report: (schema, generator, file name, plain read, reader)
+REPORTS = {
+    "mb51": ("mb51", "mb51", "MB51.xlsx", lambda f: read_excel(f, columns=list(REPORT_SCHEMAS["mb51"])), load_mb51),
+    "mb52": ("mb52", "mb52", "MB52.xlsx", lambda f: read_excel(f, columns=list(REPORT_SCHEMAS["mb52"])), load_mb52),
+    "me2n": ("me2n", "me2n", "ME2N.xlsx", lambda f: read_excel(f, columns=list(REPORT_SCHEMAS["me2n"])), read_me2n),
+    "lotus_csv": ("lotus", "lotus_csv", "LOTUS.csv", read_lotus_csv, read_lotus),
+    "lotus_xlsx": ("lotus", "lotus_xlsx", "LOTUS.xlsx", lambda f: read_excel(f, columns=list(REPORT_SCHEMAS["lotus"])), read_lotus),
+    "mc_stock_list": ("mc_stock_list", "mc_stock_list", "MC.xlsx", stock_list_types, None),
+}
+
+def measure(report, rows, seed=0):
+    """Bytes of each schema column, plain and compacted, and the reader's dtypes."""
+    schema, generator, filename, read_plain, reader = REPORTS[report]
+    data = GENERATORS[generator](rows, seed)
+    plain = read_plain(upload(data, filename))
+    compacted = compact(plain, schema)
+    read = reader(upload(data, filename)) if reader else None
+
+    columns = []
+    for column in [column for column in REPORT_SCHEMAS[schema] if column in plain.columns]:
+        plain_bytes = int(plain[column].memory_usage(index=False, deep=True))
+        compact_bytes = int(compacted[column].memory_usage(index=False, deep=True))
+        columns.append({
+            "column": column,
+            "plain_dtype": str(plain[column].dtype),
+            "compact_dtype": str(compacted[column].dtype),
+            "plain_bytes": plain_bytes,
+            "compact_bytes": compact_bytes,
+            "read_dtype": str(read[column].dtype) if read is not None else None,
+        })
+    return {"report": report, "rows": len(plain), "columns": columns}
+
+def check(result):
+    """Failure messages of one measurement."""
+    failures = []
+    for column in result["columns"]:
+        label = f"{result['report']} {column['column']} ({result['rows']} rows)"
+        if column["compact_bytes"] > column["plain_bytes"]:
+            failures.append(f"{label}: {column['compact_dtype']} takes {column['compact_bytes']} bytes, "
+                            f"{column['plain_dtype']} {column['plain_bytes']}")
+        if column["read_dtype"] not in (None, column["compact_dtype"]):
+            failures.append(f"{label}: read as {column['read_dtype']}, expected {column['compact_dtype']}")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the memory saved by the compact report dtypes.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000])
+    parser.add_argument("--reports", nargs="+", choices=list(REPORTS), default=list(REPORTS))
+    parser.add_argument("--output", help="JSON file for the results (default: print them)")
+    args = parser.parse_args(argv)
+
+    results, failures = [], []
+    for rows in args.rows:
+        for report in args.reports:
+            result = measure(report, rows)
+            results.append(result)
+            failures += check(result)
+            plain = sum(column["plain_bytes"] for column in result["columns"])
+            compacted = sum(column["compact_bytes"] for column in result["columns"])
+            print(f"{report} {result['rows']} rows: {plain:,} -> {compacted:,} bytes "
+                  f"({compacted / plain:.0%})" if plain else f"{report}: no schema columns", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("memory footprint ok", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Time every processor stage on synthetic exports and record peak memory.
+
+Run from backend/:
+
+    python benchmarks/run_benchmarks.py --rows 1000 10000 100000 --output bench.json
+    python benchmarks/run_benchmarks.py --rows 10000 --compare bench.json
+
+Generated inputs are kept in benchmarks/data/ so later runs reuse them.
+Peak memory is measured with tracemalloc, which makes the processors
+several times slower; compare timings of runs made with the same
+setting, or pass --no-memory for realistic timings.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import datetime
+import subprocess
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+import pandas as pd
+from generators import GENERATORS
+from workers import execute_measured
+from excel_reader import excel_engine
+from engines import PROCESSING_ENGINES, processing_engine
+
+# Each benchmark runs one processor on generated inputs:
+# form field -> (generator, upload filename)
+BENCHMARKS = {
+    'global_orders_csv': {
+        'processor': 'global_orders',
+        'inputs': {'me2n_file': ('me2n', 'ME2N.xlsx'), 'lotus_file': ('lotus_csv', 'LOTUS.csv')},
+        'params': {},
+    },
+    'global_orders_xlsx': {
+        'processor': 'global_orders',
+        'inputs': {'me2n_file': ('me2n', 'ME2N.xlsx'), 'lotus_file': ('lotus_xlsx', 'LOTUS.xlsx')},
+        'params': {},
+    },
+    'mb51_102': {'processor': 'mb51', 'inputs': {'mb51_file': ('mb51', 'MB51.xlsx')}, 'params': {'movement_type': 102}},
+    'mb51_122': {'processor': 'mb51', 'inputs': {'mb51_file': ('mb51', 'MB51.xlsx')}, 'params': {'movement_type': 122}},
+    'mb52': {'processor': 'mb52', 'inputs': {'mb52_file': ('mb52', 'MB52.xlsx')}, 'params': {}},
+    'mb52_streaming': {'processor': 'mb52', 'inputs': {'mb52_file': ('mb52', 'MB52.xlsx')}, 'params': {'streaming': True}},
+    'stock_ruptures': {'processor': 'stock_ruptures', 'inputs': {'file': ('mc_stock_list', 'MC.xlsx')}, 'params': {}},
+    'stock_coverage': {
+        'processor': 'stock_coverage',
+        'inputs': {'me2n_file': ('me2n', 'ME2N.xlsx'), 'lotus_file': ('lotus_csv', 'LOTUS.csv'), 'mb52_file': ('mb52', 'MB52.xlsx')},
+        'params': {},
+    },
+}
+
+class StageRecorder:
+    """
+    Progress callback recording the wall time and traced peak memory of
+    each stage a processor reports.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._current = None
+        self._baseline = 0
+
+    def start(self):
+        self.stages = []
+        self._current = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+
+    def __call__(self, stage):
+        self._close()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._current = (stage, time.perf_counter())
+
+    def finish(self):
+        self._close()
+
+    def _close(self):
+        if self._current is None:
+            return
+        name, started = self._current
+        record = {'name': name, 'seconds': round(time.perf_counter() - started, 6)}
+        if self.trace_memory:
+            record['peak_memory_bytes'] = max(tracemalloc.get_traced_memory()[1] - self._baseline, 0)
+        self.stages.append(record)
+        self._current = None
+
+def generated_input(generator, rows, seed, filename, data_dir):
+    """Bytes of a synthetic export, generated once and kept in `data_dir`."""
+    extension = os.path.splitext(filename)[1]
+    path = os.path.join(data_dir, f"{generator}-{rows}-{seed}{extension}")
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    data = GENERATORS[generator](rows, seed)
+    os.makedirs(data_dir, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+def run_benchmark(name, rows, seed=0, repeat=1, trace_memory=True, data_dir=None):
+    """Run one benchmark `repeat` times and keep the fastest run."""
+    spec = BENCHMARKS[name]
+    payload = {
+        field: (filename, generated_input(generator, rows, seed, filename, data_dir))
+        for field, (generator, filename) in spec['inputs'].items()
+    }
+
+    recorder = StageRecorder(trace_memory)
+    best = None
+    for _ in range(repeat):
+        recorder.start()
+        started = time.perf_counter()
+        # Processor log lines must not end up in the JSON printed on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            result, operations, _ = execute_measured(spec['processor'], payload, spec['params'], recorder)
+        seconds = time.perf_counter() - started
+        recorder.finish()
+
+        if result is None or (isinstance(result, dict) and 'error' in result):
+            raise RuntimeError(f"{name} failed on {rows} rows: {result}")
+
+        # 'operations' are the instrumented functions inside the stages (see metrics.py)
+        run = {'seconds': round(seconds, 6), 'stages': recorder.stages, 'operations': operations}
+        if trace_memory:
+            run['peak_memory_bytes'] = max((stage['peak_memory_bytes'] for stage in recorder.stages), default=0)
+        if best is None or run['seconds'] < best['seconds']:
+            best = run
+
+    return {
+        'benchmark': name,
+        'processor': spec['processor'],
+        'rows': rows,
+        'seed': seed,
+        'params': spec['params'],
+        'input_bytes': sum(len(data) for _, data in payload.values()),
+        'repeat': repeat,
+        **best,
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'excel_engine': excel_engine(),
+        'processing_engine': processing_engine(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def compare(results, baseline):
+    """Print the time and memory ratio of each result against a previous run."""
+    previous = {(r['benchmark'], r['rows']): r for r in baseline['results']}
+    print(f"{'benchmark':<20} {'rows':>8} {'before s':>10} {'after s':>10} {'ratio':>7} {'memory':>7}")
+    for result in results:
+        before = previous.get((result['benchmark'], result['rows']))
+        if before is None:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else float('nan')
+        memory = ''
+        if result.get('peak_memory_bytes') and before.get('peak_memory_bytes'):
+            memory = f"{result['peak_memory_bytes'] / before['peak_memory_bytes']:.2f}"
+        print(f"{result['benchmark']:<20} {result['rows']:>8} {before['seconds']:>10.3f} {result['seconds']:>10.3f} {ratio:>7.2f} {memory:>7}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the processors on synthetic exports.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help="row counts to generate (1k to 1M)")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=1, help="runs per benchmark, the fastest is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc for undisturbed timings")
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARKS_DIR, 'data'), help="where generated inputs are kept")
+    parser.add_argument('--output', help="JSON file for the results (default: print them)")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare against")
+    parser.add_argument('--engine', choices=PROCESSING_ENGINES, help="processing engine (default: STOCKSYNC_ENGINE or pandas)")
+    args = parser.parse_args(argv)
+
+    if args.engine:
+        os.environ['STOCKSYNC_ENGINE'] = args.engine
+
+    trace_memory = not args.no_memory
+    if trace_memory:
+        tracemalloc.start()
+
+    report = {'environment': environment(), 'results': []}
+    for rows in args.rows:
+        for name in args.benchmarks:
+            result = run_benchmark(name, rows, args.seed, args.repeat, trace_memory, args.data_dir)
+            report['results'].append(result)
+            memory = f", peak {result['peak_memory_bytes'] / 2**20:.1f} MiB" if trace_memory else ""
+            print(f"{name} ({rows} rows): {result['seconds']:.3f}s{memory}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report['results'], json.load(f))
+
+if __name__ == '__main__':
+    main()
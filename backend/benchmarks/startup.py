@@ -0,0 +1,81 @@
+"""
+Measure how long the backend takes to answer /health after it is spawned,
+the way Electron starts it.
+
+Run from backend/:
+
+    python benchmarks/startup.py --modes development production --repeat 5 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import subprocess
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def stop(proc):
+    """Stop the server and, for the debug reloader, its child process."""
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/pid', str(proc.pid), '/f', '/t'], capture_output=True)
+    else:
+        os.killpg(proc.pid, signal.SIGTERM)
+    proc.wait(timeout=10)
+
+def time_to_health(mode, timeout=60):
+    """Seconds from spawning app.py in `mode` to the first 200 from /health."""
+    port = free_port()
+    args = [sys.executable, os.path.join(BACKEND_DIR, 'app.py'), '--port', str(port)]
+    if mode == 'production':
+        args.append('--production')
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        args, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=sys.platform != 'win32',
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Backend exited with code {proc.returncode} in {mode} mode")
+            try:
+                with urllib.request.urlopen(f'http://localhost:{port}/health', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"/health did not answer within {timeout}s in {mode} mode")
+    finally:
+        stop(proc)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the backend cold start.")
+    parser.add_argument('--modes', nargs='+', choices=['development', 'production'], default=['development', 'production'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="JSON file for the results (default: print them)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.modes:
+        samples = [round(time_to_health(mode), 4) for _ in range(args.repeat)]
+        results.append({'mode': mode, 'samples_seconds': samples, 'best_seconds': min(samples)})
+        print(f"{mode}: best {min(samples):.3f}s over {args.repeat} runs", file=sys.stderr)
+
+    report = {'python': sys.version.split()[0], 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
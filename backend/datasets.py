@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+MB = 1024 * 1024
+
+class DatasetStore:
+    """
+    Frames kept in memory under an id: workbooks parsed into typed frames
+    (excel_reader.ParsedWorkbook), so one upload is parsed once and then
+    processed by any number of processors and analytics without being
+    sent or parsed again, and result previews (ResultPreview).
+    Entries have an `nbytes` size and a describe() summary.
+
+    An LRU bounded by `max_bytes` (in-memory size) and `max_entries`; a
+    dataset unused for `ttl` seconds expires.
+    """
+
+    def __init__(self, max_bytes=256 * MB, max_entries=16, ttl=3600):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._datasets = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def add(self, dataset):
+        """Keep a dataset and return its status (with its new id)."""
+        if dataset.nbytes > self.max_bytes:
+            raise ValueError(f"Dataset of {dataset.nbytes} bytes exceeds the {self.max_bytes} byte limit")
+
+        dataset_id = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            now = time.monotonic()
+            self._datasets[dataset_id] = {"dataset": dataset, "bytes": dataset.nbytes, "created": time.time(), "used": now}
+            self._used += dataset.nbytes
+            self._evict()
+        return self.status(dataset_id)
+
+    def resized(self, dataset_id):
+        """
+        Count the current `nbytes` of a dataset that grew or shrank since it
+        was added, evicting the least recently used ones if the store is now
+        over its limit. A dataset that is already gone is ignored.
+        """
+        with self._lock:
+            entry = self._datasets.get(dataset_id)
+            if entry is None:
+                return
+            nbytes = entry["dataset"].nbytes
+            self._used += nbytes - entry["bytes"]
+            entry["bytes"] = nbytes
+            self._evict()
+
+    def get(self, dataset_id):
+        """A dataset by id; KeyError if unknown or expired."""
+        with self._lock:
+            self._prune()
+            entry = self._datasets.get(dataset_id)
+            if entry is None:
+                self.stats["misses"] += 1
+                raise KeyError(dataset_id)
+            self.stats["hits"] += 1
+            entry["used"] = time.monotonic()
+            self._datasets.move_to_end(dataset_id)
+            return entry["dataset"]
+
+    def status(self, dataset_id):
+        """Summary, size and expiry of a dataset; KeyError if unknown."""
+        with self._lock:
+            entry = self._datasets.get(dataset_id)
+            if entry is None:
+                raise KeyError(dataset_id)
+            return self._describe(dataset_id, entry)
+
+    def delete(self, dataset_id):
+        with self._lock:
+            entry = self._datasets.pop(dataset_id)
+            self._used -= entry["bytes"]
+
+    def report(self):
+        """Every dataset and the store usage, ready for jsonify."""
+        with self._lock:
+            self._prune()
+            return {
+                **self.stats,
+                "bytes": self._used,
+                "limit_bytes": self.max_bytes,
+                "limit_entries": self.max_entries,
+                "datasets": [self._describe(dataset_id, entry) for dataset_id, entry in self._datasets.items()],
+            }
+
+    def _describe(self, dataset_id, entry):
+        dataset = entry["dataset"]
+        return {
+            "id": dataset_id,
+            **dataset.describe(),
+            "bytes": entry["bytes"],
+            "created": entry["created"],
+            "expires_in": max(0, round(entry["used"] + self.ttl - time.monotonic())),
+        }
+
+    def _prune(self):
+        """Drop datasets unused for longer than the TTL (lock held)."""
+        cutoff = time.monotonic() - self.ttl
+        # Least recently used first, so expired ones lead
+        while self._datasets:
+            dataset_id, entry = next(iter(self._datasets.items()))
+            if entry["used"] >= cutoff:
+                break
+            del self._datasets[dataset_id]
+            self._used -= entry["bytes"]
+            self.stats["expirations"] += 1
+
+    def _evict(self):
+        """Drop the least recently used datasets until within the limits (lock held)."""
+        while self._used > self.max_bytes or len(self._datasets) > self.max_entries:
+            _, evicted = self._datasets.popitem(last=False)
+            self._used -= evicted["bytes"]
+            self.stats["evictions"] += 1
+
+class ResultPreview:
+    """
+    The result frames of a processor run ({table name: DataFrame}), read
+    one page at a time. `summary` carries the non-tabular part of a result.
+    Exports are written once per format and kept, counted in `nbytes`.
+    """
+
+    # Filtered and sorted row orders kept per preview
+    MAX_VIEWS = 4
+
+    def __init__(self, processor, frames, summary=None):
+        self.processor = processor
+        self.frames = frames
+        self.summary = summary
+        self.nbytes = int(sum(df.memory_usage(index=True, deep=True).sum() for df in frames.values()))
+        self.exports = {}
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def keep_export(self, output_format, data):
+        """Keep an export written in `output_format`; the first one kept wins."""
+        with self._lock:
+            if output_format not in self.exports:
+                self.exports[output_format] = data
+                self.nbytes += len(data)
+            return self.exports[output_format]
+
+    def describe(self):
+        tables = {
+            name: {"rows": len(df), "columns": [{"name": str(column), "type": str(dtype)} for column, dtype in df.dtypes.items()]}
+            for name, df in self.frames.items()
+        }
+        return {"processor": self.processor, "tables": tables, **({"summary": self.summary} if self.summary else {})}
+
+    def page(self, table, page=1, page_size=100, sort=None, descending=False, search=None, filters=()):
+        """
+        Rows `page` (from 1) of `table`, `page_size` at a time, after the
+        filters and sort. `search` matches any column and each (column,
+        text) filter its column, as case-insensitive text.
+        KeyError for an unknown table or column. Ready for jsonify.
+        """
+        df = self.frames[table]
+        rows = self._view(table, sort, descending, search, tuple(filters))
+        start = (page - 1) * page_size
+        return {
+            "table": table,
+            "page": page,
+            "page_size": page_size,
+            "total_rows": len(rows),
+            "pages": -(-len(rows) // page_size),
+            "columns": [str(column) for column in df.columns],
+            # NaN as null and dates as ISO strings
+            "rows": json.loads(df.iloc[rows[start:start + page_size]].to_json(orient="values", date_format="iso")),
+        }
+
+    def _view(self, table, sort, descending, search, filters):
+        """Positions of the rows to show, in order; the last few are memoized."""
+        key = (table, sort, descending, search, filters)
+        with self._lock:
+            if key in self._views:
+                self._views.move_to_end(key)
+                return self._views[key]
+
+        import numpy as np
+        df = self.frames[table]
+        for column in [column for column, _ in filters] + ([sort] if sort is not None else []):
+            if column not in df.columns:
+                raise KeyError(column)
+
+        mask = np.ones(len(df), dtype=bool)
+        for column, text in filters:
+            mask &= _text(df[column]).str.contains(text.lower(), regex=False).to_numpy()
+        if search:
+            found = np.zeros(len(df), dtype=bool)
+            for column in df.columns:
+                found |= _text(df[column]).str.contains(search.lower(), regex=False).to_numpy()
+            mask &= found
+        positions = np.flatnonzero(mask)
+
+        if sort is not None:
+            values = df[sort].iloc[positions].reset_index(drop=True)
+            try:
+                order = values.sort_values(ascending=not descending, kind="stable").index
+            except TypeError:
+                # Mixed numbers and text sort as text
+                order = _text(values).sort_values(ascending=not descending, kind="stable").index
+            positions = positions[order.to_numpy()]
+
+        with self._lock:
+            self._views[key] = positions
+            while len(self._views) > self.MAX_VIEWS:
+                self._views.popitem(last=False)
+        return positions
+
+def _text(series):
+    """A column as lowercase text, blanks as empty strings."""
+    return series.astype(str).where(series.notna(), "").str.lower()
+
+def datasets_from_env():
+    """Build the store from STOCKSYNC_DATASET_MB / STOCKSYNC_DATASET_ENTRIES / STOCKSYNC_DATASET_TTL_MINUTES."""
+    return DatasetStore(
+        max_bytes=int(os.environ.get("STOCKSYNC_DATASET_MB", 256)) * MB,
+        max_entries=int(os.environ.get("STOCKSYNC_DATASET_ENTRIES", 16)),
+        ttl=int(os.environ.get("STOCKSYNC_DATASET_TTL_MINUTES", 60)) * 60,
+    )
+
+def previews_from_env():
+    """Build the preview store from STOCKSYNC_PREVIEW_MB / STOCKSYNC_PREVIEW_ENTRIES / STOCKSYNC_PREVIEW_TTL_MINUTES."""
+    return DatasetStore(
+        max_bytes=int(os.environ.get("STOCKSYNC_PREVIEW_MB", 512)) * MB,
+        max_entries=int(os.environ.get("STOCKSYNC_PREVIEW_ENTRIES", 16)),
+        ttl=int(os.environ.get("STOCKSYNC_PREVIEW_TTL_MINUTES", 30)) * 60,
+    )
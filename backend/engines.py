@@ -0,0 +1,21 @@
+import os
+import importlib.util
+
+# Engines the processors can run their aggregations on. polars builds
+# each pipeline as a LazyFrame; only LOTUS CSV scans get their columns
+# and filters pushed down, Excel sheets are read by pandas first (see
+# processors/polars_engine.py).
+PROCESSING_ENGINES = ["pandas", "polars"]
+
+def processing_engine():
+    """
+    Engine chosen by STOCKSYNC_ENGINE (pandas by default). polars falls
+    back to pandas when it is not installed.
+    """
+    engine = os.environ.get("STOCKSYNC_ENGINE", "pandas").lower()
+    if engine not in PROCESSING_ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {PROCESSING_ENGINES}")
+    if engine == "polars" and importlib.util.find_spec("polars") is None:
+        print("polars is not installed, processing with pandas")
+        return "pandas"
+    return engine
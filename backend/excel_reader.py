@@ -0,0 +1,196 @@
+import importlib.util
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# Engines in order of preference. calamine (Rust) parses large SAP exports
+# several times faster than openpyxl; openpyxl is always installed and is
+# opened by pandas in read-only (streaming) mode.
+ENGINES = [
+    ("calamine", "python_calamine"),
+    ("openpyxl", "openpyxl"),
+]
+
+_engine = None
+
+def excel_engine():
+    """Return the fastest Excel engine installed, resolved once per process."""
+    global _engine
+    if _engine is None:
+        _engine = next(
+            (name for name, module in ENGINES if importlib.util.find_spec(module) is not None),
+            "openpyxl",
+        )
+    return _engine
+
+def open_workbook(source):
+    """Open a workbook once so several sheets can be parsed from it."""
+    if isinstance(source, ParsedWorkbook):
+        return source
+    return pd.ExcelFile(source, engine=excel_engine())
+
+def read_excel(source, columns=None, dtype=None, **kwargs):
+    """
+    Read an Excel sheet with the fastest available engine.
+
+    Only the declared `columns` are parsed; any that are missing from the
+    file are simply left out so callers can still report them. `dtype`
+    coerces columns while parsing instead of converting them afterwards.
+    A ParsedWorkbook is read from its parsed cells.
+    """
+    if isinstance(source, ParsedWorkbook):
+        return source.read(columns, dtype, **kwargs)
+    if columns is not None:
+        wanted = set(columns)
+        kwargs["usecols"] = lambda col: col in wanted
+
+    return pd.read_excel(source, engine=excel_engine(), dtype=dtype, **kwargs)
+
+class ParsedSheet:
+    """
+    One sheet parsed once into a typed frame: `frame` is the sheet as
+    read_excel reads it (first row as header, column types inferred) and
+    `header` the cells of that first row. Columns whose text read_excel
+    turned into numbers or booleans (ids like "00123") also keep their
+    cells in `texts` (by position), so they can still be read as text.
+    """
+
+    def __init__(self, grid):
+        self.header = grid.iloc[0].tolist() if len(grid) else []
+        self.frame = TextParser(
+            [_header_cells(self.header)] + grid.iloc[1:].to_numpy().tolist(), header=0, skip_blank_lines=False,
+        ).read() if len(grid) else None
+        self.texts = {}
+        for position in range(len(self.header)):
+            if pd.api.types.is_string_dtype(self.frame.dtypes.iloc[position]):
+                continue
+            cells = grid.iloc[1:, position].to_numpy()
+            if pd.api.types.infer_dtype(cells, skipna=True) not in NON_TEXT_CELLS:
+                self.texts[position] = cells
+
+    @property
+    def nbytes(self):
+        if self.frame is None:
+            return 0
+        texts = sum(int(pd.Series(cells).memory_usage(index=False, deep=True)) for cells in self.texts.values())
+        return int(self.frame.memory_usage(index=False, deep=True).sum()) + texts
+
+    def rows(self):
+        """Rows of the sheet, header included."""
+        return 0 if self.frame is None else len(self.frame) + 1
+
+    def read(self, columns=None, dtype=None):
+        """The sheet as read_excel(columns=..., dtype=...) returns it."""
+        if self.frame is None:
+            return pd.DataFrame()
+        positions = list(range(len(self.header)))
+        if columns is not None:
+            wanted = set(columns)
+            positions = [position for position in positions if self.header[position] in wanted]
+        df = self.frame.iloc[:, positions]
+        if not dtype:
+            return df
+
+        # Columns with a dtype are converted from their cells while parsing,
+        # as read_excel does, instead of from the inferred values
+        names = df.columns
+        converted = [i for i, name in enumerate(names) if not isinstance(dtype, dict) or name in dtype]
+        if not converted:
+            return df
+        cells = self.cells([positions[i] for i in converted])
+        parsed = TextParser(
+            [[names[i] for i in converted]] + cells.tolist(), header=0, dtype=dtype, skip_blank_lines=False,
+        ).read()
+        df = df.copy()
+        for j, i in enumerate(converted):
+            df.isetitem(i, parsed.iloc[:, j])
+        return df
+
+    def cells(self, positions=None, header=False):
+        """The cells read_excel read for the columns at `positions` (all by default), as an object array."""
+        if positions is None:
+            positions = range(len(self.header))
+        rows = 0 if self.frame is None else len(self.frame)
+        grid = np.empty((rows + header, len(positions)), dtype=object)
+        for j, position in enumerate(positions):
+            if header:
+                grid[0, j] = self.header[position]
+            grid[header:, j] = self.texts[position] if position in self.texts else _cells(self.frame.iloc[:, position])
+        return grid
+
+def _header_cells(cells):
+    """A header row as pandas passes it to the parser: blanks as "" (named "Unnamed: n")."""
+    return ["" if pd.isna(cell) else cell for cell in cells]
+
+# infer_dtype kinds of a column of cells holding no text
+NON_TEXT_CELLS = {"empty", "integer", "floating", "mixed-integer-float", "boolean", "datetime", "datetime64", "date"}
+
+def _cells(column):
+    """A column of a ParsedSheet frame back as the cells it was inferred from."""
+    if pd.api.types.is_float_dtype(column):
+        values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        cells = values.astype(object)
+        # Whole numbers were read as int cells
+        whole = np.isfinite(values) & (values % 1 == 0) & (np.abs(values) < 2 ** 63)
+        cells[whole] = values[whole].astype(np.int64).tolist()
+        return cells
+    cells = column.to_numpy(dtype=object, copy=True)
+    cells[column.isna().to_numpy()] = np.nan
+    return cells
+
+class ParsedWorkbook:
+    """
+    Every sheet of a workbook parsed once into a typed frame (see
+    ParsedSheet), for datasets reused by several processors.
+
+    read_excel() and open_workbook() accept it in place of a file and
+    return the frames a direct read returns: header-row reads select
+    columns of the typed frame; columns given a dtype, and reads with
+    another header row (or other options), are parsed from the kept cells
+    with the text parser pandas runs after reading a file.
+    """
+
+    def __init__(self, sheets, filename=None):
+        self.sheets = {name: ParsedSheet(grid) for name, grid in sheets.items()}
+        self.filename = filename
+        # Digest of the file parsed, so cached results are shared with it
+        self.digest = None
+        self.nbytes = sum(sheet.nbytes for sheet in self.sheets.values())
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def parse(self, sheet_name=0, header=0, columns=None, dtype=None, **kwargs):
+        if not isinstance(sheet_name, str):
+            sheet_name = self.sheet_names[sheet_name]
+        sheet = self.sheets[sheet_name]
+        if header == 0 and not kwargs:
+            return sheet.read(columns, dtype)
+
+        if sheet.frame is None:
+            return pd.DataFrame()
+        grid = pd.DataFrame(sheet.cells(header=True))
+        if columns is not None and header is not None and len(grid) > header:
+            wanted = set(columns)
+            grid = grid.loc[:, [name in wanted for name in grid.iloc[header]]]
+        rows = grid.to_numpy().tolist()
+        if header is not None and len(rows) > header:
+            rows[header] = _header_cells(rows[header])
+        return TextParser(rows, header=header, dtype=dtype, skip_blank_lines=False, **kwargs).read()
+
+    def read(self, columns=None, dtype=None, **kwargs):
+        """The first sheet, as read_excel(columns=..., dtype=...) returns it."""
+        return self.parse(0, columns=columns, dtype=dtype, **kwargs)
+
+    def describe(self):
+        # Sheet rows, header rows included
+        return {"filename": self.filename, "sheets": {name: sheet.rows() for name, sheet in self.sheets.items()}}
+
+    def close(self):
+        pass
+
+def parse_workbook(source, filename=None):
+    """Parse every sheet of `source` once into a ParsedWorkbook."""
+    sheets = pd.read_excel(source, sheet_name=None, header=None, dtype=object, engine=excel_engine())
+    return ParsedWorkbook(sheets, filename or getattr(source, "filename", None))
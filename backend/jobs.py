@@ -0,0 +1,97 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Pipeline stages reported by the processors, in order
+STAGES = ["parse", "match", "aggregate", "write"]
+
+class JobManager:
+    """
+    Runs processor calls on a bounded worker pool and keeps their status,
+    stage progress and output for polling clients.
+
+    Only the most recent `keep_finished` finished jobs are retained so
+    results do not pile up in memory.
+    """
+
+    def __init__(self, max_workers=2, keep_finished=50):
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, processor, run, *args):
+        """
+        Queue `run(*args, progress=callback)` and return the job id.
+        `run` returns the output dict served by the result endpoint.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "processor": processor,
+                "status": "queued",
+                "stage": None,
+                "progress": 0,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+                "output": None,
+            }
+        self._executor.submit(self._run, job_id, run, args)
+        return job_id
+
+    def status(self, job_id):
+        """Public view of a job (without its output), or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if k != "output"}
+
+    def output(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job["output"] if job else None
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _report(self, job_id, stage):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Progress relayed from a worker process may arrive late
+            if job is None or job["status"] != "running":
+                return
+            job["stage"] = stage
+            if stage in STAGES:
+                job["progress"] = int(100 * STAGES.index(stage) / len(STAGES))
+
+    def _run(self, job_id, run, args):
+        self._update(job_id, status="running")
+        try:
+            output = run(*args, progress=lambda stage: self._report(job_id, stage))
+            self._update(job_id, status="done", progress=100, output=output, finished_at=time.time())
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job["finished_at"] is not None),
+                key=lambda job: job["finished_at"],
+            )
+            for job in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self._jobs[job["id"]]
+
+def jobs_from_env():
+    """Build the job manager from STOCKSYNC_JOB_* environment variables."""
+    return JobManager(
+        max_workers=int(os.environ.get("STOCKSYNC_JOB_WORKERS", 2)),
+        keep_finished=int(os.environ.get("STOCKSYNC_JOB_KEEP", 50)),
+    )
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from storage import data_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS materials (
+    code INTEGER PRIMARY KEY,
+    material TEXT NOT NULL UNIQUE,
+    description TEXT
+);
+"""
+
+# Code of a missing or blank material key
+MISSING = -1
+
+def normalize_materials(values):
+    """
+    Canonical text of material keys coming as strings, ints or floats:
+    1000001, 1000001.0, " 1000001 " and "0001000001" (SAP zero padding)
+    all become "1000001". Missing and blank keys become NaN.
+    """
+    values = pd.Series(values, dtype=object)
+    text = values.astype(str).str.strip()
+    text = text.str.replace(r"^(\d+)\.0*$", r"\1", regex=True)
+    numeric = text.str.fullmatch(r"\d+").fillna(False).astype(bool)
+    unpadded = text.str.lstrip("0").replace("", "0")
+    text = text.where(~numeric, unpadded)
+    return text.where(values.notna().to_numpy() & (text != "").to_numpy())
+
+class MaterialIndex:
+    """
+    Persistent dictionary of material keys to small integer codes, shared
+    by the processors so groupbys and cross-report joins run on integers
+    instead of loosely typed strings and floats.
+
+    Codes are assigned once and never change; every process keeps the
+    part of the table it has seen in memory and only goes back to SQLite
+    for materials it does not know yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._codes = {}
+        # Material of each code, by position (codes count up from 1)
+        self._materials = np.array([np.nan], dtype=object)
+        self._max_code = 0
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _refresh(self, con):
+        """Load the codes added since the last refresh (by any process)."""
+        rows = con.execute(
+            "SELECT code, material FROM materials WHERE code > ? ORDER BY code", (self._max_code,)
+        ).fetchall()
+        if not rows:
+            return
+        materials = np.full(rows[-1][0] + 1, np.nan, dtype=object)
+        materials[:len(self._materials)] = self._materials
+        for code, material in rows:
+            self._codes[material] = code
+            materials[code] = material
+        self._materials = materials
+        self._max_code = rows[-1][0]
+
+    def codes(self, values, descriptions=None):
+        """
+        Integer code of every material key in `values` (MISSING for blank
+        keys), registering new materials. `descriptions`, aligned with
+        `values`, are stored for materials seen for the first time.
+        """
+        # Normalize and look up each distinct key once
+        positions, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+        keys = normalize_materials(uniques)
+
+        with self._lock:
+            known = keys.map(self._codes)
+            new = keys[keys.notna() & known.isna()]
+            if len(new):
+                self._register(new.unique().tolist(), keys, positions, descriptions)
+                known = keys.map(self._codes)
+            unique_codes = known.fillna(MISSING).to_numpy(dtype=np.int64)
+
+        codes = np.full(len(positions), MISSING, dtype=np.int64)
+        found = positions >= 0
+        codes[found] = unique_codes[positions[found]]
+        return codes
+
+    def _register(self, new, keys, positions, descriptions):
+        description_of = {}
+        if descriptions is not None:
+            first = pd.Series(np.asarray(descriptions, dtype=object)).groupby(positions).first()
+            for position, value in first.items():
+                key = keys.iloc[position] if position >= 0 else None
+                if isinstance(key, str) and pd.notna(value):
+                    description_of.setdefault(key, value)
+
+        con = self._connect()
+        try:
+            # Another process may have added some of them meanwhile
+            con.execute("BEGIN IMMEDIATE")
+            self._refresh(con)
+            con.executemany(
+                "INSERT OR IGNORE INTO materials (material, description) VALUES (?, ?)",
+                [(key, str(description_of[key]) if key in description_of else None) for key in new if key not in self._codes],
+            )
+            self._refresh(con)
+            con.execute("COMMIT")
+        finally:
+            con.close()
+
+    def materials(self, codes):
+        """Canonical material key of each code (NaN for MISSING)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        with self._lock:
+            if len(codes) and codes.max() > self._max_code:
+                con = self._connect()
+                try:
+                    self._refresh(con)
+                finally:
+                    con.close()
+            materials = self._materials
+        # MISSING (-1) and unknown codes map to NaN
+        codes = np.where((codes > 0) & (codes < len(materials)), codes, 0)
+        return materials[codes]
+
+    def lookup(self, material):
+        """Code, canonical key and description of one material, or None."""
+        key = normalize_materials([material]).iloc[0]
+        if not isinstance(key, str):
+            return None
+        con = self._connect()
+        try:
+            row = con.execute("SELECT code, material, description FROM materials WHERE material = ?", (key,)).fetchone()
+        finally:
+            con.close()
+        return {"code": row[0], "material": row[1], "description": row[2]} if row else None
+
+    def report(self):
+        con = self._connect()
+        try:
+            count, = con.execute("SELECT COUNT(*) FROM materials").fetchone()
+        finally:
+            con.close()
+        return {"materials": count, "path": self.path}
+
+_index = None
+
+def material_index():
+    """The index of this process, stored in the data directory (STOCKSYNC_DATA_DIR)."""
+    global _index
+    if _index is None:
+        _index = MaterialIndex(os.environ.get("STOCKSYNC_MATERIAL_INDEX") or data_path("materials.sqlite"))
+    return _index
@@ -0,0 +1,212 @@
+import sys
+import time
+import functools
+import threading
+import contextlib
+
+try:
+    import psutil
+except ImportError:  # Listed in requirements.txt; without it memory is not measured
+    psutil = None
+
+# Upper bounds (seconds) of the stage duration histogram
+SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Interval (seconds) at which the RSS is sampled while stages are open
+RSS_SAMPLE_SECONDS = 0.01
+
+_local = threading.local()
+
+class RssSampler:
+    """
+    Samples the current resident set size of the process while stages are
+    open, keeping for each the highest value seen since it opened. One
+    daemon thread serves every open stage and sleeps while none is.
+    """
+
+    def __init__(self):
+        self._process = psutil.Process() if psutil is not None else None
+        self._changed = threading.Condition()
+        self._windows = []
+        self._thread = None
+
+    def open(self):
+        """A sampling window to pass to close(), or None when the RSS can't be read."""
+        if self._process is None:
+            return None
+        rss = self._process.memory_info().rss
+        window = {"start": rss, "peak": rss}
+        with self._changed:
+            self._windows.append(window)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._changed.notify()
+        return window
+
+    def close(self, window):
+        """How far the RSS rose above its value when `window` opened, in bytes."""
+        rss = self._process.memory_info().rss
+        with self._changed:
+            self._windows.remove(window)
+        return max(window["peak"], rss) - window["start"]
+
+    def _sample(self):
+        while True:
+            with self._changed:
+                while not self._windows:
+                    self._changed.wait()
+            rss = self._process.memory_info().rss
+            with self._changed:
+                for window in self._windows:
+                    window["peak"] = max(window["peak"], rss)
+            time.sleep(RSS_SAMPLE_SECONDS)
+
+_rss_sampler = RssSampler()
+
+@contextlib.contextmanager
+def collect_stages():
+    """Collect the stage records produced by the current thread."""
+    previous = getattr(_local, "records", None)
+    records = []
+    _local.records = records
+    try:
+        yield records
+    finally:
+        _local.records = previous
+
+def _emit(record):
+    records = getattr(_local, "records", None)
+    if records is not None:
+        records.append(record)
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """
+    Measure one pipeline stage: wall time, rows in and out, and how far
+    the process RSS rose above its value at the start of the stage (None
+    without psutil). Set record["rows_out"] in the block.
+    """
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    window = _rss_sampler.open()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - started
+        record["peak_rss_delta_bytes"] = _rss_sampler.close(window) if window is not None else None
+        _emit(record)
+
+def _is_frame(value):
+    # pandas is only imported by the processors; without it there are no frames
+    pd = sys.modules.get("pandas")
+    return pd is not None and isinstance(value, pd.DataFrame)
+
+def _rows(value):
+    return len(value) if _is_frame(value) else None
+
+def instrumented(name=None):
+    """
+    Decorator measuring a function as a stage. Rows in are those of its
+    DataFrame arguments, rows out those of a returned DataFrame.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            frames = [arg for arg in args if _is_frame(arg)]
+            rows_in = sum(len(frame) for frame in frames) if frames else None
+            with stage(name or fn.__name__, rows_in=rows_in) as record:
+                result = fn(*args, **kwargs)
+                record["rows_out"] = _rows(result)
+                return result
+        return wrapper
+    return decorator
+
+class StageMetrics:
+    """
+    Aggregates processor runs and their stage records for the /metrics
+    endpoint. Records of runs made in the current thread are also kept
+    when it is inside collect_stages(), e.g. for a timing header.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._stages = {}
+
+    def observe(self, processor, records, seconds):
+        with self._lock:
+            run = self._runs.setdefault(processor, {"count": 0, "seconds": 0.0})
+            run["count"] += 1
+            run["seconds"] += seconds
+
+            for record in records:
+                totals = self._stages.setdefault((processor, record["stage"]), {
+                    "count": 0, "seconds": 0.0, "buckets": [0] * len(SECONDS_BUCKETS),
+                    "rows_in": 0, "rows_out": 0, "peak_rss_delta_bytes": None, "max_peak_rss_delta_bytes": None,
+                })
+                totals["count"] += 1
+                totals["seconds"] += record["seconds"]
+                for i, bound in enumerate(SECONDS_BUCKETS):
+                    if record["seconds"] <= bound:
+                        totals["buckets"][i] += 1
+                totals["rows_in"] += record["rows_in"] or 0
+                totals["rows_out"] += record["rows_out"] or 0
+                # Memory totals stay None until a run of the stage measured it
+                delta = record["peak_rss_delta_bytes"]
+                if delta is not None:
+                    totals["peak_rss_delta_bytes"] = (totals["peak_rss_delta_bytes"] or 0) + delta
+                    totals["max_peak_rss_delta_bytes"] = max(totals["max_peak_rss_delta_bytes"] or 0, delta)
+
+        for record in records:
+            _emit({**record, "processor": processor})
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            runs = sorted(self._runs.items())
+            stages = sorted(self._stages.items())
+
+        family("stocksync_processor_runs_total", "counter", "Processor runs.")
+        for processor, run in runs:
+            lines.append(f'stocksync_processor_runs_total{{processor="{processor}"}} {run["count"]}')
+        family("stocksync_processor_seconds_total", "counter", "Wall time spent in processor runs.")
+        for processor, run in runs:
+            lines.append(f'stocksync_processor_seconds_total{{processor="{processor}"}} {run["seconds"]:.6f}')
+
+        family("stocksync_stage_seconds", "histogram", "Wall time of each pipeline stage.")
+        for (processor, name), totals in stages:
+            labels = f'processor="{processor}",stage="{name}"'
+            for bound, count in zip(SECONDS_BUCKETS, totals["buckets"]):
+                lines.append(f'stocksync_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'stocksync_stage_seconds_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+            lines.append(f'stocksync_stage_seconds_sum{{{labels}}} {totals["seconds"]:.6f}')
+            lines.append(f'stocksync_stage_seconds_count{{{labels}}} {totals["count"]}')
+
+        for metric, kind, key, help_text in [
+            ("stocksync_stage_rows_in_total", "counter", "rows_in", "Rows entering each stage."),
+            ("stocksync_stage_rows_out_total", "counter", "rows_out", "Rows leaving each stage."),
+            ("stocksync_stage_peak_rss_delta_bytes_total", "counter", "peak_rss_delta_bytes",
+             "How far the worker RSS rose above its value at the start of each stage."),
+            ("stocksync_stage_peak_rss_delta_bytes_max", "gauge", "max_peak_rss_delta_bytes",
+             "Largest RSS rise seen in one run of each stage."),
+        ]:
+            family(metric, kind, help_text)
+            for (processor, name), totals in stages:
+                # No sample for stages whose memory was never measured
+                if totals[key] is not None:
+                    lines.append(f'{metric}{{processor="{processor}",stage="{name}"}} {totals[key]}')
+
+        return "\n".join(lines) + "\n"
+
+def server_timing(records, total_seconds):
+    """Server-Timing header value for the stage records of one request."""
+    entries = [f'{r["stage"]};dur={r["seconds"] * 1000:.1f}' for r in records]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,92 @@
+import io
+import zipfile
+import importlib.util
+
+# pandas and the writers are imported when a result is written: the server
+# only needs OUTPUT_FORMATS and starts without them
+# Formats a processor result can be written in, with the module each
+# needs beyond pandas
+OUTPUT_FORMATS = {
+    'xlsx': {'extension': 'xlsx', 'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'},
+    'csv': {'extension': 'csv', 'mimetype': 'text/csv'},
+    'parquet': {'extension': 'parquet', 'mimetype': 'application/vnd.apache.parquet', 'requires': 'pyarrow'},
+    'arrow': {'extension': 'arrow', 'mimetype': 'application/vnd.apache.arrow.file', 'requires': 'pyarrow'},
+}
+
+# Not a file format: processors called with it return their result frames
+# as {name: DataFrame} instead of writing them (for previews)
+FRAMES = 'frames'
+
+def missing_requirement(output_format):
+    """The module `output_format` needs that is not installed, else None."""
+    module = OUTPUT_FORMATS[output_format].get('requires')
+    if module and importlib.util.find_spec(module) is None:
+        return module
+    return None
+
+def write_frame(df, output_format='xlsx', number_formats=None):
+    """
+    Write a result DataFrame in `output_format` and return a rewound BytesIO.
+    `number_formats` only applies to XLSX (see write_xlsx).
+    """
+    if output_format == FRAMES:
+        return {'result': df}
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {list(OUTPUT_FORMATS)}")
+
+    if output_format == 'xlsx':
+        from xlsx_writer import write_xlsx
+        return write_xlsx(df, number_formats=number_formats)
+
+    output = io.BytesIO()
+    if output_format == 'csv':
+        df.to_csv(output, index=False, encoding='utf-8')
+    else:
+        pa = _pyarrow(output_format)
+        table = pa.Table.from_pandas(_arrow_compatible(df), preserve_index=False)
+        if output_format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, output)
+        else:
+            with pa.ipc.new_file(output, table.schema) as writer:
+                writer.write_table(table)
+
+    output.seek(0)
+    return output
+
+def write_frames(frames, output_format='xlsx', name_prefix='Result'):
+    """
+    Write several named DataFrames: one sheet each for XLSX, otherwise a
+    ZIP with one `<name_prefix>-<name>.<ext>` file each.
+    """
+    if output_format == FRAMES:
+        return dict(frames)
+    if output_format == 'xlsx':
+        from xlsx_writer import write_xlsx
+        return write_xlsx(frames)
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, df in frames.items():
+            data = write_frame(df, output_format)
+            z.writestr(f"{name_prefix}-{name}.{OUTPUT_FORMATS[output_format]['extension']}", data.getvalue())
+    output.seek(0)
+    return output
+
+def _pyarrow(output_format):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError(f"The '{output_format}' output format requires pyarrow to be installed")
+    return pyarrow
+
+def _arrow_compatible(df):
+    """Turn object columns mixing numbers and text (common in SAP ids) into text."""
+    import pandas as pd
+    mixed = [
+        col for col in df.columns
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer')
+    ]
+    if not mixed:
+        return df
+    return df.assign(**{col: df[col].astype(str).where(df[col].notna()) for col in mixed})
@@ -1,16 +1,34 @@
 import pandas as pd
 import io
+import re
+import csv
 from openpyxl.utils import get_column_letter
-
-def process_global_orders(me2n_file, lotus_file):
+from excel_reader import read_excel
+from output_formats import write_frame
+from metrics import instrumented
+from material_index import material_index
+from engines import processing_engine
+from schemas import compact
+
+def process_global_orders(me2n_file, lotus_file, progress=None, output_format='xlsx'):
     """
     Main pipeline: Accepts file-like objects from Flask, 
-    processes them in-memory, and returns a BytesIO buffer.
+    processes them in-memory, and returns a BytesIO buffer
+    in `output_format` (xlsx, csv, parquet or arrow).
+    `progress` is called with the name of each stage as it starts.
     """
     try:
         print("Starting in-memory global orders processing pipeline...")
 
+        if processing_engine() == "polars":
+            from processors.polars_engine import global_orders_frame
+            if progress: progress("parse")
+            result = global_orders_frame(me2n_file, lotus_file, progress)
+            if progress: progress("write")
+            return write_global_orders(result, output_format)
+
         # Step 1: Process ME2N/SAP file
+        if progress: progress("parse")
         df_me2n = filter_me2n(me2n_file)
         if df_me2n is None:
             return None
@@ -21,30 +39,40 @@ def process_global_orders(me2n_file, lotus_file):
             return None
 
         # Step 3: Combine both dataframes
+        if progress: progress("match")
         combined_df = sum_global_orders(df_lotus, df_me2n)
         if combined_df is None:
             return None
 
         # Step 4: Final aggregation and export to buffer
-        return extract_excel_data(combined_df)
+        return extract_excel_data(combined_df, progress, output_format)
 
     except Exception as e:
         print(f"Error in global orders processing: {str(e)}")
         return None
 
+# Columns of an ME2N export used by the pipeline
+ME2N_COLUMNS = [
+    "Purchasing Document", "Document Date", "Vendor/supplying plant",
+    "Material", "Short Text", "Storage Location", "Order Quantity",
+    "Still to be delivered (qty)", "Req. Tracking Number"
+]
+
+def read_me2n(excel_file):
+    """The ME2N columns of an export, in ME2N_COLUMNS order (missing ones left out), compacted."""
+    df = read_excel(
+        excel_file,
+        columns=ME2N_COLUMNS,
+        dtype={"Short Text": str, "Req. Tracking Number": str},
+    )
+    return compact(df[[col for col in ME2N_COLUMNS if col in df.columns]], "me2n")
+
+@instrumented()
 def filter_me2n(excel_file):
     """Filter the ME2N file stream."""
     try:
-        df = pd.read_excel(excel_file)
-        columns_to_extract = [
-            "Purchasing Document", "Document Date", "Vendor/supplying plant",
-            "Material", "Short Text", "Storage Location", "Order Quantity",
-            "Still to be delivered (qty)", "Req. Tracking Number"
-        ]
-
         # Filter columns and drop NaNs
-        existing_cols = [col for col in columns_to_extract if col in df.columns]
-        df = df[existing_cols].dropna(subset=["Storage Location", "Material"])
+        df = read_me2n(excel_file).dropna(subset=["Storage Location", "Material"])
         
         # Keep non-zero delivery quantities
         if "Still to be delivered (qty)" in df.columns:
@@ -55,41 +83,83 @@ def filter_me2n(excel_file):
         print(f"Error in filter_me2n: {str(e)}")
         return None
 
+# Columns of an Excel LOTUS export used by the pipeline
+LOTUS_COLUMNS = [
+    "OrderID", "Pos. no", "Product name", "SAP article no",
+    "Quantity", "SAP PO number", "CC", "Req. Tracking Number"
+]
+
+# Header-less LOTUS CSV export, in file order
+LOTUS_CSV_COLUMNS = [
+    "OrderID", "Col2", "Pos. no", "Activity", "Product name", 
+    "SAP article no", "Quantity", "Price (EUR)", "SAP PO number", 
+    "SAP PR number", "Process started on", "CC", "Col13",
+    "Cost type number", "Cost type description", "Supplier",
+    "Budget position", "Creator delivery date"
+]
+
+# Every CSV column is parsed as text, these ones are then made numeric
+LOTUS_CSV_NUMERIC = ["Price (EUR)", "Quantity", "CC"]
+
+def read_lotus_csv(file_storage):
+    """
+    Parse a LOTUS CSV export in a single pass.
+
+    Some exports wrap each whole line in quotes ("a,b,c"); those lines are
+    unwrapped before parsing and their inner quotes are kept as text.
+    """
+    first_line = file_storage.readline().decode('utf-8')
+    file_storage.seek(0)
+    first_fields = next(csv.reader([first_line]), [])
+    wrapped = len(first_fields) == 1 and ',' in first_fields[0]
+
+    options = dict(
+        header=None, names=LOTUS_CSV_COLUMNS, index_col=False,
+        dtype=str, encoding='utf-8',
+    )
+    if wrapped:
+        raw = file_storage.read()
+        raw = re.sub(rb'^"(.*)"(\r?)$', rb'\1\2', raw, flags=re.M).replace(b'""', b'"')
+        df = pd.read_csv(io.BytesIO(raw), quoting=csv.QUOTE_NONE, **options)
+    else:
+        df = pd.read_csv(file_storage, quotechar='"', **options)
+
+    # Numeric conversion for specific columns (decimal comma in prices)
+    df["Price (EUR)"] = df["Price (EUR)"].str.replace(',', '.', regex=False)
+    for col in LOTUS_CSV_NUMERIC:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+def tracking_numbers(order_ids, positions):
+    """
+    Vectorized Req. Tracking Number: "year/order" ids become
+    "order/year/pos", any other id "id/pos".
+    """
+    oid = order_ids.astype(str).str.strip()
+    pos = positions.astype(str).str.strip()
+    parts = oid.str.partition('/')
+    year, slash, order_num = parts[0], parts[1], parts[2]
+    return (order_num + '/' + year + '/' + pos).where(slash == '/', oid + '/' + pos)
+
+def read_lotus(file_storage):
+    """A LOTUS export, CSV (every column) or Excel (LOTUS_COLUMNS), compacted."""
+    if file_storage.filename.lower().endswith('.csv'):
+        return compact(read_lotus_csv(file_storage), "lotus")
+    return compact(read_excel(
+        file_storage,
+        columns=LOTUS_COLUMNS,
+        dtype={"OrderID": str, "Pos. no": str, "Product name": str},
+    ), "lotus")
+
+@instrumented()
 def filter_lotus(file_storage):
     """Process LOTUS file (CSV or Excel) entirely in memory."""
     try:
-        filename = file_storage.filename.lower()
-        
-        if filename.endswith('.csv'):
-            # Replicating your _convert_csv_to_excel logic but into a DataFrame
-            column_names = [
-                "OrderID", "Col2", "Pos. no", "Activity", "Product name", 
-                "SAP article no", "Quantity", "Price (EUR)", "SAP PO number", 
-                "SAP PR number", "Process started on", "CC", "Col13",
-                "Cost type number", "Cost type description", "Supplier",
-                "Budget position", "Creator delivery date"
-            ]
-            
-            df = pd.read_csv(file_storage, header=None, quotechar='"', encoding='utf-8')
-            if df.shape[1] == 1:
-                df = df[0].str.split(',', expand=True)
-            
-            # Map columns safely
-            num_cols = min(len(column_names), df.shape[1])
-            df.columns = column_names[:num_cols]
-            
-            # Numeric conversion for specific columns
-            for col in ["Price (EUR)", "Quantity", "CC"]:
-                if col in df.columns:
-                    if col == "Price (EUR)":
-                        df[col] = df[col].astype(str).str.replace(',', '.')
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-        else:
-            df = pd.read_excel(file_storage)
+        df = read_lotus(file_storage)
 
         # Apply specific LOTUS filters
         if "SAP PO number" in df.columns:
-            df = df[df["SAP PO number"].isna() | (df["SAP PO number"] == "") | (df["SAP PO number"] == 0)]
+            df = df[df["SAP PO number"].isna() | df["SAP PO number"].isin(["", "0", 0])]
         
         if "SAP article no" in df.columns:
             df = df[df["SAP article no"].notna()]
@@ -99,21 +169,14 @@ def filter_lotus(file_storage):
 
         # Create Req. Tracking Number
         if "OrderID" in df.columns and "Pos. no" in df.columns:
-            def create_tracking(row):
-                oid = str(row['OrderID']).strip()
-                pos = str(row['Pos. no']).strip()
-                if '/' in oid:
-                    year, order_num = oid.split('/', 1)
-                    return f"{order_num}/{year}/{pos}"
-                return f"{oid}/{pos}"
-            
-            df['Req. Tracking Number'] = df.apply(create_tracking, axis=1)
+            df = df.assign(**{'Req. Tracking Number': tracking_numbers(df['OrderID'], df['Pos. no'])})
 
         return df
     except Exception as e:
         print(f"Error in filter_lotus: {str(e)}")
         return None
 
+@instrumented()
 def sum_global_orders(lotus_df, me2n_df):
     """Aligns columns and concatenates DataFrames."""
     try:
@@ -139,31 +202,37 @@ def sum_global_orders(lotus_df, me2n_df):
         print(f"Error in sum_global_orders: {str(e)}")
         return None
 
-def extract_excel_data(combined_df):
+@instrumented()
+def write_global_orders(result, output_format='xlsx'):
+    """Write the aggregated orders; in XLSX article numbers (column A) are shown in full."""
+    # Formatting: Prevent scientific notation in Excel
+    return write_frame(result, output_format, number_formats={'A': '0'})
+
+@instrumented()
+def extract_excel_data(combined_df, progress=None, output_format='xlsx'):
     """Aggregates data and writes to a BytesIO buffer with formatting."""
     try:
+        if progress: progress("aggregate")
         # Columns for final output
         cols = ["SAP article no", "Product name", "Quantity"]
         existing = [c for c in cols if c in combined_df.columns]
         
         df_subset = combined_df[existing].copy()
+        df_subset["material_code"] = material_index().codes(df_subset["SAP article no"], df_subset["Product name"])
         df_subset["SAP article no"] = pd.to_numeric(df_subset["SAP article no"], errors='coerce')
+        df_subset = df_subset[df_subset["SAP article no"].notna()]
         
-        # Group and Sum
-        result = df_subset.groupby(['SAP article no', 'Product name'], as_index=False)['Quantity'].sum()
+        # Group and Sum on the material codes, sorted by article number as before
+        result = df_subset.groupby(['material_code', 'Product name'], as_index=False, sort=False).agg({
+            'SAP article no': 'first',
+            'Quantity': 'sum',
+        })
+        result = result[cols].sort_values(['SAP article no', 'Product name'], ignore_index=True)
 
         # Write to memory buffer
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            result.to_excel(writer, index=False, sheet_name='Sheet1')
-            
-            # Formatting: Prevent scientific notation in Excel
-            ws = writer.sheets['Sheet1']
-            for cell in ws['A']: # Assuming SAP article no is column A
-                cell.number_format = '0'
-
-        output.seek(0)
-        return output
+        if progress: progress("write")
+        
+        return write_global_orders(result, output_format)
     except Exception as e:
         print(f"Error in extract_excel_data: {str(e)}")
         return None
@@ -1,105 +1,145 @@
-import pandas as pd
-import io
+import numpy as np
+from excel_reader import read_excel
+from output_formats import write_frame
+from metrics import instrumented, stage
+from schemas import compact
 
-def process_mb51(mb51_file, movement_type):
+REQUIRED_COLUMNS = [
+    "Posting Date", "Material", "Material Description", "Purchase order",
+    "Qty in unit of entry", "Vendor", "Movement type", 
+    "Document Header Text", "Unit of Entry", "Amt.in loc.cur.", 
+    "Cost Center", "Material Document", "Storage Location", "Reference"
+]
+
+# Candidate ranks, in the order a reversal consumes them
+MATCH_EXACT, MATCH_PARTIAL, MATCH_POSITIVE = 0, 1, 2
+MATCH_KINDS = {MATCH_EXACT: "match", MATCH_PARTIAL: "partial", MATCH_POSITIVE: "positive"}
+
+@instrumented()
+def load_mb51(mb51_file, columns=None):
     """
-    Process an MB51 Excel file in-memory to handle movement types 101/102 or 121/122.
+    Read and clean an MB51 export, the required columns in their compact
+    dtypes. Every column of the export is kept, since the processor writes
+    the cleaned export back, unless `columns` limits the read to those.
     """
-    required_columns = [
-        "Posting Date", "Material", "Material Description", "Purchase order",
-        "Qty in unit of entry", "Vendor", "Movement type", 
-        "Document Header Text", "Unit of Entry", "Amt.in loc.cur.", 
-        "Cost Center", "Material Document", "Storage Location", "Reference"
-    ]
+    df = read_excel(mb51_file, columns=columns, dtype={"Document Header Text": str})
+    
+    # Validate required columns
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
     
+    # Data Cleaning
+    df = df.dropna(subset=["Posting Date"])
+    df['Document Header Text'] = df['Document Header Text'].astype(str).str.extract(r'(\S+)')
+    return compact(df, "mb51")
+
+def po_column(movement_type):
+    """Column pairing a reversal with its (x1) row: the PO for 102, the header text for 122."""
+    return "Purchase order" if movement_type == 102 else "Document Header Text"
+
+@instrumented()
+def resolve_reversals(df_x01, df_x02, po_col):
+    """
+    Resolve every (x2) reversal row against the (x1) rows sharing its
+    Material and PO key.
+
+    Both frames are joined on (Material, PO key) once, so a reversal only
+    ever looks at its own group. For each reversal the first exact match
+    wins, then the first partial (negative sum), then the first positive
+    sum, candidates being taken in frame order.
+
+    Returns one row per matched reversal, in reversal order, with the
+    labels of both rows (label_x02, label_x01), the MATCH_* rank and the
+    reversal quantity.
+    """
+    qty = "Qty in unit of entry"
+    keys = ["Material", po_col]
+
+    # NaN never equals itself, so those rows could never be matched
+    x02 = df_x02[keys + [qty]].dropna(subset=keys)
+    x01 = df_x01[keys + [qty]].dropna(subset=keys)
+    x02 = x02.assign(label_x02=x02.index, order_x02=np.arange(len(x02)))
+    x01 = x01.assign(label_x01=x01.index, order_x01=np.arange(len(x01)))
+
+    pairs = x02.merge(x01, on=keys, suffixes=("_x02", "_x01"))
+    total = pairs[f"{qty}_x02"] + pairs[f"{qty}_x01"]
+    pairs["rank"] = np.select([total == 0, total > 0], [MATCH_EXACT, MATCH_POSITIVE], default=MATCH_PARTIAL)
+
+    # Keep the best candidate of each reversal
+    chosen = (
+        pairs.sort_values(["order_x02", "rank", "order_x01"], kind="stable")
+        .drop_duplicates("order_x02")
+        .sort_values("order_x02", kind="stable")
+    )
+
+    return chosen[["label_x02", "label_x01", "rank", f"{qty}_x02"]].rename(columns={f"{qty}_x02": "qty_x02"})
+
+def match_reversals(df_x01, df_x02, po_col):
+    """
+    Returns the labels of the rows to delete and the ordered list of
+    (x1 label, reversal qty) pairs that partially reverse an (x1) row.
+    See resolve_reversals for the priority rules.
+    """
+    chosen = resolve_reversals(df_x01, df_x02, po_col)
+
+    is_partial = chosen["rank"] == MATCH_PARTIAL
+    rows_to_delete = chosen["label_x02"].tolist() + chosen.loc[~is_partial, "label_x01"].tolist()
+    partial_matches = list(zip(chosen.loc[is_partial, "label_x01"], chosen.loc[is_partial, "qty_x02"]))
+
+    return rows_to_delete, partial_matches
+
+@instrumented()
+def apply_partial_matches(df, partial_matches):
+    """Partial/Negative Sum: shrink each (x1) row and re-price it at its unit price."""
+    for idx_x01, qty_x02 in partial_matches:
+        qty_x01 = df.loc[idx_x01, "Qty in unit of entry"]
+        new_qty = qty_x01 + qty_x02
+
+        # Math for price adjustment
+        price = df.loc[idx_x01, "Amt.in loc.cur."]
+        pu = abs(price) / abs(qty_x01) if qty_x01 != 0 else 0
+
+        df.at[idx_x01, "Qty in unit of entry"] = new_qty
+        df.at[idx_x01, "Amt.in loc.cur."] = new_qty * pu
+
+
+def map_storage_locations(df):
+    """Report storage location 1000 under 8888."""
+    return df.assign(**{'Storage Location': df['Storage Location'].replace({1000: 8888})})
+
+def process_mb51(mb51_file, movement_type, progress=None, output_format='xlsx'):
+    """
+    Process an MB51 Excel file in-memory to handle movement types 101/102 or 121/122.
+    The result is returned as a BytesIO in `output_format` (xlsx, csv, parquet or arrow).
+    `progress` is called with the name of each stage as it starts.
+    """
     try:
         # Load directly from the Flask file stream
-        df = pd.read_excel(mb51_file)
-        
-        # Validate required columns
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {missing_columns}")
-        
-        # Data Cleaning
-        df = df.dropna(subset=["Posting Date"])
-        df['Document Header Text'] = df['Document Header Text'].astype(str).str.extract(r'(\S+)')
+        if progress: progress("parse")
+        df = load_mb51(mb51_file)
         
         # Define the 'PO' column dynamically based on your movement logic
-        # Note: Your original code had a small typo 'Purhcase', fixed here.
-        po_col = "Purchase order" if movement_type == 102 else "Document Header Text"
+        po_col = po_column(movement_type)
         
         # Split dataframes for processing
         df_x02 = df[df["Movement type"] == movement_type].copy()
         df_x01 = df[df["Movement type"] == (movement_type - 1)].copy()
         
-        rows_to_delete = []
-
-        # Logic Loop
-        for idx_x02, row_x02 in df_x02.iterrows():
-            mat = row_x02["Material"]
-            po = row_x02[po_col]
-            qty_x02 = row_x02["Qty in unit of entry"]
-            
-            # Find matching (x-1) rows
-            matching_x01 = df_x01[
-                (df_x01["Material"] == mat) &
-                (df_x01[po_col] == po)
-            ]
-            
-            if len(matching_x01) == 0:
-                continue
-            
-            candidates = []
-            for idx_x01, row_x01 in matching_x01.iterrows():
-                qty_x01 = row_x01["Qty in unit of entry"]
-                if qty_x01 + qty_x02 == 0:
-                    candidates.append((idx_x01, "match"))
-                elif qty_x01 + qty_x02 > 0:
-                    candidates.append((idx_x01, "positive"))
-                else:
-                    candidates.append((idx_x01, "partial"))
-            
-            # Priority 1: Exact matches
-            exact = [c for c in candidates if c[1] == "match"]
-            if exact:
-                rows_to_delete.extend([idx_x02, exact[0][0]])
-                continue
-
-            # Priority 2: Partial/Negative Sum
-            partial = [c for c in candidates if c[1] == "partial"]
-            if partial:
-                idx_x01 = partial[0][0]
-                qty_x01 = df.loc[idx_x01, "Qty in unit of entry"]
-                new_qty = qty_x01 + qty_x02
-                
-                # Math for price adjustment
-                price = df.loc[idx_x01, "Amt.in loc.cur."]
-                pu = abs(price) / abs(qty_x01) if qty_x01 != 0 else 0
-                
-                df.at[idx_x01, "Qty in unit of entry"] = new_qty
-                df.at[idx_x01, "Amt.in loc.cur."] = new_qty * pu
-                rows_to_delete.append(idx_x02)
-                continue
-
-            # Priority 3: Positive Sum
-            positive = [c for c in candidates if c[1] == "positive"]
-            if positive:
-                rows_to_delete.extend([idx_x02, positive[0][0]])
+        if progress: progress("match")
+        rows_to_delete, partial_matches = match_reversals(df_x01, df_x02, po_col)
+        apply_partial_matches(df, partial_matches)
 
         # Cleanup
+        if progress: progress("aggregate")
         df = df.drop(rows_to_delete)
         
-        # Replace 'Storage Location' column that equals 1000 with 8888 and color it blue
-        df['Storage Location'] = df['Storage Location'].apply(lambda x: 8888 if x == 1000 else x)
+        df = map_storage_locations(df)
 
         # Export to BytesIO
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
-        output.seek(0)
-        
-        return output
+        if progress: progress("write")
+        with stage("write_mb51", rows_in=len(df)):
+            return write_frame(df, output_format)
 
     except Exception as e:
         print(f"Error in MB51 processor: {e}")
@@ -0,0 +1,243 @@
+import sqlite3
+import datetime
+import pandas as pd
+from output_formats import write_frames
+from metrics import instrumented
+from schemas import expand
+from processors.mb51 import (
+    REQUIRED_COLUMNS, MATCH_PARTIAL, MATCH_KINDS,
+    load_mb51, po_column, resolve_reversals, apply_partial_matches, map_storage_locations,
+)
+
+# Columns identifying an MB51 line across overlapping exports
+KEY_COLUMNS = [
+    "Material Document", "Material", "Movement type", "Posting Date", "Qty in unit of entry",
+    "Amt.in loc.cur.", "Storage Location", "Purchase order", "Reference", "Document Header Text",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_rows (
+    movement_type INTEGER NOT NULL,
+    row_key TEXT NOT NULL,
+    PRIMARY KEY (movement_type, row_key)
+);
+CREATE TABLE IF NOT EXISTS open_rows (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    movement_type INTEGER NOT NULL,
+    row_key TEXT NOT NULL,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS open_rows_movement_type ON open_rows (movement_type);
+CREATE TABLE IF NOT EXISTS resolved_pairs (
+    movement_type INTEGER NOT NULL,
+    reversal_key TEXT NOT NULL,
+    receipt_key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    resolved_at TEXT NOT NULL
+);
+""".format(columns=",\n    ".join(f'"{col}"' for col in REQUIRED_COLUMNS))
+
+QUOTED_COLUMNS = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+
+# resolved_pairs columns describing each pair, and their Resolved sheet names;
+# stores written before they existed get them added (see connect)
+PAIR_COLUMNS = {
+    "material": "Material",
+    "reversal_document": "Reversal document",
+    "receipt_document": "Receipt document",
+    "quantity": "Reversed quantity",
+    "kind": "Match",
+    "resolved_at": "Resolved at",
+}
+
+def connect(store_path):
+    con = sqlite3.connect(store_path, timeout=30, isolation_level=None)
+    con.executescript(SCHEMA)
+    con.execute("BEGIN IMMEDIATE")
+    existing = {row[1] for row in con.execute("PRAGMA table_info(resolved_pairs)")}
+    for column in PAIR_COLUMNS:
+        if column not in existing:
+            con.execute(f"ALTER TABLE resolved_pairs ADD COLUMN {column}")
+    con.execute("COMMIT")
+    return con
+
+def row_keys(df):
+    """
+    Stable key of each row: a hash of its identity columns plus the
+    occurrence number, so identical lines in one export stay distinct.
+    """
+    canonical = {}
+    for col in KEY_COLUMNS:
+        # Keys stay the ones of exports read before the compact dtypes
+        values = expand(df[col])
+        if pd.api.types.is_datetime64_any_dtype(values):
+            canonical[col] = values.dt.strftime("%Y-%m-%d %H:%M:%S")
+            continue
+        # 4711 and 4711.0 (or "4711" in a mixed column) are the same id
+        numbers = pd.to_numeric(values, errors="coerce")
+        canonical[col] = numbers.astype(str).where(numbers.notna(), values.astype(str))
+
+    hashed = pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).astype(str)
+    occurrence = hashed.groupby(hashed).cumcount().astype(str)
+    return (hashed + "-" + occurrence).to_numpy()
+
+def load_open_rows(con, movement_type):
+    return pd.read_sql_query(
+        f"SELECT seq, row_key, {QUOTED_COLUMNS} FROM open_rows WHERE movement_type = ? ORDER BY seq",
+        con, params=(movement_type,), parse_dates=["Posting Date"],
+    )
+
+def load_resolved_pairs(con, movement_type):
+    """Every pair resolved for `movement_type`, oldest first, with the Resolved sheet columns."""
+    columns = ", ".join(f'{column} AS "{name}"' for column, name in PAIR_COLUMNS.items())
+    return pd.read_sql_query(
+        f"SELECT {columns} FROM resolved_pairs WHERE movement_type = ? ORDER BY rowid",
+        con, params=(movement_type,),
+    )
+
+def resolved_pairs(rows, chosen, movement_type):
+    """resolved_pairs records of the (reversal, receipt) pairs in `chosen`."""
+    resolved_at = datetime.datetime.now().isoformat(timespec="seconds")
+    reversals = rows.loc[chosen["label_x02"]].reset_index(drop=True)
+    receipts = rows.loc[chosen["label_x01"]].reset_index(drop=True)
+    pairs = pd.DataFrame({
+        "movement_type": movement_type,
+        "reversal_key": reversals["row_key"],
+        "receipt_key": receipts["row_key"],
+        "kind": chosen["rank"].map(MATCH_KINDS).to_numpy(),
+        "resolved_at": resolved_at,
+        "material": reversals["Material"],
+        "reversal_document": reversals["Material Document"],
+        "receipt_document": receipts["Material Document"],
+        "quantity": chosen["qty_x02"].to_numpy(),
+    })
+    return _records(pairs, list(pairs.columns))
+
+def _records(df, columns):
+    """Rows of `df` as tuples of plain Python values for sqlite."""
+    values = df[columns].copy()
+    if "Posting Date" in columns:
+        values["Posting Date"] = values["Posting Date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    values = values.astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+@instrumented()
+def save_changes(con, movement_type, new_keys, added, updated, removed, pairs):
+    con.executemany(
+        "INSERT OR IGNORE INTO seen_rows (movement_type, row_key) VALUES (?, ?)",
+        [(movement_type, key) for key in new_keys],
+    )
+    con.executemany("DELETE FROM open_rows WHERE seq = ?", [(int(seq),) for seq in removed["seq"]])
+    con.executemany(
+        'UPDATE open_rows SET "Qty in unit of entry" = ?, "Amt.in loc.cur." = ? WHERE seq = ?',
+        _records(updated, ["Qty in unit of entry", "Amt.in loc.cur.", "seq"]),
+    )
+    placeholders = ", ".join("?" * (len(REQUIRED_COLUMNS) + 2))
+    con.executemany(
+        f"INSERT INTO open_rows (movement_type, row_key, {QUOTED_COLUMNS}) VALUES ({placeholders})",
+        [(movement_type,) + row for row in _records(added, ["row_key"] + REQUIRED_COLUMNS)],
+    )
+    con.executemany(
+        "INSERT INTO resolved_pairs (movement_type, reversal_key, receipt_key, kind, resolved_at, "
+        "material, reversal_document, receipt_document, quantity) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        pairs,
+    )
+
+def reset_mb51_state(store_path, movement_type):
+    """Forget everything stored for `movement_type`."""
+    con = connect(store_path)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        for table in ("seen_rows", "open_rows", "resolved_pairs"):
+            con.execute(f"DELETE FROM {table} WHERE movement_type = ?", (movement_type,))
+        con.execute("COMMIT")
+    finally:
+        con.close()
+
+def process_mb51_incremental(mb51_file, movement_type, store_path, progress=None, output_format='xlsx'):
+    """
+    Incremental version of process_mb51 for overlapping daily exports.
+
+    The rows left after reconciliation (open receipts, unmatched reversals
+    and everything else) are kept in the SQLite store at `store_path`
+    together with the pairs already resolved. Rows of the upload that were
+    seen in an earlier run are skipped; the new ones are matched against
+    the open rows only, with the same priority rules as process_mb51.
+    A stored receipt that was partially reversed is matched on its
+    remaining quantity.
+
+    Returns the "Delta" (rows added, updated or removed by this upload,
+    see the Change column), the "Consolidated" open rows and every pair
+    "Resolved" so far as sheets of one XLSX, or as a ZIP of three files
+    for the other formats.
+    """
+    try:
+        if progress: progress("parse")
+        # Only the required columns are stored and written
+        upload = load_mb51(mb51_file, columns=REQUIRED_COLUMNS)
+        upload["row_key"] = row_keys(upload)
+        po_col = po_column(movement_type)
+
+        con = connect(store_path)
+        try:
+            # One run at a time per store
+            con.execute("BEGIN IMMEDIATE")
+
+            if progress: progress("match")
+            seen = pd.read_sql_query(
+                "SELECT row_key FROM seen_rows WHERE movement_type = ?", con, params=(movement_type,)
+            )["row_key"]
+            new_rows = upload[~upload["row_key"].isin(seen)]
+            stored = load_open_rows(con, movement_type)
+
+            # Stored rows first, so they keep their place as match candidates
+            if stored.empty:
+                rows = new_rows.assign(seq=pd.NA).reset_index(drop=True)
+            else:
+                rows = pd.concat([stored, new_rows.assign(seq=pd.NA)], ignore_index=True)
+
+            df_x02 = rows[rows["Movement type"] == movement_type]
+            df_x01 = rows[rows["Movement type"] == (movement_type - 1)]
+            chosen = resolve_reversals(df_x01, df_x02, po_col)
+
+            is_partial = chosen["rank"] == MATCH_PARTIAL
+            apply_partial_matches(rows, zip(chosen.loc[is_partial, "label_x01"], chosen.loc[is_partial, "qty_x02"]))
+
+            if progress: progress("aggregate")
+            deleted = rows.index.isin(chosen["label_x02"]) | rows.index.isin(chosen.loc[~is_partial, "label_x01"])
+            is_stored = rows["seq"].notna()
+            added = rows[~is_stored & ~deleted]
+            updated = rows[is_stored & ~deleted & rows.index.isin(chosen.loc[is_partial, "label_x01"])]
+            removed = rows[is_stored & deleted]
+
+            pairs = resolved_pairs(rows, chosen, movement_type)
+            save_changes(con, movement_type, new_rows["row_key"], added, updated, removed, pairs)
+            resolved = load_resolved_pairs(con, movement_type)
+            con.execute("COMMIT")
+        except Exception:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+        delta = pd.concat([
+            added[REQUIRED_COLUMNS].assign(Change="added"),
+            updated[REQUIRED_COLUMNS].assign(Change="updated"),
+            removed[REQUIRED_COLUMNS].assign(Change="removed"),
+        ], ignore_index=True)
+        consolidated = rows.loc[~deleted, REQUIRED_COLUMNS]
+
+        if progress: progress("write")
+        return write_frames(
+            {
+                "Delta": map_storage_locations(delta),
+                "Consolidated": map_storage_locations(consolidated),
+                "Resolved": resolved,
+            },
+            output_format, name_prefix="MB51",
+        )
+
+    except Exception as e:
+        print(f"Error in incremental MB51 processor: {e}")
+        return None
@@ -1,80 +1,274 @@
 import pandas as pd
 import io
+import os
 import zipfile
 from datetime import datetime
+from excel_reader import read_excel, ParsedWorkbook
+from output_formats import OUTPUT_FORMATS, FRAMES, write_frame
+from metrics import stage
+from material_index import material_index, MISSING
+from engines import processing_engine
+from schemas import compact
 
-def process_mb52(mb52_file):
-    """Process MB52 file and separate into different storage locations in memory."""
+MB52_COLUMNS = ["Material Number", "Storage Location", "Material Description", "Unrestricted"]
+
+# Exports larger than this are aggregated in streaming mode (see process_mb52)
+STREAMING_THRESHOLD_BYTES = int(os.environ.get("STOCKSYNC_MB52_STREAMING_MB", 100)) * 1024 * 1024
+STREAMING_CHUNK_ROWS = 50_000
+
+def load_mb52(mb52_file):
+    """Read an MB52 export with numeric storage locations (Int16, blank if not a number) and quantities."""
+    columns_to_keep = MB52_COLUMNS
+
+    # Read only the needed columns, material numbers as text
+    with stage("read_mb52") as record:
+        df = read_excel(mb52_file, columns=columns_to_keep, dtype={"Material Number": str})
+        record["rows_out"] = len(df)
+
+    # Ensure all required columns exist
+    for column in columns_to_keep:
+        if column not in df.columns:
+            raise ValueError(f"Required column '{column}' not found in the input file")
+
+    # Data conversion
+    df["Storage Location"] = pd.to_numeric(df["Storage Location"], errors='coerce')
+    df["Unrestricted"] = pd.to_numeric(df["Unrestricted"], errors='coerce').fillna(0)
+    return compact(df, "mb52")
+
+def group_mb52(df):
+    """
+    Stock per material for each reported location: 8888 (1000 and 8888
+    combined) and 9999. Locations without stock lines are left out.
+
+    Materials are grouped on their material index code, so "0001000001"
+    and "1000001" are the same material (one row), reported under the
+    first Material Number seen for it, as written in the export.
+    """
+    groups = {}
+    index = material_index()
+    with stage("material_codes", rows_in=len(df)):
+        df = df.assign(material_code=index.codes(df["Material Number"], df["Material Description"]))
+    df = df[df["material_code"] != MISSING]
+
+    def group_stock(frame, keys):
+        grouped = frame.groupby(["material_code"] + keys, sort=False).agg({
+            "Material Number": "first",
+            "Material Description": "first",
+            "Unrestricted": "sum",
+        }).reset_index()
+        grouped = grouped.drop(columns="material_code")
+        grouped.insert(0, "Material Number", grouped.pop("Material Number"))
+        return grouped.sort_values(["Material Number"] + keys, ignore_index=True)
+
+    # --- Step 1 & 2: Filter/Group Storage Location 8888 & 1000 ---
+    df_8888_1000 = df[df["Storage Location"].isin([8888, 1000])]
+    if not df_8888_1000.empty:
+        with stage("group_8888_1000", rows_in=len(df_8888_1000)) as record:
+            combined_8888 = group_stock(df_8888_1000, [])
+            combined_8888["Storage Location"] = 8888
+            record["rows_out"] = len(combined_8888)
+        groups["8888"] = combined_8888
+
+    # --- Step 3: Handle Storage Location 9999 ---
+    df_9999 = df[df["Storage Location"] == 9999]
+    if not df_9999.empty:
+        with stage("group_9999", rows_in=len(df_9999)) as record:
+            grouped_9999 = group_stock(df_9999, ["Storage Location"])
+            record["rows_out"] = len(grouped_9999)
+        groups["9999"] = grouped_9999
+
+    return groups
+
+def iter_mb52_chunks(mb52_file, chunk_rows=STREAMING_CHUNK_ROWS):
+    """
+    Yield the MB52 columns of the first sheet as DataFrames of at most
+    `chunk_rows` rows, streamed by openpyxl's read-only mode so the sheet
+    is never loaded as a whole.
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(mb52_file, read_only=True, data_only=True)
     try:
-        print(f"Processing MB52 file stream...")
-        
-        # Read the Excel file stream directly
-        df = pd.read_excel(mb52_file)
-        
-        columns_to_keep = ["Material Number", "Storage Location", "Material Description", "Unrestricted"]
-        
-        # Ensure all required columns exist
-        for column in columns_to_keep:
-            if column not in df.columns:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        for column in MB52_COLUMNS:
+            if column not in header:
                 raise ValueError(f"Required column '{column}' not found in the input file")
-        
-        # Data conversion
-        df["Material Number"] = df["Material Number"].astype(str)
-        df["Storage Location"] = pd.to_numeric(df["Storage Location"], errors='coerce')
-        df["Unrestricted"] = pd.to_numeric(df["Unrestricted"], errors='coerce').fillna(0)
-        
-        # Dictionary to store our in-memory files
-        # Key: filename, Value: BytesIO object
-        output_mem_files = {}
-
-        # --- Step 1 & 2: Filter/Group Storage Location 8888 & 1000 ---
-        df_8888_1000 = df[df["Storage Location"].isin([8888, 1000])]
-        if not df_8888_1000.empty:
-            combined_8888 = df_8888_1000.groupby("Material Number").agg({
-                "Material Description": "first",
-                "Unrestricted": "sum",
-            }).reset_index()
-            combined_8888["Storage Location"] = 8888
-            
-            # Save to buffer
-            buf_8888 = io.BytesIO()
-            combined_8888.to_excel(buf_8888, index=False, engine='openpyxl')
-            buf_8888.seek(0)
-            output_mem_files[f"MB52-8888-{datetime.now().strftime('%H%M%S')}.xlsx"] = buf_8888
-
-        # --- Step 3: Handle Storage Location 9999 ---
-        df_9999 = df[df["Storage Location"] == 9999]
-        if not df_9999.empty:
-            grouped_9999 = df_9999.groupby(["Material Number", "Storage Location"]).agg({
-                "Material Description": "first",
-                "Unrestricted": "sum"
-            }).reset_index()
-            
-            # Save to buffer
-            buf_9999 = io.BytesIO()
-            grouped_9999.to_excel(buf_9999, index=False, engine='openpyxl')
-            buf_9999.seek(0)
-            output_mem_files[f"MB52-9999-{datetime.now().strftime('%H%M%S')}.xlsx"] = buf_9999
-
-        # --- Final Packaging ---
-        if len(output_mem_files) > 1:
-            # Create a ZIP in memory
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for filename, file_data in output_mem_files.items():
-                    # No need to seek(0) here, it was done above
-                    zipf.writestr(filename, file_data.getvalue())
-            zip_buffer.seek(0)
-            return zip_buffer
-        
-        elif len(output_mem_files) == 1:
-            # Return the single Excel buffer
-            return list(output_mem_files.values())[0]
-        
+        positions = [header.index(column) for column in MB52_COLUMNS]
+
+        chunk = []
+        for row in rows:
+            chunk.append([row[i] if i < len(row) else None for i in positions])
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=MB52_COLUMNS)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=MB52_COLUMNS)
+    finally:
+        workbook.close()
+
+def group_mb52_streaming(mb52_file, chunk_rows=STREAMING_CHUNK_ROWS):
+    """
+    group_mb52 over an export read in chunks: each chunk is reduced to
+    per-material sums that are added to a running total per location, so
+    memory depends on the number of materials, not on the number of rows.
+    """
+    index = material_index()
+    sites = {"8888": [1000, 8888], "9999": [9999]}
+    totals = {site: pd.Series(dtype="float64") for site in sites}
+    numbers = {site: pd.Series(dtype="object") for site in sites}
+    descriptions = {site: pd.Series(dtype="object") for site in sites}
+    integral = True
+
+    with stage("stream_mb52") as record:
+        rows = 0
+        for chunk in iter_mb52_chunks(mb52_file, chunk_rows):
+            rows += len(chunk)
+            locations = pd.to_numeric(chunk["Storage Location"], errors='coerce')
+            quantities = pd.to_numeric(chunk["Unrestricted"], errors='coerce').fillna(0)
+            integral = integral and pd.api.types.is_integer_dtype(quantities)
+            codes = pd.Series(index.codes(chunk["Material Number"], chunk["Material Description"]))
+
+            for site, site_locations in sites.items():
+                kept = locations.isin(site_locations) & (codes != MISSING)
+                if not kept.any():
+                    continue
+                by_code = pd.DataFrame({
+                    "Material Number": chunk["Material Number"][kept],
+                    "Material Description": chunk["Material Description"][kept],
+                    "Unrestricted": quantities[kept],
+                }).groupby(codes[kept].to_numpy(), sort=False).agg(
+                    {"Material Number": "first", "Material Description": "first", "Unrestricted": "sum"}
+                )
+                totals[site] = totals[site].add(by_code["Unrestricted"], fill_value=0)
+                numbers[site] = numbers[site].combine_first(by_code["Material Number"])
+                # The first description seen wins, as with "first" in group_mb52
+                descriptions[site] = descriptions[site].combine_first(by_code["Material Description"].dropna())
+        record["rows_in"] = rows
+
+    groups = {}
+    for site, total in totals.items():
+        if total.empty:
+            continue
+        frame = pd.DataFrame({
+            # Raw cells, as text like the non-streaming read
+            "Material Number": pd.Series(numbers[site].reindex(total.index).map(_cell_text).to_numpy(), dtype="str"),
+            "Material Description": descriptions[site].reindex(total.index).to_numpy(),
+            "Unrestricted": total.astype("int64").to_numpy() if integral else total.to_numpy(),
+        })
+        if site == "8888":
+            frame["Storage Location"] = 8888
         else:
-            print("No output files were created.")
-            return None
-            
+            frame.insert(1, "Storage Location", 9999)
+        groups[site] = frame.sort_values("Material Number", ignore_index=True)
+    return groups
+
+def _cell_text(value):
+    """A material number cell as read_excel(dtype=str) reads it (1000001.0 as "1000001")."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def use_streaming(mb52_file):
+    """True for exports above STREAMING_THRESHOLD_BYTES (STOCKSYNC_MB52_STREAMING_MB)."""
+    try:
+        position = mb52_file.tell()
+        size = mb52_file.seek(0, io.SEEK_END)
+        mb52_file.seek(position)
+    except (AttributeError, OSError, ValueError):
+        return False
+    return size is not None and size > STREAMING_THRESHOLD_BYTES
+
+def write_mb52(groups, output_format='xlsx', name_prefix="MB52"):
+    """
+    Write each location group; several are zipped together, a single one
+    is returned as is. None when there is nothing to write.
+    """
+    if output_format == FRAMES:
+        return dict(groups) or None
+    ext = OUTPUT_FORMATS[output_format]['extension']
+
+    # Dictionary to store our in-memory files
+    # Key: filename, Value: BytesIO object
+    output_mem_files = {}
+    for location, frame in groups.items():
+        # Save to buffer
+        with stage(f"write_{location}", rows_in=len(frame)):
+            output_mem_files[f"{name_prefix}-{location}-{datetime.now().strftime('%H%M%S')}.{ext}"] = write_frame(frame, output_format)
+
+    # --- Final Packaging ---
+    if len(output_mem_files) > 1:
+        # Create a ZIP in memory
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for filename, file_data in output_mem_files.items():
+                # No need to seek(0) here, it was done above
+                zipf.writestr(filename, file_data.getvalue())
+        zip_buffer.seek(0)
+        return zip_buffer
+
+    elif len(output_mem_files) == 1:
+        # Return the single Excel buffer
+        return list(output_mem_files.values())[0]
+
+    else:
+        print("No output files were created.")
+        return None
+
+def process_mb52(mb52_file, progress=None, output_format='xlsx', streaming=None):
+    """
+    Process MB52 file and separate into different storage locations in memory.
+    Each location is written in `output_format` (xlsx, csv, parquet or arrow).
+    `progress` is called with the name of each stage as it starts.
+
+    With `streaming` the export is aggregated chunk by chunk with bounded
+    memory (see group_mb52_streaming); by default only exports larger
+    than STREAMING_THRESHOLD_BYTES are. A parsed dataset is already in
+    memory and is never streamed.
+    """
+    try:
+        print(f"Processing MB52 file stream...")
+        if progress: progress("parse")
+        if streaming is None:
+            streaming = use_streaming(mb52_file)
+        if streaming and not isinstance(mb52_file, ParsedWorkbook):
+            # Parsing and aggregation are interleaved, reported as "parse"
+            groups = group_mb52_streaming(mb52_file)
+        elif processing_engine() == "polars":
+            from processors.polars_engine import mb52_groups
+            groups = mb52_groups([mb52_file], progress)
+        else:
+            df = load_mb52(mb52_file)
+
+            if progress: progress("aggregate")
+            groups = group_mb52(df)
+
+        if progress: progress("write")
+        return write_mb52(groups, output_format)
+
     except Exception as e:
         print(f"Error in process_mb52: {str(e)}")
         return None
+
+def process_mb52_combined(mb52_files, progress=None, output_format='xlsx'):
+    """
+    Aggregate several MB52 exports (e.g. one per plant or month) as if
+    they were one file, with the same grouping as process_mb52.
+    """
+    try:
+        print(f"Processing {len(mb52_files)} MB52 file streams together...")
+        if progress: progress("parse")
+        if processing_engine() == "polars":
+            from processors.polars_engine import mb52_groups
+            groups = mb52_groups(mb52_files, progress)
+        else:
+            df = pd.concat([load_mb52(mb52_file) for mb52_file in mb52_files], ignore_index=True)
+
+            if progress: progress("aggregate")
+            groups = group_mb52(df)
+
+        if progress: progress("write")
+        return write_mb52(groups, output_format, name_prefix="MB52-Combined")
+
+    except Exception as e:
+        print(f"Error in process_mb52_combined: {str(e)}")
+        return None
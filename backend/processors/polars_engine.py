@@ -0,0 +1,147 @@
+import io
+import re
+import csv
+import polars as pl
+from pandas._libs.parsers import STR_NA_VALUES
+from excel_reader import read_excel
+from metrics import stage
+from material_index import material_index, MISSING
+from processors.global_orders import LOTUS_CSV_COLUMNS
+from processors.mb52 import MB52_COLUMNS
+
+# Polars versions of the global orders and MB52 pipelines (selected with
+# STOCKSYNC_ENGINE=polars, see engines.py), each built as a LazyFrame.
+# LOTUS CSV exports are scanned by polars directly, so only the columns
+# the result needs are parsed and the filters are pushed into the scan.
+# Excel sheets are parsed by excel_reader into a pandas frame first
+# (restricted to those columns) and only then handed to polars: for
+# them the filters and aggregation run on data that is already loaded.
+# The results are the pandas frames the pandas pipelines produce.
+
+# Columns the global orders result is built from
+ME2N_COLUMNS = ["Material", "Short Text", "Storage Location", "Still to be delivered (qty)"]
+LOTUS_COLUMNS = ["Product name", "SAP article no", "Quantity", "SAP PO number", "CC"]
+
+def _excel(source, columns, dtype=None):
+    """Lazy frame over the `columns` of an Excel sheet."""
+    df = read_excel(source, columns=columns, dtype=dtype)
+    for column in columns:
+        if column not in df.columns:
+            raise ValueError(f"Required column '{column}' not found in the input file")
+    return pl.from_pandas(df[columns]).lazy()
+
+def _number(column):
+    return pl.col(column).cast(pl.Float64, strict=False)
+
+def _lotus_csv(file_storage):
+    """Lazy scan of a header-less LOTUS CSV export (see read_lotus_csv)."""
+    raw = file_storage.read()
+    first_fields = next(csv.reader([raw.split(b"\n", 1)[0].decode("utf-8")]), [])
+    # pandas' default NA tokens ("N/A", "NULL", ...) are blanks, as in read_lotus_csv
+    options = dict(
+        has_header=False, new_columns=LOTUS_CSV_COLUMNS, infer_schema=False, encoding="utf8",
+        null_values=sorted(STR_NA_VALUES),
+    )
+    if len(first_fields) == 1 and "," in first_fields[0]:
+        # Lines wrapped in quotes: unwrap them and keep inner quotes as text
+        raw = re.sub(rb'^"(.*)"(\r?)$', rb'\1\2', raw, flags=re.M).replace(b'""', b'"')
+        options["quote_char"] = None
+    return pl.scan_csv(io.BytesIO(raw), **options).select(LOTUS_COLUMNS).with_columns(
+        _number("Quantity"), _number("CC"),
+    )
+
+def _is_blank_po(lf):
+    """LOTUS lines without a SAP PO number (empty, 0 or "0")."""
+    po = pl.col("SAP PO number")
+    if lf.collect_schema()["SAP PO number"] == pl.String:
+        return po.is_null() | po.is_in(["", "0"])
+    return po.is_null() | (po == 0)
+
+def global_orders_frame(me2n_file, lotus_file, progress=None):
+    """Open quantity per article number and product name, as extract_excel_data groups it."""
+    with stage("read_me2n"):
+        me2n = _excel(me2n_file, ME2N_COLUMNS, dtype={"Short Text": str})
+    with stage("read_lotus"):
+        if lotus_file.filename.lower().endswith(".csv"):
+            lotus = _lotus_csv(lotus_file)
+        else:
+            lotus = _excel(lotus_file, LOTUS_COLUMNS, dtype={"Product name": str})
+
+    me2n = me2n.filter(
+        pl.col("Storage Location").is_not_null() & pl.col("Material").is_not_null()
+        & pl.col("Still to be delivered (qty)").ne_missing(0)
+    ).select(
+        _number("Material").alias("SAP article no"),
+        pl.col("Short Text").cast(pl.String).alias("Product name"),
+        _number("Still to be delivered (qty)").alias("Quantity"),
+    )
+    lotus = lotus.filter(
+        _is_blank_po(lotus) & pl.col("SAP article no").is_not_null() & (_number("CC") == 47000)
+    ).select(
+        _number("SAP article no"),
+        pl.col("Product name").cast(pl.String),
+        _number("Quantity"),
+    )
+
+    if progress: progress("aggregate")
+    with stage("aggregate_global_orders") as record:
+        result = (
+            pl.concat([lotus, me2n])
+            .filter(pl.col("SAP article no").is_not_null() & pl.col("Product name").is_not_null())
+            .group_by(["SAP article no", "Product name"])
+            .agg(pl.col("Quantity").sum())
+            .sort(["SAP article no", "Product name"])
+            .collect()
+            .to_pandas()
+        )
+        record["rows_out"] = len(result)
+    return result
+
+def mb52_groups(mb52_files, progress=None):
+    """Stock per material of each reported location, as group_mb52 returns it."""
+    with stage("read_mb52"):
+        frames = [_excel(mb52_file, MB52_COLUMNS, dtype={"Material Number": str}) for mb52_file in mb52_files]
+
+    if progress: progress("aggregate")
+    with stage("group_mb52") as record:
+        stock = (
+            pl.concat(frames)
+            .with_columns(_number("Storage Location"), _number("Unrestricted").fill_null(0))
+            .filter(pl.col("Storage Location").is_in([1000.0, 8888.0, 9999.0]))
+            .with_columns(
+                pl.when(pl.col("Storage Location") == 9999).then(pl.lit("9999")).otherwise(pl.lit("8888")).alias("site")
+            )
+            .collect()
+        )
+        index = material_index()
+        stock = stock.with_columns(pl.Series(
+            "material_code",
+            index.codes(stock["Material Number"].to_numpy(), stock["Material Description"].to_numpy()),
+        )).filter(pl.col("material_code") != MISSING)
+
+        grouped = (
+            stock.lazy()
+            .group_by(["site", "material_code"])
+            .agg(
+                # The first number seen for the material, as written in the export
+                pl.col("Material Number").first(),
+                pl.col("Material Description").drop_nulls().first(),
+                pl.col("Unrestricted").sum(),
+            )
+            .collect()
+        )
+        record["rows_out"] = len(grouped)
+
+    groups = {}
+    for site in ("8888", "9999"):
+        frame = grouped.filter(pl.col("site") == site)
+        if frame.is_empty():
+            continue
+        frame = frame.to_pandas()
+        frame.insert(0, "Material Number", frame.pop("Material Number").astype("str"))
+        frame["Storage Location"] = int(site)
+        columns = ["Material Number", "Material Description", "Unrestricted", "Storage Location"]
+        if site == "9999":
+            columns = ["Material Number", "Storage Location", "Material Description", "Unrestricted"]
+        groups[site] = frame[columns].sort_values("Material Number", ignore_index=True)
+    return groups
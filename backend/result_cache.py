@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+MB = 1024 * 1024
+
+# Part of every key: bump it whenever a processor's output changes (columns,
+# values or formatting), so results cached on disk by an earlier version are
+# never served for the same upload. Entries under old keys age out by LRU.
+CACHE_VERSION = 3
+
+class ResultCache:
+    """
+    Two-tier cache of processor outputs keyed by a hash of the uploaded
+    bytes and the processor parameters.
+
+    The memory tier is an LRU bounded by total bytes; the disk tier keeps
+    every result as one file and evicts the least recently used ones once
+    it grows past its own byte budget. A size of 0 disables a tier.
+    """
+
+    def __init__(self, memory_bytes=256 * MB, disk_dir=None, disk_bytes=2048 * MB):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes if disk_dir else 0
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+        if self.disk_bytes:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(processor, files, params=None):
+        """Hash the cache version, processor name, each uploaded file and its parameters."""
+        digest = hashlib.sha256(f"{CACHE_VERSION}|{processor}".encode())
+        for field in sorted(files):
+            file_storage = files[field]
+            # The extension selects the parser (LOTUS can be CSV or Excel)
+            ext = os.path.splitext(file_storage.filename or "")[1].lower()
+            digest.update(f"|{field}{ext}|".encode())
+            digest.update(file_digest(file_storage))
+        digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached bytes for `key`, or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return data
+
+            data = self._read_disk(key)
+            if data is None:
+                self.stats["misses"] += 1
+                return None
+
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """Store a result in both tiers."""
+        with self._lock:
+            self.stats["stores"] += 1
+            self._remember(key, data)
+            self._write_disk(key, data)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            for path, _, _ in self._disk_entries():
+                os.remove(path)
+
+    def report(self):
+        """Hit/miss counters and tier usage, ready for jsonify."""
+        with self._lock:
+            disk = self._disk_entries()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                "memory": {"entries": len(self._memory), "bytes": self._memory_used, "limit_bytes": self.memory_bytes},
+                "disk": {"entries": len(disk), "bytes": sum(size for _, size, _ in disk), "limit_bytes": self.disk_bytes},
+            }
+
+    # --- Memory tier ---
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_used += len(data)
+
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    # --- Disk tier ---
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _read_disk(self, key):
+        if not self.disk_bytes:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # Mark as recently used
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_bytes or len(data) > self.disk_bytes:
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Result cache could not write to disk: {e}")
+            return
+
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        used = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if used <= self.disk_bytes:
+                break
+            os.remove(path)
+            used -= size
+
+    def _disk_entries(self):
+        """(path, size, last use) of every stored result."""
+        if not self.disk_bytes:
+            return []
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+def file_digest(file_storage, chunk_size=1024 * 1024):
+    """sha256 of an uploaded file, leaving the stream rewound for the parser."""
+    # Parsed datasets carry the digest of the file they came from
+    if getattr(file_storage, "digest", None) is not None:
+        return file_storage.digest
+    digest = hashlib.sha256()
+    file_storage.seek(0)
+    for chunk in iter(lambda: file_storage.read(chunk_size), b""):
+        digest.update(chunk)
+    file_storage.seek(0)
+    return digest.digest()
+
+def cache_from_env():
+    """Build the cache from STOCKSYNC_CACHE_* environment variables."""
+    disk_dir = os.environ.get("STOCKSYNC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "stocksync-cache"))
+    return ResultCache(
+        memory_bytes=int(os.environ.get("STOCKSYNC_CACHE_MEMORY_MB", 256)) * MB,
+        disk_dir=disk_dir or None,
+        disk_bytes=int(os.environ.get("STOCKSYNC_CACHE_DISK_MB", 2048)) * MB,
+    )
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# Compact dtypes of the code and id columns of each report, applied once
+# when the report is read (see compact), so the processors work on lean
+# frames: repetitive values as categoricals, numeric codes as nullable
+# integers of the smallest width that holds them (blanks as <NA>).
+REPORT_SCHEMAS = {
+    "mb51": {
+        "Movement type": "Int16",
+        "Storage Location": "Int16",
+        "Unit of Entry": "category",
+        "Vendor": "category",
+        "Cost Center": "category",
+    },
+    "mb52": {"Storage Location": "Int16"},
+    "me2n": {"Storage Location": "Int16", "Vendor/supplying plant": "category"},
+    "lotus": {"CC": "Int32"},
+    # MC stock list, read as a grid; Type is a column of its data rows
+    "mc_stock_list": {"Type": "category"},
+}
+
+def compact_series(series, dtype):
+    """
+    `series` in `dtype` when that loses nothing: an integer dtype only
+    applies to a numeric column of whole numbers in its range, otherwise
+    the column is returned as is.
+    """
+    if dtype == "category":
+        return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype("category")
+
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return series
+    values = series.to_numpy(dtype="float64", na_value=np.nan)
+    values = values[~np.isnan(values)]
+    limits = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+    if len(values) and (values.min() < limits.min or values.max() > limits.max or (values % 1).any()):
+        return series
+    return series.astype(dtype)
+
+def compact(df, report):
+    """`df` with the REPORT_SCHEMAS dtypes of `report` applied to the columns it has."""
+    schema = REPORT_SCHEMAS[report]
+    return df.assign(**{
+        column: compact_series(df[column], dtype) for column, dtype in schema.items() if column in df.columns
+    })
+
+def expand(series):
+    """
+    A nullable integer column back in the dtype read_excel gives it:
+    int64, or float64 when it has blanks. Other columns are returned as is.
+    """
+    if not isinstance(series.dtype, pd.api.extensions.ExtensionDtype) or not pd.api.types.is_integer_dtype(series):
+        return series
+    return series.astype("float64") if series.hasnans else series.astype("int64")
@@ -0,0 +1,13 @@
+import os
+
+def data_dir():
+    """
+    Directory for state kept between runs (incremental MB51 state, ...).
+    Set with STOCKSYNC_DATA_DIR, defaults to ~/.stocksync.
+    """
+    path = os.environ.get("STOCKSYNC_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".stocksync")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def data_path(filename):
+    return os.path.join(data_dir(), filename)
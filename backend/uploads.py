@@ -0,0 +1,255 @@
+import io
+import os
+import json
+import mmap
+import time
+import uuid
+import tempfile
+import threading
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+MB = 1024 * 1024
+
+class MappedFile(io.RawIOBase):
+    """
+    Read-only file object over a memory mapping of a file on disk, so
+    parsers read the upload straight from the page cache.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.name = path
+        self._file = open(path, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        # An empty file cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = max(0, min(len(buffer), self._size - self._pos))
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size=-1):
+        end = self._size if size is None or size < 0 else min(self._size, self._pos + size)
+        data = self._view[self._pos:end].tobytes() if end > self._pos else b""
+        self._pos = max(self._pos, end)
+        return data
+
+    def readline(self, size=-1):
+        end = self._map.find(b"\n", self._pos) + 1 if self._map is not None else 0
+        if end <= 0:
+            end = self._size
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+        super().close()
+
+def open_upload(path, filename, name=None):
+    """FileStorage reading a stored upload through a memory mapping."""
+    return FileStorage(stream=MappedFile(path), filename=filename, name=name)
+
+def upload_path(file_storage):
+    """Path of an upload spooled to disk by StreamedRequest, else None."""
+    stream = file_storage.stream
+    path = getattr(stream, "name", None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    if hasattr(stream, "flush"):
+        stream.flush()
+    return path
+
+class StreamedRequest(Request):
+    """
+    Request that streams every uploaded file to its own temporary file in
+    `upload_dir` instead of memory, removed again when the request closes.
+    Paths in UploadStore.detached (see UploadStore.detach) outlive it.
+    """
+
+    upload_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile("wb+", dir=self.upload_dir, prefix="upload-", delete=False)
+        self.__dict__.setdefault("_spooled", []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        for stream in self.__dict__.pop("_spooled", []):
+            stream.close()
+            if stream.name not in UploadStore.detached:
+                _remove(stream.name)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class UploadStore:
+    """
+    Temporary upload files: request bodies spooled by StreamedRequest and
+    resumable chunked uploads, both limited to `max_bytes` per file.
+
+    A chunked upload is created empty, receives its chunks in order at the
+    offset the server reports, and is kept for `ttl` seconds after its last
+    chunk so an interrupted transfer can resume.
+    """
+
+    # Spooled uploads handed over to a job, kept after their request closes
+    detached = set()
+
+    def __init__(self, directory, max_bytes=1024 * MB, ttl=24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "chunked"), exist_ok=True)
+
+    # --- Spooled request uploads ---
+
+    def detach(self, file_storage):
+        """
+        Keep a spooled upload past its request (for a background job).
+        Returns the FileStorage to use instead and a release() callback.
+        """
+        path = upload_path(file_storage)
+        if path is None:
+            # Not spooled to disk: keep an in-memory copy
+            data = FileStorage(
+                stream=io.BytesIO(file_storage.read()), filename=file_storage.filename, name=file_storage.name,
+            )
+            return data, lambda: None
+
+        if os.path.dirname(path) == os.path.join(self.directory, "chunked"):
+            # Chunked uploads stay until deleted or expired
+            return open_upload(path, file_storage.filename, file_storage.name), lambda: None
+
+        UploadStore.detached.add(path)
+        detached = open_upload(path, file_storage.filename, file_storage.name)
+
+        def release():
+            detached.close()
+            UploadStore.detached.discard(path)
+            _remove(path)
+        return detached, release
+
+    # --- Resumable chunked uploads ---
+
+    def _paths(self, upload_id):
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        base = os.path.join(self.directory, "chunked", upload_id)
+        return base + ".part", base + ".json"
+
+    def create(self, filename, size=None):
+        """Start a chunked upload of `size` bytes (if known) and return its status."""
+        if size is not None and size > self.max_bytes:
+            raise ValueError(f"Upload of {size} bytes exceeds the {self.max_bytes} byte limit")
+        self.prune()
+
+        upload_id = uuid.uuid4().hex
+        data_path, meta_path = self._paths(upload_id)
+        open(data_path, "wb").close()
+        with open(meta_path, "w") as f:
+            json.dump({"id": upload_id, "filename": filename, "size": size}, f)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """Received byte count and completion of an upload; KeyError if unknown."""
+        data_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(data_path)
+        except OSError:
+            raise KeyError(upload_id)
+        return {**meta, "offset": offset, "complete": meta["size"] is not None and offset == meta["size"]}
+
+    def append(self, upload_id, offset, stream, chunk_size=MB):
+        """
+        Write the chunk read from `stream` at `offset`, which must be the
+        number of bytes received so far. Returns the new status.
+        """
+        with self._lock:
+            status = self.status(upload_id)
+            if offset != status["offset"]:
+                raise ValueError(f"Expected offset {status['offset']}, got {offset}")
+
+            limit = min(self.max_bytes, status["size"] if status["size"] is not None else self.max_bytes)
+            data_path, _ = self._paths(upload_id)
+            with open(data_path, "ab") as f:
+                written = 0
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    written += len(chunk)
+                    if offset + written > limit:
+                        f.truncate(offset)
+                        raise ValueError(f"Upload exceeds its {limit} byte limit")
+                    f.write(chunk)
+        return self.status(upload_id)
+
+    def open_chunked(self, upload_id, name=None):
+        """FileStorage over a finished chunked upload."""
+        status = self.status(upload_id)
+        if status["size"] is not None and not status["complete"]:
+            raise ValueError(f"Upload {upload_id} is incomplete ({status['offset']} of {status['size']} bytes)")
+        data_path, _ = self._paths(upload_id)
+        os.utime(data_path)
+        return open_upload(data_path, status["filename"], name)
+
+    def delete(self, upload_id):
+        """Remove a chunked upload; KeyError if there is none with that id."""
+        paths = [path for path in self._paths(upload_id) if os.path.exists(path)]
+        if not paths:
+            raise KeyError(upload_id)
+        for path in paths:
+            _remove(path)
+
+    def prune(self):
+        """Drop chunked uploads untouched for longer than the TTL."""
+        cutoff = time.time() - self.ttl
+        directory = os.path.join(self.directory, "chunked")
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+                try:
+                    self.delete(entry.name[:-len(".part")])
+                except KeyError:
+                    # Deleted meanwhile
+                    pass
+
+def uploads_from_env():
+    """Build the store from STOCKSYNC_UPLOAD_DIR / STOCKSYNC_MAX_UPLOAD_MB / STOCKSYNC_UPLOAD_TTL_HOURS."""
+    return UploadStore(
+        directory=os.environ.get("STOCKSYNC_UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "stocksync-uploads"),
+        max_bytes=int(os.environ.get("STOCKSYNC_MAX_UPLOAD_MB", 1024)) * MB,
+        ttl=int(os.environ.get("STOCKSYNC_UPLOAD_TTL_HOURS", 24)) * 3600,
+    )
@@ -0,0 +1,238 @@
+import io
+import os
+import time
+import importlib
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.datastructures import FileStorage
+
+from metrics import collect_stages
+from output_formats import write_frame, write_frames
+from uploads import MappedFile, upload_path
+
+# Processor functions, imported on first use so the server starts without
+# loading pandas
+PROCESSOR_FUNCTIONS = {
+    'global_orders': ('processors.global_orders', 'process_global_orders'),
+    'mb51': ('processors.mb51', 'process_mb51'),
+    'mb51_incremental': ('processors.mb51_incremental', 'process_mb51_incremental'),
+    'mb52': ('processors.mb52', 'process_mb52'),
+    'mb52_combined': ('processors.mb52', 'process_mb52_combined'),
+    'stock_ruptures': ('analytics.daily_stock_rupture', 'generate_combined_stock_ruptures'),
+    'stock_coverage': ('analytics.stock_coverage', 'generate_stock_coverage'),
+    'query': ('analytics.sql_query', 'run_query'),
+    # Parses an upload into a dataset (see datasets.py) off the request thread
+    'parse_workbook': ('excel_reader', 'parse_workbook'),
+}
+
+def processor_function(processor):
+    module, name = PROCESSOR_FUNCTIONS[processor]
+    return getattr(importlib.import_module(module), name)
+
+# How each processor is called from the uploaded files and parameters
+PROCESSOR_CALLS = {
+    'global_orders': lambda files, params, progress: processor_function('global_orders')(
+        files['me2n_file'], files['lotus_file'], progress, params.get('output_format', 'xlsx')),
+    'mb51': lambda files, params, progress: processor_function('mb51')(
+        files['mb51_file'], params['movement_type'], progress, params.get('output_format', 'xlsx')),
+    'mb51_incremental': lambda files, params, progress: processor_function('mb51_incremental')(
+        files['mb51_file'], params['movement_type'], params['store_path'], progress, params.get('output_format', 'xlsx')),
+    'mb52': lambda files, params, progress: processor_function('mb52')(
+        files['mb52_file'], progress, params.get('output_format', 'xlsx'), params.get('streaming')),
+    # Files arrive as mb52_file_0, mb52_file_1, ... in upload order
+    'mb52_combined': lambda files, params, progress: processor_function('mb52_combined')(
+        [files[field] for field in sorted(files, key=lambda field: int(field.rsplit('_', 1)[1]))],
+        progress, params.get('output_format', 'xlsx')),
+    'stock_ruptures': lambda files, params, progress: processor_function('stock_ruptures')(files['file'], progress),
+    'stock_coverage': lambda files, params, progress: processor_function('stock_coverage')(
+        files['me2n_file'], files['lotus_file'], files['mb52_file'], progress),
+    'query': lambda files, params, progress: processor_function('query')(
+        files, params['sql'], params.get('limit'), params.get('output_format', 'json'), progress),
+    'parse_workbook': lambda files, params, progress: processor_function('parse_workbook')(files['file']),
+    # Exports a result preview (see app.py), without files
+    'write_preview': lambda files, params, progress: write_preview(
+        params['processor'], params['frames'], params['output_format']),
+}
+
+# How the result frames of a preview (processors run with output_format
+# FRAMES) are written when exported, as the processor writes them
+PREVIEW_WRITERS = {
+    'global_orders': lambda frames, output_format: importlib.import_module('processors.global_orders').write_global_orders(
+        frames['result'], output_format),
+    'mb51': lambda frames, output_format: write_frame(frames['result'], output_format),
+    'mb52': lambda frames, output_format: importlib.import_module('processors.mb52').write_mb52(frames, output_format),
+}
+
+def write_preview(processor, frames, output_format):
+    """Export of a preview; analytics tables get one sheet (or file) each."""
+    writer = PREVIEW_WRITERS.get(processor)
+    if writer is None:
+        return write_frames(frames, output_format, name_prefix=processor)
+    return writer(frames, output_format)
+
+def warm_up():
+    """Import every processor and pick the Excel engine ahead of the first run."""
+    for processor in PROCESSOR_FUNCTIONS:
+        processor_function(processor)
+    from excel_reader import excel_engine
+    return excel_engine()
+
+def execute(processor, payload, params=None, progress=None):
+    """
+    Run a processor on uploaded files.
+
+    `payload` maps each form field to (filename, source), the source being
+    the path of an upload on disk (read through a memory mapping), its
+    bytes, or a parsed dataset (excel_reader.ParsedWorkbook) passed as is.
+    Buffers are returned as bytes so the result can cross a process
+    boundary.
+    """
+    files = {
+        field: FileStorage(
+            stream=MappedFile(source) if isinstance(source, str) else io.BytesIO(source),
+            filename=filename, name=field,
+        ) if isinstance(source, (str, bytes)) else source
+        for field, (filename, source) in payload.items()
+    }
+    try:
+        result = PROCESSOR_CALLS[processor](files, params or {}, progress)
+    finally:
+        for file_storage in files.values():
+            file_storage.close()
+    if isinstance(result, io.BytesIO):
+        return result.getvalue()
+    return result
+
+def execute_measured(processor, payload, params=None, progress=None):
+    """execute() plus the stage records and wall time of the run."""
+    with collect_stages() as stages:
+        started = time.perf_counter()
+        result = execute(processor, payload, params, progress)
+        seconds = time.perf_counter() - started
+    return result, stages, seconds
+
+# --- Worker process side ---
+
+_progress_queue = None
+
+def _init_worker(progress_queue):
+    """Keep the progress queue and warm the worker before its first task."""
+    global _progress_queue
+    _progress_queue = progress_queue
+    warm_up()
+
+def _execute_in_worker(task_id, processor, payload, params):
+    progress = lambda stage: _progress_queue.put((task_id, stage))
+    return execute_measured(processor, payload, params, progress)
+
+# --- Server side ---
+
+class ProcessorPool:
+    """
+    Dispatches processor runs to a pool of warm worker processes so
+    concurrent requests use several cores instead of sharing the GIL.
+
+    `max_workers=0` runs processors inline in the calling thread, as are
+    runs on a parsed dataset: it lives in this process, and pickling it to
+    a worker on every run would cost more than reading it.
+    `max_concurrent` caps how many runs may be in flight; extra callers
+    wait for a free slot. Stage records of every run go to `metrics`
+    (a StageMetrics) when given.
+    """
+
+    def __init__(self, max_workers=2, max_concurrent=None, metrics=None):
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self._slots = threading.BoundedSemaphore(max_concurrent or max(max_workers, 1))
+        self._lock = threading.Lock()
+        self._pool = None
+        self._queue = None
+        self._callbacks = {}
+        self._task_ids = itertools.count()
+
+    def run(self, processor, files, params=None, progress=None):
+        """Run `processor` on the uploaded `files` and return its result."""
+        payload = {field: (f.filename, upload_source(f)) for field, f in files.items()}
+        result, stages, seconds = self._execute(processor, payload, params, progress)
+        if self.metrics is not None:
+            self.metrics.observe(processor, stages, seconds)
+        return result
+
+    def _execute(self, processor, payload, params, progress):
+        with self._slots:
+            in_memory = any(not isinstance(source, (str, bytes)) for _, source in payload.values())
+            if not self.max_workers or in_memory:
+                return execute_measured(processor, payload, params, progress)
+
+            task_id = next(self._task_ids)
+            if progress:
+                self._callbacks[task_id] = progress
+            try:
+                future = self._get_pool().submit(_execute_in_worker, task_id, processor, payload, params)
+                return future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory): start a fresh pool next time
+                with self._lock:
+                    self._pool = None
+                raise RuntimeError("Processor worker crashed")
+            finally:
+                self._callbacks.pop(task_id, None)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn behaves the same on Windows and in the frozen build
+                context = multiprocessing.get_context("spawn")
+                if self._queue is None:
+                    self._queue = context.Queue()
+                    threading.Thread(target=self._relay_progress, daemon=True).start()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._queue,),
+                )
+                # Start every worker now so the first request finds them warm
+                for _ in range(self.max_workers):
+                    self._pool.submit(warm_up)
+            return self._pool
+
+    def start(self):
+        """Spawn and warm the workers now instead of on the first run."""
+        if self.max_workers:
+            self._get_pool()
+        else:
+            warm_up()
+
+    def _relay_progress(self):
+        while True:
+            task_id, stage = self._queue.get()
+            callback = self._callbacks.get(task_id)
+            if callback:
+                callback(stage)
+
+def upload_source(file_storage):
+    """
+    What a worker needs to read an upload: the path of a file on disk,
+    so only the name crosses the process boundary, or else its bytes.
+    A parsed dataset is passed as is (and the run stays in this process).
+    """
+    if not isinstance(file_storage, FileStorage):
+        return file_storage
+    return upload_path(file_storage) or read_upload(file_storage)
+
+def read_upload(file_storage):
+    """Whole upload as bytes, leaving the stream rewound."""
+    file_storage.seek(0)
+    data = file_storage.read()
+    file_storage.seek(0)
+    return data
+
+def pool_from_env(metrics=None):
+    """Build the pool from STOCKSYNC_PROCESS_WORKERS / STOCKSYNC_MAX_CONCURRENT."""
+    workers = int(os.environ.get("STOCKSYNC_PROCESS_WORKERS", min(4, os.cpu_count() or 1)))
+    max_concurrent = os.environ.get("STOCKSYNC_MAX_CONCURRENT")
+    return ProcessorPool(max_workers=workers, max_concurrent=int(max_concurrent) if max_concurrent else None, metrics=metrics)
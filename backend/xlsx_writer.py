@@ -0,0 +1,76 @@
+import io
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import column_index_from_string
+
+# Same datetime format as DataFrame.to_excel
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+
+def write_xlsx(sheets, number_formats=None, output=None, chunk_rows=10000):
+    """
+    Write DataFrames to an XLSX file with openpyxl's write-only mode.
+
+    Rows are streamed to the workbook `chunk_rows` at a time, so the
+    openpyxl object model is never built. `sheets` is a DataFrame or a
+    {sheet name: DataFrame} dict; `number_formats` maps a column letter
+    to the number format of every cell in that column, e.g. {'A': '0'}.
+    Returns `output` (a new BytesIO by default) rewound to the start.
+    """
+    if isinstance(sheets, pd.DataFrame):
+        sheets = {"Sheet1": sheets}
+    formats_by_index = {
+        column_index_from_string(letter) - 1: fmt for letter, fmt in (number_formats or {}).items()
+    }
+
+    workbook = Workbook(write_only=True)
+    for sheet_name, df in sheets.items():
+        ws = workbook.create_sheet(sheet_name)
+
+        formats = []
+        for i, dtype in enumerate(df.dtypes):
+            if i in formats_by_index:
+                formats.append(formats_by_index[i])
+            elif pd.api.types.is_datetime64_any_dtype(dtype):
+                formats.append(DATETIME_FORMAT)
+            else:
+                formats.append(None)
+
+        ws.append(_cells(ws, list(df.columns), [formats_by_index.get(i) for i in range(df.shape[1])]))
+
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            columns = [_cells(ws, _column_values(chunk.iloc[:, i]), formats[i]) for i in range(chunk.shape[1])]
+            for row in zip(*columns):
+                ws.append(row)
+
+    output = output if output is not None else io.BytesIO()
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+def _column_values(column):
+    """Python values of a column, missing values as empty cells."""
+    if column.hasnans:
+        return column.astype(object).where(column.notna(), None).tolist()
+    return column.tolist()
+
+def _cells(ws, values, number_format):
+    """
+    Wrap values that need a number format in write-only cells.
+    `number_format` is one format for every value, or one per value.
+    """
+    if number_format is None:
+        return values
+    if isinstance(number_format, str):
+        number_format = [number_format] * len(values)
+
+    cells = []
+    for value, fmt in zip(values, number_format):
+        if fmt is None:
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = fmt
+        cells.append(cell)
+    return cells
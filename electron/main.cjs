@@ -5,6 +5,9 @@ const { ipcMain, dialog } = require('electron');
 const fs = require('fs');
 
 const isDev = !app.isPackaged;
+// "production" serves the backend with waitress, "development" with the Flask
+// debug server. Packaged builds default to production.
+const backendMode = process.env.STOCKSYNC_SERVER_MODE || (isDev ? "development" : "production");
 let pyProc = null;
 let mainWindow = null;
 
@@ -51,6 +54,10 @@ if (!isFirstInstance) {
       console.log(`[Prod] Executing binary: ${pyCommand}`);
     }
 
+    if (backendMode === "production") {
+      args.push("--production");
+    }
+
     pyProc = spawn(pyCommand, args, { 
       detached: false,
       windowsHide: true,
@@ -31,3 +31,119 @@ export async function fetchStockRuptures(file: File): Promise<StockRuptureData>
 
   return await response.json();
 }
+
+export interface StockCoverageMaterial {
+  material: string;
+  description: string | null;
+  stock_8888: number;
+  stock_9999: number;
+  stock_on_hand: number;
+  open_quantity: number;
+  coverage: number;
+  projected_rupture: boolean;
+}
+
+export interface StockCoverageData {
+  summary: {
+    materials: number;
+    with_open_orders: number;
+    out_of_stock: number;
+    projected_ruptures: number;
+    stock_on_hand: number;
+    open_quantity: number;
+  };
+  /** Worst coverage first */
+  materials: StockCoverageMaterial[];
+}
+
+export async function fetchStockCoverage(me2nFile: File, lotusFile: File, mb52File: File): Promise<StockCoverageData> {
+  const formData = new FormData();
+  formData.append('me2n_file', me2nFile);
+  formData.append('lotus_file', lotusFile);
+  formData.append('mb52_file', mb52File);
+
+  const response = await fetch('http://localhost:5454/processors/stock_coverage', {
+    method: 'POST',
+    body: formData,
+  });
+
+  const data = await response.json().catch(() => ({}));
+  if (!response.ok || data.error) {
+    throw new Error(data.error || `Server responded with status ${response.status}`);
+  }
+
+  return data;
+}
+
+export interface StockRuptureHistoryQuery {
+  /** ISO dates, inclusive */
+  start?: string;
+  end?: string;
+  /** Rolling window in days */
+  window?: number;
+  aggregate?: 'mean' | 'sum' | 'max';
+}
+
+export interface StockRuptureHistory {
+  ruptures: StockRuptureData;
+  rolling?: StockRuptureData;
+  window?: number;
+  aggregate?: string;
+}
+
+export async function fetchStockRuptureHistory(query: StockRuptureHistoryQuery = {}): Promise<StockRuptureHistory> {
+  const params = new URLSearchParams();
+  for (const [key, value] of Object.entries(query)) {
+    if (value !== undefined) params.append(key, String(value));
+  }
+
+  const response = await fetch(`http://localhost:5454/processors/stock_ruptures/history?${params}`);
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || `Server responded with status ${response.status}`);
+  }
+
+  return await response.json();
+}
+
+export interface QueryResult {
+  /** SQL type names, e.g. BIGINT, VARCHAR, TIMESTAMP */
+  columns: { name: string; type: string }[];
+  rows: unknown[][];
+  row_count: number;
+  /** More rows matched than the limit */
+  truncated: boolean;
+}
+
+/**
+ * Run one SELECT over uploaded reports, each a table named after its
+ * report: me2n, lotus, mb51, mb52 (a File, or a dataset id from createDataset).
+ */
+export async function runQuery(
+  sql: string,
+  reports: Partial<Record<'me2n' | 'lotus' | 'mb51' | 'mb52', File | string>>,
+  limit?: number,
+): Promise<QueryResult> {
+  const formData = new FormData();
+  formData.append('sql', sql);
+  for (const [table, report] of Object.entries(reports)) {
+    if (report instanceof File) {
+      formData.append(`${table}_file`, report);
+    } else if (report) {
+      formData.append(`${table}_file_dataset`, report);
+    }
+  }
+  if (limit !== undefined) formData.append('limit', limit.toString());
+
+  const response = await fetch('http://localhost:5454/query', {
+    method: 'POST',
+    body: formData,
+  });
+
+  const data = await response.json().catch(() => ({}));
+  if (!response.ok || data.error) {
+    throw new Error(data.error || `Server responded with status ${response.status}`);
+  }
+
+  return data;
+}
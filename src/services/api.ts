@@ -49,14 +49,67 @@ export async function processMB52(file: File): Promise<Blob> {
   return await response.blob();
 }
 
+// Files above this size are sent as a resumable chunked upload
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+
+/**
+ * Send a file to /uploads in chunks and return its upload id.
+ * After a failed chunk the upload resumes from the offset the server reports.
+ */
+export async function uploadInChunks(file: File, maxRetries = 3): Promise<string> {
+  const created = await fetch('http://localhost:5454/uploads', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  if (!created.ok) {
+    const errorData = await created.json().catch(() => ({}));
+    throw new Error(errorData.error || 'Failed to start upload');
+  }
+  const { id } = await created.json();
+
+  let offset = 0;
+  let retries = 0;
+  while (offset < file.size) {
+    try {
+      const response = await fetch(`http://localhost:5454/uploads/${id}`, {
+        method: 'PUT',
+        headers: { 'Upload-Offset': offset.toString() },
+        body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE),
+      });
+      const status = await response.json();
+      if (!response.ok && response.status !== 409) {
+        throw new Error(status.error || `Upload failed with status ${response.status}`);
+      }
+      // 409: the server has a different offset, continue from there
+      offset = status.offset;
+      retries = 0;
+    } catch (error) {
+      if (++retries > maxRetries) throw error;
+      const status = await fetch(`http://localhost:5454/uploads/${id}`).then((r) => r.json());
+      offset = status.offset;
+    }
+  }
+  return id;
+}
+
 export async function processMB51(file: File, movementType: number): Promise<Blob> {
   const formData = new FormData();
-  formData.append('mb51_file', file);
+  const uploadId = file.size > CHUNKED_UPLOAD_THRESHOLD ? await uploadInChunks(file) : null;
+  if (uploadId) {
+    formData.append('mb51_file_upload', uploadId);
+  } else {
+    formData.append('mb51_file', file);
+  }
   formData.append('movement_type', movementType.toString());
 
   const response = await fetch('http://localhost:5454/processors/mb51', {
     method: 'POST',
     body: formData,
+  }).finally(() => {
+    // The server would otherwise keep the upload until it expires
+    if (uploadId) fetch(`http://localhost:5454/uploads/${uploadId}`, { method: 'DELETE' }).catch(() => {});
   });
 
   if (!response.ok) {
@@ -67,6 +120,120 @@ export async function processMB51(file: File, movementType: number): Promise<Blo
   return await response.blob();
 }
 
+/**
+ * Parse an Excel export once on the server and return its dataset id.
+ * Send the id as `<field>_dataset` (e.g. 'mb52_file_dataset') to any
+ * processor instead of uploading the file again.
+ */
+export async function createDataset(file: File): Promise<string> {
+  const formData = new FormData();
+  const uploadId = file.size > CHUNKED_UPLOAD_THRESHOLD ? await uploadInChunks(file) : null;
+  if (uploadId) {
+    formData.append('file_upload', uploadId);
+  } else {
+    formData.append('file', file);
+  }
+
+  const response = await fetch('http://localhost:5454/datasets', {
+    method: 'POST',
+    body: formData,
+  }).finally(() => {
+    if (uploadId) fetch(`http://localhost:5454/uploads/${uploadId}`, { method: 'DELETE' }).catch(() => {});
+  });
+
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || 'Failed to parse the file');
+  }
+  const { id } = await response.json();
+  return id;
+}
+
+/** Free a dataset before it expires. */
+export async function deleteDataset(datasetId: string): Promise<void> {
+  await fetch(`http://localhost:5454/datasets/${datasetId}`, { method: 'DELETE' });
+}
+
+export interface PreviewPage {
+  table: string;
+  page: number;
+  page_size: number;
+  total_rows: number;
+  pages: number;
+  columns: string[];
+  rows: unknown[][];
+}
+
+export interface PreviewQuery {
+  table?: string;
+  page?: number;
+  pageSize?: number;
+  sort?: string;
+  descending?: boolean;
+  search?: string;
+  /** Case-insensitive text to match, per column */
+  filters?: Record<string, string>;
+}
+
+/**
+ * Run a processor and keep its result on the server for paging.
+ * `fields` are the processor's form fields (files or values), e.g.
+ * { mb52_file: file }; the returned status has the preview id and tables.
+ */
+export async function createPreview(
+  processor: string,
+  fields: Record<string, File | string>
+): Promise<{ id: string; tables: Record<string, { rows: number; columns: { name: string; type: string }[] }> }> {
+  const formData = new FormData();
+  for (const [name, value] of Object.entries(fields)) formData.append(name, value);
+
+  const response = await fetch(`http://localhost:5454/previews/${processor}`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || 'Failed to process the files');
+  }
+  return await response.json();
+}
+
+export async function fetchPreviewPage(previewId: string, query: PreviewQuery = {}): Promise<PreviewPage> {
+  const params = new URLSearchParams();
+  if (query.table) params.set('table', query.table);
+  if (query.page) params.set('page', query.page.toString());
+  if (query.pageSize) params.set('page_size', query.pageSize.toString());
+  if (query.sort) params.set('sort', query.sort);
+  if (query.descending) params.set('descending', '1');
+  if (query.search) params.set('search', query.search);
+  for (const [column, text] of Object.entries(query.filters ?? {})) {
+    if (text) params.append('filter', `${column}:${text}`);
+  }
+
+  const response = await fetch(`http://localhost:5454/previews/${previewId}/rows?${params}`);
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || 'Failed to load the preview');
+  }
+  return await response.json();
+}
+
+/** The whole previewed result as a file (XLSX, or a ZIP of them, by default). */
+export async function exportPreview(previewId: string, outputFormat = 'xlsx'): Promise<Blob> {
+  const response = await fetch(`http://localhost:5454/previews/${previewId}/export?output_format=${outputFormat}`);
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.error || 'Failed to export the preview');
+  }
+  return await response.blob();
+}
+
+/** Free a preview before it expires. */
+export async function deletePreview(previewId: string): Promise<void> {
+  await fetch(`http://localhost:5454/previews/${previewId}`, { method: 'DELETE' });
+}
+
 /* ── Helpers ─────────────────────────────────── */
 
 function simulateDelay(): Promise<void> {
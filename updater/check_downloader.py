@@ -0,0 +1,167 @@
+"""
+Exercise downloader.py against standin_server.py on a temporary
+directory: a parallel download, a resume after an interruption, a
+checksum mismatch, a server without range support, a delta update and
+manifests with paths leading out of the install.
+
+Run from updater/ (exits with status 1 on the first failure):
+
+    python check_downloader.py --size-mb 20
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+
+from downloader import download, apply_delta, ChecksumError, ManifestError
+from standin_server import serve
+
+class Interrupted(Exception):
+    pass
+
+def start(directory, ranges=True):
+    """Stand-in server for `directory` on a free port, and its base URL."""
+    server = serve(directory, port=0, ranges=ranges, quiet=True)
+    # Interrupted downloads leave broken pipes on the server side
+    server.handle_error = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def check(condition, message):
+    if not condition:
+        raise AssertionError(message)
+
+def check_download(base, data, work):
+    dest = os.path.join(work, 'full.zip')
+    download(f"{base}/asset.zip", dest, sha256(data), parts=4)
+    check(read(dest) == data, "parallel download: content differs")
+    check(not os.path.exists(dest + '.part'), "parallel download: .part left behind")
+
+def check_resume(base, data, work):
+    dest = os.path.join(work, 'resumed.zip')
+
+    def interrupt(done, total):
+        if done >= total // 2:
+            raise Interrupted()
+
+    try:
+        download(f"{base}/asset.zip", dest, sha256(data), parts=4, progress=interrupt, interval=0)
+        raise AssertionError("resume: the first attempt was not interrupted")
+    except Interrupted:
+        pass
+    check(os.path.exists(dest + '.part.json'), "resume: no state kept after the interruption")
+
+    resumed_from = []
+    download(f"{base}/asset.zip", dest, sha256(data), parts=4,
+             progress=lambda done, total: resumed_from.append(done), interval=0)
+    check(read(dest) == data, "resume: content differs")
+    check(resumed_from and resumed_from[0] >= len(data) // 2,
+          f"resume: restarted from {resumed_from[:1]} instead of the bytes already written")
+
+def check_checksum(base, data, work):
+    dest = os.path.join(work, 'corrupt.zip')
+    try:
+        download(f"{base}/asset.zip", dest, '0' * 64, parts=4)
+        raise AssertionError("checksum: no ChecksumError for a wrong digest")
+    except ChecksumError:
+        pass
+    leftovers = [path for path in (dest, dest + '.part', dest + '.part.json') if os.path.exists(path)]
+    check(not leftovers, f"checksum: {leftovers} left behind")
+
+def check_no_ranges(base, data, work):
+    dest = os.path.join(work, 'plain.zip')
+    download(f"{base}/asset.zip", dest, sha256(data), parts=4)
+    check(read(dest) == data, "no ranges: content differs")
+
+def release_manifest(release_dir, files):
+    write(os.path.join(release_dir, 'manifest.json'), json.dumps({'version': 'check', 'files': {
+        path: {'sha256': sha256(content), 'size': len(content)} for path, content in files.items()
+    }}).encode('utf-8'))
+
+def check_delta(base, release_dir, work):
+    files = {
+        'StockSync.exe': b'unchanged executable',
+        'resources/app.asar': b'new application code',
+        'locales/en-US.pak': b'new locale',
+    }
+    for path, content in files.items():
+        write(os.path.join(release_dir, *path.split('/')), content)
+    release_manifest(release_dir, files)
+
+    app_root = os.path.join(work, 'app')
+    write(os.path.join(app_root, 'StockSync.exe'), files['StockSync.exe'])
+    write(os.path.join(app_root, 'resources', 'app.asar'), b'old application code')
+
+    replaced = apply_delta(f"{base}/manifest.json", app_root, os.path.join(work, 'staging'), parts=2)
+    check(sorted(replaced) == ['locales/en-US.pak', 'resources/app.asar'], f"delta: replaced {replaced}")
+    for path, content in files.items():
+        check(read(os.path.join(app_root, *path.split('/'))) == content, f"delta: {path} differs")
+
+def check_unsafe_paths(base, release_dir, work):
+    app_root = os.path.join(work, 'install', 'app')
+    write(os.path.join(app_root, 'StockSync.exe'), b'installed')
+    for unsafe in ['../escape.txt', 'resources/../../escape.txt', '/escape.txt', '..\\escape.txt', 'C:/escape.txt']:
+        release_manifest(release_dir, {unsafe: b'outside', 'StockSync.exe': b'replaced'})
+        try:
+            apply_delta(f"{base}/manifest.json", app_root, os.path.join(work, 'install', 'staging'))
+            raise AssertionError(f"unsafe paths: {unsafe!r} was accepted")
+        except ManifestError:
+            pass
+        check(read(os.path.join(app_root, 'StockSync.exe')) == b'installed',
+              f"unsafe paths: the install was changed by a manifest with {unsafe!r}")
+    check(not os.path.exists(os.path.join(work, 'install', 'escape.txt')), "unsafe paths: a file was written outside the install")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the updater downloads against the stand-in server.")
+    parser.add_argument("--size-mb", type=int, default=20, help="size of the release asset")
+    args = parser.parse_args(argv)
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        release_dir, delta_dir, work = (os.path.join(tmp, name) for name in ('release', 'delta', 'work'))
+        for directory in (release_dir, delta_dir, work):
+            os.makedirs(directory)
+        write(os.path.join(release_dir, 'asset.zip'), data)
+
+        server, base = start(release_dir)
+        plain_server, plain_base = start(release_dir, ranges=False)
+        delta_server, delta_base = start(delta_dir)
+        checks = [
+            ("parallel download", lambda: check_download(base, data, work)),
+            ("resume", lambda: check_resume(base, data, work)),
+            ("checksum mismatch", lambda: check_checksum(base, data, work)),
+            ("no range support", lambda: check_no_ranges(plain_base, data, work)),
+            ("delta update", lambda: check_delta(delta_base, delta_dir, work)),
+            ("unsafe manifest paths", lambda: check_unsafe_paths(delta_base, delta_dir, work)),
+        ]
+        try:
+            for name, run in checks:
+                try:
+                    run()
+                except Exception as e:
+                    print(f"{name}: {type(e).__name__}: {e}", file=sys.stderr)
+                    sys.exit(1)
+                print(f"{name}: ok", file=sys.stderr)
+        finally:
+            for s in (server, plain_server, delta_server):
+                s.shutdown()
+                s.server_close()
+    print("downloader ok")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+HEADERS = {'User-Agent': 'Electron-Updater'}
+CHUNK_SIZE = 1024 * 1024
+# Parts smaller than this are not worth a connection of their own
+MIN_PART_SIZE = 4 * 1024 * 1024
+
+class DownloadError(Exception):
+    pass
+
+class ChecksumError(DownloadError):
+    pass
+
+class ManifestError(DownloadError):
+    pass
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class Throttle:
+    """Calls progress(done, total) at most every `interval` seconds, and always for the last bytes."""
+
+    def __init__(self, progress, total, interval=0.2):
+        self.progress = progress
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if self.progress and (now - self._last >= self.interval or self.done >= self.total):
+                self._last = now
+                self.progress(self.done, self.total)
+
+def probe(url):
+    """
+    Size, validator (ETag or Last-Modified), range support and final URL
+    (after redirects) of a download, from a one-byte range request.
+    """
+    headers = dict(HEADERS, Range='bytes=0-0')
+    with requests.get(url, headers=headers, stream=True, allow_redirects=True, timeout=10) as response:
+        response.raise_for_status()
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        if response.status_code == 206:
+            total = response.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+            return (int(total) if total.isdigit() else None), validator, True, response.url
+        return int(response.headers.get('Content-Length', 0)) or None, validator, False, response.url
+
+def _split(size, parts):
+    parts = max(1, min(parts, size // MIN_PART_SIZE or 1))
+    step = -(-size // parts)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+def _load_state(state_path, url, size, validator):
+    """Parts of an interrupted download of the same file, else None."""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('url') != url or state.get('size') != size or state.get('validator') != validator:
+        return None
+    return state
+
+def download(url, dest, sha256=None, parts=4, progress=None, interval=0.2, chunk_size=CHUNK_SIZE):
+    """
+    Download `url` to `dest` with `parts` parallel range requests.
+
+    Bytes go to `dest`.part at their offset and the completed ranges to
+    `dest`.part.json, so an interrupted download resumes where each part
+    stopped (as long as the server reports the same size and validator).
+    Servers without range support get a single plain request, restarted
+    from zero. With `sha256` the result is verified before it replaces
+    `dest`; a mismatch removes the partial file and raises ChecksumError.
+    `progress(done, total)` is called at most every `interval` seconds.
+    """
+    part_path, state_path = dest + '.part', dest + '.part.json'
+    # Redirect targets (signed asset URLs) change between attempts, the
+    # requested URL identifies the download
+    size, validator, ranges, source = probe(url)
+
+    state = _load_state(state_path, url, size, validator) if size and ranges else None
+    if state is None or not os.path.exists(part_path):
+        state = {'url': url, 'size': size, 'validator': validator,
+                 'parts': _split(size, parts) if size and ranges else [[0, (size or 0) - 1, 0]]}
+        with open(part_path, 'wb') as f:
+            if size:
+                f.truncate(size)
+
+    throttle = Throttle(progress, size or 0, interval)
+    throttle.add(sum(part[2] for part in state['parts']))
+    lock = threading.Lock()
+
+    def save_state():
+        with lock:
+            with open(state_path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(state_path + '.tmp', state_path)
+
+    def fetch(part):
+        start, end, done = part
+        if size and start + done > end:
+            return
+        headers = dict(HEADERS)
+        if size and ranges:
+            headers['Range'] = f'bytes={start + done}-{end}'
+        with requests.get(source, headers=headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if 'Range' in headers and response.status_code != 206:
+                raise DownloadError(f"Server ignored the range request for {url}")
+            # One handle per part, kept open for the whole transfer
+            with open(part_path, 'r+b') as f:
+                f.seek(start + done)
+                last_save = time.monotonic()
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    part[2] += len(chunk)
+                    throttle.add(len(chunk))
+                    if time.monotonic() - last_save > 1:
+                        f.flush()
+                        save_state()
+                        last_save = time.monotonic()
+        save_state()
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(state['parts'])) as executor:
+            for future in [executor.submit(fetch, part) for part in state['parts']]:
+                future.result()
+    except Exception:
+        # Keep what was written so the next attempt resumes
+        if size and ranges:
+            save_state()
+        raise
+
+    if size and os.path.getsize(part_path) != size:
+        raise DownloadError(f"Downloaded {os.path.getsize(part_path)} of {size} bytes from {url}")
+    if sha256 and sha256_file(part_path) != sha256.lower():
+        for path in (part_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise ChecksumError(f"Checksum mismatch for {url}")
+
+    os.replace(part_path, dest)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return dest
+
+# --- Delta updates ---
+# A manifest lists every file of a release with its hash:
+# {"version": "1.2.0", "files": {"resources/app.asar": {"sha256": "...", "size": 123, "url": "..."}}}
+# "url" is optional and relative to the manifest (default: the file path).
+
+def fetch_manifest(manifest_url):
+    response = requests.get(manifest_url, headers=HEADERS, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def manifest_path(root, relative_path):
+    """
+    Local path of a manifest entry under `root`. Absolute paths, drives,
+    backslashes and paths leading out of `root` (through '..') raise
+    ManifestError: the updater runs elevated and must only write inside
+    the install.
+    """
+    if (not relative_path or '\\' in relative_path or ':' in relative_path
+            or relative_path.startswith('/') or os.path.isabs(relative_path)):
+        raise ManifestError(f"Unsafe path in manifest: {relative_path!r}")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, *relative_path.split('/')))
+    if path == root or os.path.commonpath([root, path]) != root:
+        raise ManifestError(f"Unsafe path in manifest: {relative_path!r}")
+    return path
+
+def changed_files(manifest, app_root):
+    """
+    Manifest entries whose local file is missing or has another hash.
+    Every path is checked (see manifest_path) before any file is read.
+    """
+    local_paths = {relative_path: manifest_path(app_root, relative_path) for relative_path in manifest['files']}
+    changed = {}
+    for relative_path, entry in manifest['files'].items():
+        local_path = local_paths[relative_path]
+        if not os.path.isfile(local_path) or sha256_file(local_path) != entry['sha256'].lower():
+            changed[relative_path] = entry
+    return changed
+
+def apply_delta(manifest_url, app_root, staging_dir, parts=4, progress=None, interval=0.2):
+    """
+    Download only the files of the manifest at `manifest_url` that differ
+    from `app_root`, verify them and then replace them. Downloads are
+    staged (and resumable) in `staging_dir`; nothing in `app_root` is
+    touched until every file has arrived intact.
+    Returns the list of replaced paths.
+    """
+    manifest = fetch_manifest(manifest_url)
+    changed = changed_files(manifest, app_root)
+    total = sum(entry.get('size', 0) for entry in changed.values())
+    throttle = Throttle(progress, total, interval)
+
+    staged = {}
+    for relative_path, entry in changed.items():
+        staged_path = manifest_path(staging_dir, relative_path)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        url = urljoin(manifest_url, entry.get('url') or relative_path)
+        before = [0]
+
+        def file_progress(done, file_total, before=before):
+            throttle.add(done - before[0])
+            before[0] = done
+
+        staged[relative_path] = download(url, staged_path, entry['sha256'], parts, file_progress, interval)
+
+    for relative_path, staged_path in staged.items():
+        local_path = manifest_path(app_root, relative_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        os.replace(staged_path, local_path)
+    return list(staged)
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the GitHub release server, to exercise the updater
+without publishing a release.
+
+Serves the files of a directory with HEAD, Range and ETag support, and
+describes them as the assets of the latest release at
+/repos/<owner>/<repo>/releases/latest (with their sha256 digest).
+A manifest.json in the directory makes the updater apply a delta update.
+
+    python standin_server.py ./release --port 8765
+    UPDATER_RELEASE_URL=http://127.0.0.1:8765/repos/mehdii000/inventory-hub/releases/latest python updater.py
+"""
+import os
+import re
+import json
+import hashlib
+import argparse
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+class ReleaseHandler(SimpleHTTPRequestHandler):
+    ranges = True
+
+    def release(self):
+        host = f"http://{self.headers.get('Host')}"
+        assets = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+            assets.append({'name': name, 'size': os.path.getsize(path), 'digest': f'sha256:{digest}',
+                           'browser_download_url': f'{host}/{name}'})
+        return {'tag_name': 'standin', 'assets': assets}
+
+    def send_head(self):
+        if self.path.rstrip('/').endswith('/releases/latest'):
+            body = json.dumps(self.release()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            return _Body(body)
+
+        path = self.translate_path(self.path)
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if not self.ranges or not match or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start > end:
+            self.send_error(416)
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', self.etag(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return _Slice(f, end - start + 1)
+
+    @staticmethod
+    def etag(path):
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+class _Body:
+    """In-memory response body for copyfile()."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        data, self.data = self.data, b''
+        return data
+
+    def close(self):
+        pass
+
+class _Slice:
+    """The `length` bytes of an open file from its current position."""
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+def serve(directory, host='127.0.0.1', port=8765, ranges=True, quiet=False):
+    attributes = {'ranges': ranges}
+    if quiet:
+        attributes['log_message'] = lambda self, format, *args: None
+    handler = type('Handler', (ReleaseHandler,), attributes)
+    return ThreadingHTTPServer((host, port), partial(handler, directory=directory))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a directory as the latest release.")
+    parser.add_argument("directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-ranges", action="store_true", help="ignore Range headers, like servers without resume support")
+    args = parser.parse_args()
+    server = serve(os.path.abspath(args.directory), args.host, args.port, ranges=not args.no_ranges)
+    print(f"Serving {args.directory} on http://{args.host}:{server.server_address[1]}")
+    server.serve_forever()
@@ -6,11 +6,16 @@ import time
 import tkinter as tk
 from tkinter import ttk, messagebox
 from threading import Thread
+from downloader import download, apply_delta, HEADERS
 
 # --- CONFIGURATION ---
 REPO = "mehdii000/inventory-hub"
-GITHUB_URL = f"https://api.github.com/repos/{REPO}/releases/latest"
+# UPDATER_RELEASE_URL points the updater at another server (see standin_server.py)
+GITHUB_URL = os.environ.get("UPDATER_RELEASE_URL", f"https://api.github.com/repos/{REPO}/releases/latest")
 EXE_NAME = "StockSync.exe" 
+DOWNLOAD_PARTS = 4
+# Seconds between two progress redraws
+PROGRESS_INTERVAL = 0.2
 
 class UpdaterApp:
     def __init__(self, root):
@@ -63,47 +68,57 @@ class UpdaterApp:
         self.root.after(5000, self.root.quit) # Auto close after 5 seconds
 
     def update_gui(self, text, status, value=None):
+        # Called from the update thread: Tk is only touched from its own loop
+        self.root.after(0, self._set_gui, text, status, value)
+
+    def _set_gui(self, text, status, value):
         self.label.config(text=text)
         self.status_label.config(text=status)
         if value is not None:
             self.progress['value'] = value
-        self.root.update_idletasks()
+
+    def show_progress(self, text):
+        def progress(done, total):
+            percent = (done / total) * 100 if total else None
+            self.update_gui(text, f"{done // 1048576}MB / {total // 1048576}MB", percent)
+        return progress
 
     def start_update_process(self):
         try:
             # 1. GitHub API Fetch
             self.update_gui("Checking Server", "Connecting to GitHub...")
-            response = requests.get(GITHUB_URL, headers={'User-Agent': 'Electron-Updater'}, timeout=10).json()
-            
-            asset = next(a for a in response['assets'] if a['name'].endswith('.zip'))
-            download_url = asset['browser_download_url']
-            total_size = asset['size']
-            
-            # 2. Stream Download
-            local_zip = "temp_update.zip"
-            with requests.get(download_url, stream=True) as r:
-                r.raise_for_status()
-                downloaded = 0
-                for chunk in r.iter_content(chunk_size=16384):
-                    if chunk:
-                        with open(local_zip, 'ab') as f:
-                            f.write(chunk)
-                        downloaded += len(chunk)
-                        percent = (downloaded / total_size) * 100
-                        self.update_gui("Downloading...", f"{downloaded // 1048576}MB / {total_size // 1048576}MB", percent)
-
-            # 3. Extraction
-            self.update_gui("Installing", "Overwriting files...", 100)
+            response = requests.get(GITHUB_URL, headers=HEADERS, timeout=10).json()
+
             # Electron root is usually 1 level up from 'resources'
             # (AppPath/resources/updater/updater.exe) -> We go up twice
             app_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
-            
-            with zipfile.ZipFile(local_zip, 'r') as zip_ref:
-                zip_ref.extractall(app_root)
+            manifest = next((a for a in response['assets'] if a['name'] == 'manifest.json'), None)
+
+            if manifest:
+                # 2. Delta update: only the files whose hash changed
+                staging_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "update_staging")
+                replaced = apply_delta(manifest['browser_download_url'], app_root, staging_dir, DOWNLOAD_PARTS,
+                                       self.show_progress("Downloading changes..."), PROGRESS_INTERVAL)
+                self.update_gui("Installing", f"{len(replaced)} files updated", 100)
+            else:
+                asset = next(a for a in response['assets'] if a['name'].endswith('.zip'))
+                # GitHub publishes "sha256:<hex>" digests for release assets
+                digest = asset.get('digest') or ''
+                sha256 = digest.split(':', 1)[1] if digest.startswith('sha256:') else None
+
+                # 2. Parallel download, resumed if a previous attempt was interrupted
+                local_zip = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "temp_update.zip")
+                download(asset['browser_download_url'], local_zip, sha256, DOWNLOAD_PARTS,
+                         self.show_progress("Downloading..."), PROGRESS_INTERVAL)
+
+                # 3. Extraction
+                self.update_gui("Installing", "Overwriting files...", 100)
+                with zipfile.ZipFile(local_zip, 'r') as zip_ref:
+                    zip_ref.extractall(app_root)
+                os.remove(local_zip)
 
             # 4. Success
             self.update_gui("Update Complete", "Cleaning up and restarting...")
-            os.remove(local_zip)
             time.sleep(2)
 
             # Restart
@@ -111,11 +126,14 @@ class UpdaterApp:
             if os.path.exists(exe_path):
                 os.startfile(exe_path)
             
-            self.root.quit()
+            self.root.after(0, self.root.quit)
 
         except Exception as e:
-            messagebox.showerror("Update Error", f"An error occurred: {str(e)}")
-            self.root.quit()
+            self.root.after(0, self.show_error, str(e))
+
+    def show_error(self, message):
+        messagebox.showerror("Update Error", f"An error occurred: {message}")
+        self.root.quit()
 
 if __name__ == "__main__":
     root = tk.Tk()